@@ -6,7 +6,6 @@ Create Date: 2025-12-07
 """
 from alembic import op
 import sqlalchemy as sa
-from sqlmodel import SQLModel
 
 # revision identifiers, used by Alembic.
 revision = '0001_create_tables'
@@ -16,13 +15,52 @@ depends_on = None
 
 
 def upgrade():
-    bind = op.get_bind()
-    # create all tables using SQLModel metadata
-    from app import models
-    SQLModel.metadata.create_all(bind=bind)
+    # Tables are spelled out rather than created from SQLModel.metadata so that
+    # later revisions can add tables/columns without this one creating them first.
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('full_name', sa.String(), nullable=True),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.Column('role', sa.String(), nullable=False),
+    )
+    op.create_index('ix_user_username', 'user', ['username'])
+    op.create_table(
+        'machine',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('code', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('last_heartbeat', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_machine_code', 'machine', ['code'])
+    op.create_table(
+        'order',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('order_number', sa.String(), nullable=False),
+        sa.Column('product', sa.String(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('priority', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_order_order_number', 'order', ['order_number'])
+    op.create_table(
+        'event',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('ts', sa.DateTime(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('payload', sa.String(), nullable=True),
+    )
 
 
 def downgrade():
-    bind = op.get_bind()
-    from app import models
-    SQLModel.metadata.drop_all(bind=bind)
+    op.drop_table('event')
+    op.drop_index('ix_order_order_number', table_name='order')
+    op.drop_table('order')
+    op.drop_index('ix_machine_code', table_name='machine')
+    op.drop_table('machine')
+    op.drop_index('ix_user_username', table_name='user')
+    op.drop_table('user')
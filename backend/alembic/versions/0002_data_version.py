@@ -0,0 +1,27 @@
+"""data version counters for conditional GET
+
+Revision ID: 0002_data_version
+Revises: 0001_create_tables
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0002_data_version'
+down_revision = '0001_create_tables'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table = op.create_table(
+        'dataversion',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+    )
+    op.bulk_insert(table, [{'name': 'orders', 'version': 1}, {'name': 'machines', 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('dataversion')
@@ -0,0 +1,93 @@
+"""cycle-time quantile sketches
+
+Revision ID: 0004_cycle_time_sketch
+Revises: 0003_production_rollup
+Create Date: 2026-10-19
+"""
+import json
+import math
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004_cycle_time_sketch'
+down_revision = '0003_production_rollup'
+branch_labels = None
+depends_on = None
+
+# frozen copy of the sketch format as of this revision (app.sketches.DDSketch); migrations do not import app code
+RELATIVE_ACCURACY = float(os.getenv('SKETCH_RELATIVE_ACCURACY', '0.01'))
+MAX_BINS = int(os.getenv('SKETCH_MAX_BINS', '2048'))
+LOG_GAMMA = math.log((1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY))
+MIN_VALUE = 1e-9
+
+
+def cycle_time_ms(payload):
+    try:
+        payload = json.loads(payload) if payload else None
+        value = payload.get('cycle_time_ms') or payload.get('ideal_cycle_time_ms') if isinstance(payload, dict) else None
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def sketch_row(source, hour, values):
+    bins = {}
+    zero = 0.0
+    for value in values:
+        if value <= MIN_VALUE:
+            zero += 1
+            continue
+        k = math.ceil(math.log(value) / LOG_GAMMA)
+        bins[k] = bins.get(k, 0.0) + 1
+        if len(bins) > MAX_BINS:
+            keys = sorted(bins)
+            target = keys[len(keys) - MAX_BINS]
+            bins[target] += sum(bins.pop(k) for k in keys[:len(keys) - MAX_BINS])
+    sketch = {'a': RELATIVE_ACCURACY, 'bins': {str(k): c for k, c in bins.items()}, 'zero': zero,
+              'n': float(len(values)), 'min': min(values), 'max': max(values)}
+    return {'source': source, 'hour': hour, 'count': len(values), 'sketch': json.dumps(sketch)}
+
+
+def upgrade():
+    table = op.create_table(
+        'cycletimesketch',
+        sa.Column('source', sa.String(), primary_key=True),
+        sa.Column('hour', sa.DateTime(), primary_key=True),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('sketch', sa.String(), nullable=False),
+    )
+
+    # one sketch per (source, hour) of the existing production events, built a key at a time
+    conn = op.get_bind()
+    event = sa.table('event', sa.column('ts', sa.DateTime()), sa.column('source'), sa.column('type'),
+                     sa.column('payload'))
+    rows = conn.execution_options(yield_per=10000).execute(
+        sa.select(event.c.source, event.c.ts, event.c.payload)
+        .where(event.c.type == 'production').order_by(event.c.source, event.c.ts))
+    pending = []
+    key = None
+    values = []
+    for source, ts, payload in rows:
+        value = cycle_time_ms(payload)
+        if value is None:
+            continue
+        hour = ts.replace(minute=0, second=0, microsecond=0)
+        if (source, hour) != key:
+            if values:
+                pending.append(sketch_row(*key, values))
+            key, values = (source, hour), []
+        values.append(value)
+        if len(pending) >= 1000:
+            op.bulk_insert(table, pending)
+            pending = []
+    if values:
+        pending.append(sketch_row(*key, values))
+    if pending:
+        op.bulk_insert(table, pending)
+
+
+def downgrade():
+    op.drop_table('cycletimesketch')
@@ -0,0 +1,37 @@
+"""anomaly alerts
+
+Revision ID: 0005_alert
+Revises: 0004_cycle_time_sketch
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0005_alert'
+down_revision = '0004_cycle_time_sketch'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'alert',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('ts', sa.DateTime(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('value', sa.Float(), nullable=False),
+        sa.Column('baseline_mean', sa.Float(), nullable=False),
+        sa.Column('baseline_std', sa.Float(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.Column('acknowledged', sa.Boolean(), nullable=False),
+    )
+    op.create_index('ix_alert_ts', 'alert', ['ts'])
+    op.create_index('ix_alert_source', 'alert', ['source'])
+
+
+def downgrade():
+    op.drop_index('ix_alert_source', table_name='alert')
+    op.drop_index('ix_alert_ts', table_name='alert')
+    op.drop_table('alert')
@@ -0,0 +1,37 @@
+"""gateway api keys
+
+Revision ID: 0006_gateway_key
+Revises: 0005_alert
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006_gateway_key'
+down_revision = '0005_alert'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'gatewaykey',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('prefix', sa.String(), nullable=False),
+        sa.Column('key_hash', sa.String(), nullable=False),
+        sa.Column('sources', sa.String(), nullable=False),
+        sa.Column('active', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_gatewaykey_prefix', 'gatewaykey', ['prefix'])
+    op.create_index('ix_gatewaykey_key_hash', 'gatewaykey', ['key_hash'], unique=True)
+    op.execute("INSERT INTO dataversion (name, version) VALUES ('gateway_keys', 1)")
+
+
+def downgrade():
+    op.execute("DELETE FROM dataversion WHERE name = 'gateway_keys'")
+    op.drop_index('ix_gatewaykey_key_hash', table_name='gatewaykey')
+    op.drop_index('ix_gatewaykey_prefix', table_name='gatewaykey')
+    op.drop_table('gatewaykey')
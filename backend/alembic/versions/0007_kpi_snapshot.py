@@ -0,0 +1,52 @@
+"""kpi snapshots
+
+Revision ID: 0007_kpi_snapshot
+Revises: 0006_gateway_key
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0007_kpi_snapshot'
+down_revision = '0006_gateway_key'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'kpisnapshot',
+        sa.Column('granularity', sa.String(), primary_key=True),
+        sa.Column('source', sa.String(), primary_key=True),
+        sa.Column('bucket', sa.DateTime(), primary_key=True),
+        sa.Column('planned_seconds', sa.Float(), nullable=False),
+        sa.Column('downtime_seconds', sa.Float(), nullable=False),
+        sa.Column('run_seconds', sa.Float(), nullable=False),
+        sa.Column('produced', sa.Integer(), nullable=False),
+        sa.Column('good', sa.Integer(), nullable=False),
+        sa.Column('ict_sum_ms', sa.Float(), nullable=False),
+        sa.Column('ict_count', sa.Integer(), nullable=False),
+        sa.Column('availability', sa.Float(), nullable=False),
+        sa.Column('performance', sa.Float(), nullable=False),
+        sa.Column('quality', sa.Float(), nullable=False),
+        sa.Column('oee', sa.Float(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_kpisnapshot_granularity_bucket', 'kpisnapshot', ['granularity', 'bucket'])
+    op.create_table(
+        'kpiwatermark',
+        sa.Column('granularity', sa.String(), primary_key=True),
+        sa.Column('watermark', sa.DateTime(), nullable=False),
+    )
+    # downtime events are read by type and time range
+    op.create_index('ix_event_type_ts', 'event', ['type', 'ts'])
+    op.execute("INSERT INTO dataversion (name, version) VALUES ('kpi', 1)")
+
+
+def downgrade():
+    op.execute("DELETE FROM dataversion WHERE name = 'kpi'")
+    op.drop_index('ix_event_type_ts', table_name='event')
+    op.drop_table('kpiwatermark')
+    op.drop_index('ix_kpisnapshot_granularity_bucket', table_name='kpisnapshot')
+    op.drop_table('kpisnapshot')
@@ -0,0 +1,58 @@
+"""event machine id
+
+Revision ID: 0008_event_machine_id
+Revises: 0007_kpi_snapshot
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0008_event_machine_id'
+down_revision = '0007_kpi_snapshot'
+branch_labels = None
+depends_on = None
+
+BATCH = 10000
+
+
+def upgrade():
+    with op.batch_alter_table('event') as batch:
+        batch.add_column(sa.Column('machine_id', sa.Integer(), nullable=True))
+        batch.create_foreign_key('fk_event_machine_id', 'machine', ['machine_id'], ['id'], ondelete='SET NULL')
+
+    conn = op.get_bind()
+    # every source without a machine becomes one (name = code = source), as ingest does
+    conn.execute(sa.text(
+        "INSERT INTO machine (name, code, status) "
+        "SELECT DISTINCT e.source, e.source, 'idle' FROM event e "
+        "WHERE NOT EXISTS (SELECT 1 FROM machine m WHERE m.code = e.source OR m.name = e.source)"
+    ))
+    machines = conn.execute(sa.text("SELECT id, name, code FROM machine ORDER BY id")).all()
+    ids = {}
+    for mid, name, _ in machines:
+        ids.setdefault(name, mid)
+    for mid, _, code in machines:
+        if code:
+            ids[code] = mid
+    sources = [row[0] for row in conn.execute(sa.text("SELECT DISTINCT source FROM event"))]
+
+    # backfill in bounded batches, committing each outside the migration transaction
+    with op.get_context().autocommit_block():
+        for source in sources:
+            while True:
+                count = conn.execute(sa.text(
+                    "UPDATE event SET machine_id = :mid WHERE id IN "
+                    "(SELECT id FROM event WHERE source = :source AND machine_id IS NULL LIMIT :n)"
+                ), {'mid': ids[source], 'source': source, 'n': BATCH}).rowcount
+                if count < BATCH:
+                    break
+    op.create_index('ix_event_machine_id_ts', 'event', ['machine_id', 'ts'])
+    conn.execute(sa.text("UPDATE dataversion SET version = version + 1 WHERE name = 'machines'"))
+
+
+def downgrade():
+    op.drop_index('ix_event_machine_id_ts', table_name='event')
+    with op.batch_alter_table('event') as batch:
+        batch.drop_constraint('fk_event_machine_id', type_='foreignkey')
+        batch.drop_column('machine_id')
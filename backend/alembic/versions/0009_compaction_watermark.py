@@ -0,0 +1,26 @@
+"""compaction watermark
+
+Revision ID: 0009_compaction_watermark
+Revises: 0008_event_machine_id
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0009_compaction_watermark'
+down_revision = '0008_event_machine_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'compactionwatermark',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('watermark', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('compactionwatermark')
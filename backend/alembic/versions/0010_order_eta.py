@@ -0,0 +1,39 @@
+"""order eta
+
+Revision ID: 0010_order_eta
+Revises: 0009_compaction_watermark
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0010_order_eta'
+down_revision = '0009_compaction_watermark'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('order') as batch:
+        batch.add_column(sa.Column('machine_id', sa.Integer(), nullable=True))
+        batch.add_column(sa.Column('started_at', sa.DateTime(), nullable=True))
+        batch.add_column(sa.Column('progress', sa.Integer(), nullable=False, server_default='0'))
+        batch.add_column(sa.Column('eta', sa.DateTime(), nullable=True))
+        batch.create_foreign_key('fk_order_machine_id', 'machine', ['machine_id'], ['id'], ondelete='SET NULL')
+    op.create_table(
+        'machinethroughput',
+        sa.Column('machine_id', sa.Integer(), sa.ForeignKey('machine.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('rate', sa.Float(), nullable=True),
+        sa.Column('last_ts', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('machinethroughput')
+    with op.batch_alter_table('order') as batch:
+        batch.drop_constraint('fk_order_machine_id', type_='foreignkey')
+        batch.drop_column('eta')
+        batch.drop_column('progress')
+        batch.drop_column('started_at')
+        batch.drop_column('machine_id')
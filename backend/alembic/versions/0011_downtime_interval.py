@@ -0,0 +1,67 @@
+"""downtime intervals
+
+Revision ID: 0011_downtime_interval
+Revises: 0010_order_eta
+Create Date: 2026-10-19
+"""
+import json
+from datetime import timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0011_downtime_interval'
+down_revision = '0010_order_eta'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table = op.create_table(
+        'downtimeinterval',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('machine_id', sa.Integer(), sa.ForeignKey('machine.id', ondelete='SET NULL'), nullable=True),
+        sa.Column('start', sa.DateTime(), nullable=False),
+        sa.Column('end', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_downtimeinterval_source_start', 'downtimeinterval', ['source', 'start'])
+    op.create_index('ix_downtimeinterval_end', 'downtimeinterval', ['end'])
+
+    # merge the existing downtime events of each source, in time order, into disjoint intervals
+    conn = op.get_bind()
+    event = sa.table('event', sa.column('source'), sa.column('machine_id'), sa.column('ts', sa.DateTime()),
+                     sa.column('type'), sa.column('payload'))
+    rows = conn.execution_options(yield_per=10000).execute(
+        sa.select(event.c.source, event.c.machine_id, event.c.ts, event.c.payload)
+        .where(event.c.type == 'downtime').order_by(event.c.source, event.c.ts))
+    pending = []
+    current = None
+    for source, machine_id, ts, payload in rows:
+        try:
+            seconds = float((json.loads(payload) if payload else {}).get('duration_seconds', 0))
+        except (ValueError, TypeError, AttributeError):
+            continue
+        if seconds <= 0:
+            continue
+        end = ts + timedelta(seconds=seconds)
+        if current is not None and current['source'] == source and ts <= current['end']:
+            current['end'] = max(current['end'], end)
+            continue
+        if current is not None:
+            pending.append(current)
+        current = {'source': source, 'machine_id': machine_id, 'start': ts, 'end': end}
+        if len(pending) >= 10000:
+            op.bulk_insert(table, pending)
+            pending = []
+    if current is not None:
+        pending.append(current)
+    if pending:
+        op.bulk_insert(table, pending)
+
+
+def downgrade():
+    op.drop_index('ix_downtimeinterval_end', table_name='downtimeinterval')
+    op.drop_index('ix_downtimeinterval_source_start', table_name='downtimeinterval')
+    op.drop_table('downtimeinterval')
@@ -0,0 +1,222 @@
+"""event drop source
+
+Revision ID: 0012_event_drop_source
+Revises: 0011_downtime_interval
+Create Date: 2026-10-19
+"""
+import json
+import math
+import os
+from datetime import timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0012_event_drop_source'
+down_revision = '0011_downtime_interval'
+branch_labels = None
+depends_on = None
+
+BATCH = 10000
+# frozen sketch settings as of this revision (see 0004)
+SKETCH_MAX_BINS = int(os.getenv('SKETCH_MAX_BINS', '2048'))
+
+ROLLUP = sa.table('productionrollup', sa.column('resolution'), sa.column('bucket', sa.DateTime()), sa.column('source'),
+                  sa.column('produced'), sa.column('good'), sa.column('ict_sum_ms'), sa.column('ict_count'),
+                  sa.column('events'))
+SKETCH = sa.table('cycletimesketch', sa.column('source'), sa.column('hour', sa.DateTime()), sa.column('count'),
+                  sa.column('sketch'))
+KPI = sa.table('kpisnapshot', sa.column('granularity'), sa.column('source'), sa.column('bucket', sa.DateTime()),
+               sa.column('planned_seconds'), sa.column('downtime_seconds'), sa.column('run_seconds'),
+               sa.column('produced'), sa.column('good'), sa.column('ict_sum_ms'), sa.column('ict_count'),
+               sa.column('availability'), sa.column('performance'), sa.column('quality'), sa.column('oee'))
+INTERVAL = sa.table('downtimeinterval', sa.column('id'), sa.column('source'), sa.column('machine_id'),
+                    sa.column('start', sa.DateTime()), sa.column('end', sa.DateTime()))
+ALERT = sa.table('alert', sa.column('source'))
+
+
+def machine_ids(conn):
+    """source string -> machine id (codes win over names) and machine id -> label (code, else name)."""
+    machines = conn.execute(sa.text("SELECT id, name, code FROM machine ORDER BY id")).all()
+    ids = {}
+    for mid, name, _ in machines:
+        ids.setdefault(name, mid)
+    for mid, _, code in machines:
+        if code:
+            ids[code] = mid
+    return ids, {mid: code or name for mid, name, code in machines}
+
+
+def renames(conn, table, ids, labels):
+    """(raw, label, machine id) for every source spelling in `table` that is not its machine's label."""
+    out = []
+    for (raw,) in conn.execute(sa.select(table.c.source).distinct()):
+        mid = ids.get(raw)
+        if mid is not None and labels[mid] != raw:
+            out.append((raw, labels[mid], mid))
+    return out
+
+
+def merge_into_label(conn, table, keys, raw, label, combine):
+    """Fold rows of `raw` into the `label` row with the same keys, then rename the remaining `raw` rows."""
+    r = table.alias('r')
+    lbl = table.alias('l')
+    stmt = sa.select(r, lbl).select_from(r.join(lbl, sa.and_(
+        lbl.c.source == label, *[lbl.c[k] == r.c[k] for k in keys]))).where(r.c.source == raw)
+    width = len(table.c)
+    for row in conn.execute(stmt).all():
+        raw_row = dict(zip(table.c.keys(), row[:width]))
+        label_row = dict(zip(table.c.keys(), row[width:]))
+        where = [table.c[k] == label_row[k] for k in keys]
+        conn.execute(table.update().where(table.c.source == label, *where).values(combine(raw_row, label_row)))
+        conn.execute(table.delete().where(table.c.source == raw, *where))
+    conn.execute(table.update().where(table.c.source == raw).values(source=label))
+
+
+def add_rollups(raw, lbl):
+    return {c: raw[c] + lbl[c] for c in ('produced', 'good', 'ict_sum_ms', 'ict_count', 'events')}
+
+
+def add_sketches(raw, lbl):
+    a, b = json.loads(raw['sketch'] or 'null'), json.loads(lbl['sketch'] or 'null')
+    if not a or not a['n']:
+        return {}
+    if not b or not b['n']:
+        return {'sketch': raw['sketch'], 'count': raw['count']}
+    bins = dict(b['bins'])
+    for k, c in a['bins'].items():
+        bins[k] = bins.get(k, 0.0) + c
+    keys = sorted(bins, key=int)
+    if len(keys) > SKETCH_MAX_BINS:
+        excess = len(keys) - SKETCH_MAX_BINS
+        bins[keys[excess]] += sum(bins.pop(k) for k in keys[:excess])
+    merged = {'a': b['a'], 'bins': bins, 'zero': a['zero'] + b['zero'], 'n': a['n'] + b['n'],
+              'min': min(a['min'], b['min']), 'max': max(a['max'], b['max'])}
+    return {'sketch': json.dumps(merged), 'count': int(merged['n'])}
+
+
+def oee_metrics(planned, downtime, produced, good, ict_sum_seconds, ict_count):
+    # frozen copy of app.kpi.oee_metrics
+    run = max(0.0, planned - downtime)
+    availability = run / planned if planned > 0 else 0.0
+    if produced > 0 and run > 0:
+        avg_ict = ict_sum_seconds / ict_count if ict_count > 0 else 0.0
+        performance = produced * avg_ict / run if avg_ict > 0 else 1.0
+    else:
+        performance = 0.0
+    quality = good / produced if produced > 0 else 0.0
+    return {'run_seconds': run, 'availability': availability, 'performance': performance, 'quality': quality,
+            'oee': availability * performance * quality}
+
+
+def add_snapshots(conn, label):
+    def combine(raw, lbl):
+        out = {c: raw[c] + lbl[c] for c in ('produced', 'good', 'ict_sum_ms', 'ict_count')}
+        # downtime from the (already merged) intervals of the machine, so overlapping stops count once
+        lo = lbl['bucket']
+        hi = lo + timedelta(seconds=lbl['planned_seconds'])
+        rows = conn.execute(sa.select(INTERVAL.c.start, INTERVAL.c.end).where(
+            INTERVAL.c.source == label, INTERVAL.c.end > lo, INTERVAL.c.start < hi))
+        out['downtime_seconds'] = sum((min(end, hi) - max(start, lo)).total_seconds() for start, end in rows)
+        out.update(oee_metrics(lbl['planned_seconds'], out['downtime_seconds'], out['produced'], out['good'],
+                               out['ict_sum_ms'] / 1000.0, out['ict_count']))
+        return out
+    return combine
+
+
+def merge_intervals(conn, sources, label, mid):
+    rows = conn.execute(sa.select(INTERVAL.c.start, INTERVAL.c.end).where(
+        INTERVAL.c.source.in_(sources)).order_by(INTERVAL.c.start)).all()
+    merged = []
+    for start, end in rows:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    conn.execute(INTERVAL.delete().where(INTERVAL.c.source.in_(sources)))
+    if merged:
+        op.bulk_insert(INTERVAL, [{'source': label, 'machine_id': mid, 'start': start, 'end': end}
+                                  for start, end in merged])
+
+
+def rekey_derived(conn):
+    """Key the derived tables by machine label, merging rows of the spellings a gateway sent."""
+    ids, labels = machine_ids(conn)
+    by_label = {}
+    for raw, label, mid in renames(conn, INTERVAL, ids, labels):
+        by_label.setdefault((label, mid), [label]).append(raw)
+    for (label, mid), sources in by_label.items():
+        merge_intervals(conn, sources, label, mid)
+    for raw, label, _ in renames(conn, ROLLUP, ids, labels):
+        merge_into_label(conn, ROLLUP, ('resolution', 'bucket'), raw, label, add_rollups)
+    for raw, label, _ in renames(conn, SKETCH, ids, labels):
+        merge_into_label(conn, SKETCH, ('hour',), raw, label, add_sketches)
+    for raw, label, _ in renames(conn, KPI, ids, labels):
+        merge_into_label(conn, KPI, ('granularity', 'bucket'), raw, label, add_snapshots(conn, label))
+    for raw, label, _ in renames(conn, ALERT, ids, labels):
+        conn.execute(ALERT.update().where(ALERT.c.source == raw).values(source=label))
+
+
+def upgrade():
+    with op.batch_alter_table('machine') as batch:
+        batch.add_column(sa.Column('auto_registered', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+    conn = op.get_bind()
+    # events stored without a machine since 0008 (AUTO_REGISTER_SOURCES off) get one, as ingest would
+    pending = [row[0] for row in conn.execute(sa.text("SELECT DISTINCT source FROM event WHERE machine_id IS NULL"))]
+    if pending:
+        conn.execute(sa.text(
+            "INSERT INTO machine (name, code, status, auto_registered) "
+            "SELECT DISTINCT e.source, e.source, 'idle', :auto FROM event e WHERE e.machine_id IS NULL "
+            "AND NOT EXISTS (SELECT 1 FROM machine m WHERE m.code = e.source OR m.name = e.source)"
+        ), {'auto': True})
+        machines = conn.execute(sa.text("SELECT id, name, code FROM machine ORDER BY id")).all()
+        ids = {}
+        for mid, name, _ in machines:
+            ids.setdefault(name, mid)
+        for mid, _, code in machines:
+            if code:
+                ids[code] = mid
+        with op.get_context().autocommit_block():
+            for source in pending:
+                while True:
+                    count = conn.execute(sa.text(
+                        "UPDATE event SET machine_id = :mid WHERE id IN "
+                        "(SELECT id FROM event WHERE source = :source AND machine_id IS NULL LIMIT :n)"
+                    ), {'mid': ids[source], 'source': source, 'n': BATCH}).rowcount
+                    if count < BATCH:
+                        break
+
+    # machines 0008 (or ingest since) created for unknown sources look like name = code = source; flag
+    # those that nobody has touched since: no heartbeat, no orders, and data recorded under that code
+    conn.execute(sa.text(
+        "UPDATE machine SET auto_registered = :auto WHERE code = name AND last_heartbeat IS NULL "
+        "AND NOT EXISTS (SELECT 1 FROM \"order\" o WHERE o.machine_id = machine.id) "
+        "AND (EXISTS (SELECT 1 FROM event e WHERE e.machine_id = machine.id) "
+        "OR EXISTS (SELECT 1 FROM productionrollup r WHERE r.source = machine.code))"
+    ), {'auto': True})
+    rekey_derived(conn)
+
+    with op.batch_alter_table('event') as batch:
+        batch.drop_constraint('fk_event_machine_id', type_='foreignkey')
+        batch.drop_column('source')
+        batch.alter_column('machine_id', existing_type=sa.Integer(), nullable=False)
+        batch.create_foreign_key('fk_event_machine_id', 'machine', ['machine_id'], ['id'], ondelete='RESTRICT')
+    conn.execute(sa.text(
+        "UPDATE dataversion SET version = version + 1 WHERE name IN ('machines', 'events', 'kpi')"))
+
+
+def downgrade():
+    with op.batch_alter_table('event') as batch:
+        batch.add_column(sa.Column('source', sa.String(), nullable=True))
+    op.execute(sa.text(
+        "UPDATE event SET source = (SELECT COALESCE(m.code, m.name) FROM machine m WHERE m.id = event.machine_id)"
+    ))
+    with op.batch_alter_table('event') as batch:
+        batch.drop_constraint('fk_event_machine_id', type_='foreignkey')
+        batch.alter_column('source', existing_type=sa.String(), nullable=False)
+        batch.alter_column('machine_id', existing_type=sa.Integer(), nullable=True)
+        batch.create_foreign_key('fk_event_machine_id', 'machine', ['machine_id'], ['id'], ondelete='SET NULL')
+    with op.batch_alter_table('machine') as batch:
+        batch.drop_column('auto_registered')
@@ -0,0 +1,114 @@
+"""Streaming anomaly detection for incoming events.
+
+Every ingested event updates an exponentially weighted mean/variance per
+(source, metric) in memory - O(1) work and memory per event - and is
+flagged when it deviates by more than ANOMALY_Z_THRESHOLD standard
+deviations in the bad direction:
+
+- ``yield``: good/produced of a production event (drops are anomalous)
+- ``downtime``: duration_seconds of a downtime event (spikes are anomalous)
+
+Flags are written to the `Alert` table in the ingest transaction. State is
+per worker process and starts cold after a restart; the first
+ANOMALY_WARMUP events of each series only train the baseline.
+"""
+import json
+import math
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import insert
+
+from .core.config import settings
+from .models import Alert
+
+# metric -> +1 when high values are bad, -1 when low values are bad
+DIRECTIONS = {'yield': -1, 'downtime': 1}
+
+
+class EWStats:
+    __slots__ = ('mean', 'var', 'n')
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.n = 0
+
+    def score(self, value: float) -> float:
+        """z-score of `value` against the current baseline (0 while warming up)."""
+        if self.n < settings.ANOMALY_WARMUP:
+            return 0.0
+        std = math.sqrt(self.var)
+        # floor the deviation so perfectly steady series don't flag tiny wobbles
+        return (value - self.mean) / max(std, settings.ANOMALY_MIN_STD * max(abs(self.mean), 1e-9))
+
+    def update(self, value: float) -> None:
+        self.n += 1
+        if self.n == 1:
+            self.mean = value
+            return
+        alpha = settings.ANOMALY_ALPHA
+        diff = value - self.mean
+        incr = alpha * diff
+        self.mean += incr
+        self.var = (1 - alpha) * (self.var + diff * incr)
+
+
+_stats: Dict[Tuple[str, str], EWStats] = {}
+_lock = threading.Lock()
+
+
+def observations(row: dict) -> List[Tuple[str, float]]:
+    payload = row['payload']
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except Exception:
+            return []
+    if not payload:
+        return []
+    try:
+        if row['type'] == 'production':
+            produced = int(payload.get('produced', 0))
+            if produced > 0:
+                return [('yield', int(payload.get('good', 0)) / produced)]
+        elif row['type'] == 'downtime':
+            return [('downtime', float(payload.get('duration_seconds', 0)))]
+    except (TypeError, ValueError):
+        pass
+    return []
+
+
+def detect(rows: Iterable[dict]) -> List[dict]:
+    """Update the baselines with `rows` and return alert rows for anomalous events."""
+    alerts = []
+    threshold = settings.ANOMALY_Z_THRESHOLD
+    with _lock:
+        for row in rows:
+            for metric, value in observations(row):
+                key = (row['source'], metric)
+                stats = _stats.get(key)
+                if stats is None:
+                    stats = _stats[key] = EWStats()
+                z = stats.score(value) * DIRECTIONS[metric]
+                if z > threshold:
+                    alerts.append({
+                        'ts': row['ts'], 'source': row['source'], 'kind': metric, 'value': value,
+                        'baseline_mean': stats.mean, 'baseline_std': math.sqrt(stats.var), 'score': z,
+                    })
+                stats.update(value)
+    return alerts
+
+
+def apply(session, rows: Iterable[dict]) -> None:
+    """Run detection on an ingest batch and stage alerts in the caller's transaction."""
+    if not settings.ANOMALY_DETECTION:
+        return
+    alerts = detect(rows)
+    if alerts:
+        session.execute(insert(Alert), alerts)
+
+
+def reset() -> None:
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,112 @@
+"""API-key credentials for machine gateways.
+
+Keys look like ``gw_<prefix>_<secret>`` and are stored only as
+HMAC-SHA256(API_KEY_SECRET, key) - a keyed hash is enough for random
+high-entropy secrets and costs microseconds, unlike argon2. Active keys are
+held in an in-memory index (hash -> principal), so verifying a request needs
+no database round-trip. Writers bump the ``gateway_keys`` data version; each
+worker re-reads the key table when it sees a new version, checking at most
+every API_KEY_REFRESH_SECONDS.
+"""
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlmodel import Session, select
+
+from .caching import get_version
+from .core.config import settings
+from .models import GatewayKey
+from .sources import directory
+
+VERSION_NAME = 'gateway_keys'
+
+
+class GatewayPrincipal:
+    """Authenticated gateway; `sources` is None when the key may post for any source."""
+    __slots__ = ('id', 'name', 'sources')
+    role = 'gateway'
+
+    def __init__(self, id: int, name: str, sources: Optional[FrozenSet[str]]):
+        self.id = id
+        self.name = name
+        self.sources = sources
+
+
+def hash_key(key: str) -> str:
+    secret = (settings.API_KEY_SECRET or settings.SECRET_KEY).encode()
+    return hmac.new(secret, key.encode(), hashlib.sha256).hexdigest()
+
+
+def generate_key() -> Tuple[str, str, str]:
+    """Return (plaintext key, prefix, hash); only the last two are stored."""
+    prefix = secrets.token_hex(4)
+    key = f"gw_{prefix}_{secrets.token_urlsafe(24)}"
+    return key, prefix, hash_key(key)
+
+
+def parse_sources(text: Optional[str]) -> Optional[FrozenSet[str]]:
+    if not text or text == '*':
+        return None
+    return frozenset(s for s in text.split(',') if s)
+
+
+class KeyIndex:
+    def __init__(self):
+        self._by_hash: Dict[str, GatewayPrincipal] = {}
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        self._checked = 0.0
+        self._version = None
+
+    def _refresh(self, session: Session) -> None:
+        now = time.monotonic()
+        if now - self._checked < settings.API_KEY_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if now - self._checked < settings.API_KEY_REFRESH_SECONDS:
+                return
+            version = get_version(session, VERSION_NAME)
+            if version != self._version:
+                rows = session.exec(select(GatewayKey).where(GatewayKey.active == True)).all()  # noqa: E712
+                self._by_hash = {k.key_hash: GatewayPrincipal(k.id, k.name, parse_sources(k.sources)) for k in rows}
+                self._version = version
+            self._checked = now
+
+    def lookup(self, session: Session, key: str) -> Optional[GatewayPrincipal]:
+        self._refresh(session)
+        return self._by_hash.get(hash_key(key))
+
+    def cached(self, key: str) -> Optional[GatewayPrincipal]:
+        """Like `lookup`, against the keys already loaded, without touching the database."""
+        return self._by_hash.get(hash_key(key))
+
+
+index = KeyIndex()
+
+
+def allows(principal, source: str) -> bool:
+    """Whether a key may post for `source`; spellings of the same machine (code or name) count as one."""
+    allowed = getattr(principal, 'sources', None)
+    if allowed is None or source in allowed:
+        return True
+    mid = directory.known(source)
+    return mid is not None and any(directory.known(a) == mid for a in allowed)
+
+
+def check_sources(principal, sources: Iterable[str], session: Optional[Session] = None) -> None:
+    """Reject a batch containing sources outside a gateway key's scope."""
+    if getattr(principal, 'sources', None) is None:
+        return
+    if session is not None:
+        directory.labels(session)  # refresh the directory if machines changed
+    denied = {s for s in sources if not allows(principal, s)}
+    if denied:
+        raise HTTPException(status_code=403, detail=f"Key not allowed for sources: {', '.join(sorted(denied))}")
@@ -1,36 +1,46 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
 
-from passlib.context import CryptContext
-from jose import jwt
-from fastapi import HTTPException, status, Depends
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import HTTPException, status, Depends, Request
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 
 from .core.config import settings
 from .models import User
 from .db import get_session
+from . import api_keys
 from sqlmodel import select
 
-# Use argon2 as primary (handles long passwords), with bcrypt as fallback
-pwd_context = CryptContext(
-    schemes=["argon2", "bcrypt"],
-    deprecated="auto",
-    argon2__memory_cost=65536,
-    argon2__time_cost=3,
-    argon2__parallelism=2
-)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+
+# passlib (argon2 backend) and jose are imported on first use to keep worker startup fast
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+
+    # Use argon2 as primary (handles long passwords), with bcrypt as fallback
+    return CryptContext(
+        schemes=["argon2", "bcrypt"],
+        deprecated="auto",
+        argon2__memory_cost=65536,
+        argon2__time_cost=3,
+        argon2__parallelism=2
+    )
 
 
 def verify_password(plain, hashed):
-    return pwd_context.verify(plain, hashed)
+    return get_pwd_context().verify(plain, hashed)
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
@@ -52,8 +62,12 @@ def authenticate_user(session, username: str, password: str):
     return user
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session=Depends(get_session)):
-    from jose import JWTError
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), session=Depends(get_session)):
+    # sub-requests of POST /batch arrive with the batch's user already authenticated
+    user = request.scope.get('state', {}).get('user')
+    if user is not None:
+        return user
+    from jose import JWTError, jwt
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -71,3 +85,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session=Depends(
     if user is None:
         raise credentials_exception
     return user
+
+
+async def get_ingest_principal(request: Request, api_key: Optional[str] = Depends(api_key_header), session=Depends(get_session)):
+    """Authenticate a gateway by `X-API-Key`, falling back to a user bearer token.
+
+    The key path is an HMAC plus a dict lookup (see app.api_keys); no JWT decode or user query.
+    """
+    if api_key:
+        principal = api_keys.index.lookup(session, api_key)
+        if principal is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key")
+        return principal
+    token = await oauth2_scheme(request)
+    return await get_current_user(request, token, session)
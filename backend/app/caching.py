@@ -0,0 +1,76 @@
+"""Data versions and conditional GET support.
+
+Each cacheable data set has a cheap version number: orders and machines keep
+a counter in `DataVersion` that writers bump in their transaction, and
+events use their max primary key. `conditional()` turns the versions a
+response depends on into a weak ETag and answers `304 Not Modified` before
+the endpoint body (and its query) runs.
+"""
+import hashlib
+import time
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import func, update
+from sqlmodel import Session, select
+
+from .db import get_read_session
+from .models import DataVersion, Event
+from .shards import shards
+
+
+def bump_version(session: Session, name: str) -> None:
+    """Increment the counter for `name`; commit together with the data change."""
+    result = session.execute(update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version + 1))
+    if result.rowcount == 0:
+        session.add(DataVersion(name=name, version=1))
+
+
+def get_version(session: Session, name: str) -> int:
+    if name == 'events':
+        # per-shard ids only grow, so their sum changes whenever any shard gains events
+        return sum(shards.gather(session, lambda s: s.exec(select(func.max(Event.id))).one() or 0))
+    return session.exec(select(DataVersion.version).where(DataVersion.name == name)).first() or 0
+
+
+def make_etag(parts) -> str:
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # weak comparison: ignore the W/ prefix on either side
+    wanted = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+def conditional(*names: str, clock: Optional[int] = None):
+    """Dependency factory adding an ETag built from the given data versions.
+
+    `clock` (seconds) also folds in the current time slot, for responses
+    whose window slides with the clock even when no data changed.
+    Declare it after the auth dependency so unauthenticated clients get 401, not 304.
+    Versions are read through the same read session as the endpoint's data.
+    """
+    def dependency(request: Request, response: Response, session: Session = Depends(get_read_session)):
+        parts = [request.url.path, request.url.query]
+        parts.extend(f'{name}:{get_version(session, name)}' for name in names)
+        if clock:
+            parts.append(int(time.time()) // clock)
+        etag = make_etag(parts)
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            raise HTTPException(status_code=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
+        return etag
+
+    return dependency
@@ -0,0 +1,194 @@
+"""Compaction of aged production events.
+
+Production events older than COMPACTION_AGE_HOURS are merged per machine and
+minute into one `production` event whose payload carries the sums every
+reader needs::
+
+    {"produced": 1200, "good": 1188, "ict_sum_ms": 72000.0, "ict_count": 60,
+     "events": 60, "cycle_times": {"1200.0": 58, "1310.0": 2}, "compacted": "1m"}
+
+`rollups`, `sketches` and `/reports/oee` read these sums (cycle times as a
+value -> count histogram), so rollup rebuilds, cycle-time percentiles, OEE
+and trends give the same results before and after compaction. The record is
+stamped with the minute's last event time, which keeps `last_ts` in
+`/reports/metrics/production`. An OEE window starting or ending inside a
+compacted minute counts that minute's events all or not at all. Only `produced`,
+`good` and cycle times survive; other payload fields of merged events are
+dropped. Minutes with a single event are left as they are. Downtime and
+other event types are never compacted.
+
+Each run continues from the watermark in `CompactionWatermark`, one
+COMPACTION_WINDOW_MINUTES window per transaction and shard. Compacting a
+window again is harmless, so after replaying old archives rerun from their
+start with ``--start``::
+
+    python -m app.compaction [--once] [--start ISO]
+
+It runs inside the app every COMPACTION_INTERVAL_SECONDS when
+COMPACTION_SCHEDULER_ENABLED is on. On Postgres concurrent runs are
+serialized with an advisory lock.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, text
+from sqlmodel import Session, select
+
+from .core.config import settings
+from .db import engine
+from .models import CompactionWatermark, Event
+from .rollups import floor_ts, production_values
+from .shards import shards
+from .sketches import cycle_times
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'production'
+# arbitrary key for pg_try_advisory_xact_lock
+LOCK_KEY = 0x636D70
+DELETE_CHUNK = 500
+
+
+def try_lock(session: Session) -> bool:
+    """Transaction-scoped run lock; always granted on databases without advisory locks."""
+    if session.get_bind().dialect.name != 'postgresql':
+        return True
+    return bool(session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': LOCK_KEY}).scalar())
+
+
+def merge(rows) -> dict:
+    """One compacted event row for the events of a single machine and minute."""
+    produced = good = ict_count = events = 0
+    ict_sum_ms = 0.0
+    hist: Dict[str, int] = {}
+    for row in rows:
+        try:
+            payload = json.loads(row.payload) if row.payload else {}
+        except ValueError:
+            payload = {}
+        p, g, s, c = production_values(payload)
+        produced += p
+        good += g
+        ict_sum_ms += s
+        ict_count += c
+        events += payload.get('events', 1) if payload else 1
+        for value, count in cycle_times(payload):
+            # str(float) round-trips exactly
+            key = str(value)
+            hist[key] = hist.get(key, 0) + count
+    return {
+        'ts': max(row.ts for row in rows),
+        'machine_id': rows[0].machine_id,
+        'type': 'production',
+        'payload': json.dumps({'produced': produced, 'good': good, 'ict_sum_ms': ict_sum_ms, 'ict_count': ict_count,
+                               'events': events, 'cycle_times': hist, 'compacted': '1m'}),
+    }
+
+
+def compact_window(session: Session, lo: datetime, hi: datetime) -> int:
+    """Compact the production events in [lo, hi) of one shard (caller commits); returns rows removed."""
+    stmt = select(Event.id, Event.ts, Event.machine_id, Event.payload).where(
+        Event.type == 'production', Event.ts >= lo, Event.ts < hi)
+    groups: Dict[tuple, List] = {}
+    for row in session.execute(stmt):
+        groups.setdefault((row.machine_id, floor_ts(row.ts, '1m')), []).append(row)
+    merged = []
+    ids = []
+    for rows in groups.values():
+        if len(rows) < 2:
+            continue
+        merged.append(merge(rows))
+        ids.extend(row.id for row in rows)
+    if not merged:
+        return 0
+    for i in range(0, len(ids), DELETE_CHUNK):
+        session.execute(delete(Event).where(Event.id.in_(ids[i:i + DELETE_CHUNK])))
+    session.execute(insert(Event), merged)
+    return len(ids) - len(merged)
+
+
+def first_window(session: Session) -> Optional[datetime]:
+    stmt = select(func.min(Event.ts)).where(Event.type == 'production')
+    found = [ts for ts in shards.gather(session, lambda s: s.exec(stmt).one()) if ts is not None]
+    return floor_ts(min(found), '1h') if found else None
+
+
+def run(now: Optional[datetime] = None, start: Optional[datetime] = None) -> int:
+    """Compact windows from the watermark (or `start`) up to the age cutoff; returns rows removed."""
+    step = timedelta(minutes=settings.COMPACTION_WINDOW_MINUTES)
+    cutoff = floor_ts((now or datetime.utcnow()) - timedelta(hours=settings.COMPACTION_AGE_HOURS), '1m')
+    removed = 0
+    lo = None
+    if start is not None:
+        if start.tzinfo is not None:
+            start = start.astimezone(timezone.utc).replace(tzinfo=None)
+        lo = floor_ts(start, '1m')
+    while True:
+        with Session(engine) as session:
+            if not try_lock(session):
+                return removed
+            mark = session.get(CompactionWatermark, WATERMARK_NAME)
+            if lo is None:
+                lo = mark.watermark if mark is not None else first_window(session)
+            if lo is None or lo >= cutoff:
+                return removed
+            hi = min(cutoff, lo + step)
+
+            def compact(shard_session):
+                count = compact_window(shard_session, lo, hi)
+                # without shards this is `session`, committed below together with the watermark
+                if shard_session is not session:
+                    shard_session.commit()
+                return count
+
+            removed += sum(shards.gather(session, compact))
+            if mark is None:
+                mark = CompactionWatermark(name=WATERMARK_NAME, watermark=hi)
+            mark.watermark = max(mark.watermark, hi)
+            session.add(mark)
+            session.commit()
+        lo = hi
+
+
+async def scheduler() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            removed = await loop.run_in_executor(None, run)
+            if removed:
+                logger.info("compacted away %d production events", removed)
+        except Exception:
+            logger.exception("event compaction run failed")
+        await asyncio.sleep(settings.COMPACTION_INTERVAL_SECONDS)
+
+
+_state = {'task': None}
+
+
+def start() -> None:
+    _state['task'] = asyncio.get_running_loop().create_task(scheduler())
+
+
+def stop() -> None:
+    if _state['task'] is not None:
+        _state['task'].cancel()
+        _state['task'] = None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compact aged production events into per-minute records')
+    parser.add_argument('--once', action='store_true', help='run once instead of every COMPACTION_INTERVAL_SECONDS')
+    parser.add_argument('--start', help='recompact from this ISO datetime instead of the watermark')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.once or args.start:
+        start_at = datetime.fromisoformat(args.start) if args.start else None
+        print(f'{run(start=start_at)} events compacted away')
+    else:
+        asyncio.run(scheduler())
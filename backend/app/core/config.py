@@ -1,3 +1,5 @@
+from typing import Dict, List
+
 from pydantic_settings import BaseSettings
 
 
@@ -5,8 +7,92 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "Production Optimization"
     SECRET_KEY: str = "change-me-in-production"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24
+    # HMAC key for gateway API keys (defaults to SECRET_KEY) and how often workers look for key changes
+    API_KEY_SECRET: str = ""
+    API_KEY_REFRESH_SECONDS: float = 5.0
     # Default to sqlite for local dev; production should set DATABASE_URL to a Postgres URL
     DATABASE_URL: str = "sqlite:///./production.db"
+    # SQLite (edge) mode: pragmas run on every connection, and event inserts go through one writer thread (app.writer)
+    SQLITE_PRAGMAS: Dict[str, str] = {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": "5000",
+                                      "cache_size": "-65536", "mmap_size": "268435456", "temp_store": "MEMORY"}
+    SQLITE_SINGLE_WRITER: bool = True
+    SQLITE_WRITER_MAX_ROWS: int = 20000
+    # Startup schema handling: create_all (demo), check (Alembic head only) or skip; see app.schema
+    SCHEMA_MODE: str = "create_all"
+    # Optional read replicas (JSON list of URLs) for reports and listings; see db.ReplicaRouter
+    READ_REPLICA_URLS: List[str] = []
+    REPLICA_POLICY: str = "round_robin"  # or "least_loaded"
+    REPLICA_MAX_LAG_SECONDS: float = 5.0
+    REPLICA_LAG_CHECK_SECONDS: float = 2.0
+    # Raw events sharded by source over these databases (app.shards); empty keeps them on DATABASE_URL
+    EVENT_SHARD_URLS: List[str] = []
+    EVENT_SHARD_VNODES: int = 64
+    # Event sources are mapped to Machine ids in memory (app.sources); unknown sources become (hidden)
+    # auto-registered machines, or are rejected with 422 when this is off
+    AUTO_REGISTER_SOURCES: bool = True
+    SOURCE_REFRESH_SECONDS: float = 5.0
+    # Largest /events/bulk body after gzip/zstd decoding (bytes); bigger bodies get 413
+    INGEST_MAX_DECOMPRESSED_BYTES: int = 64 * 1024 * 1024
+    # Responses smaller than this (bytes) are sent uncompressed
+    COMPRESSION_MIN_SIZE: int = 1024
+    # Shift calendar (UTC) used by the 'shift' rollup resolution
+    SHIFT_START_HOUR: int = 6
+    SHIFT_HOURS: int = 8
+    # Upper bound on buckets when production_trend picks a resolution itself
+    TREND_MAX_POINTS: int = 500
+    # Cycle-time quantile sketches: relative error bound and max buckets per sketch
+    SKETCH_RELATIVE_ACCURACY: float = 0.01
+    SKETCH_MAX_BINS: int = 2048
+    # Streaming anomaly detection on ingest (EWMA z-scores per source)
+    ANOMALY_DETECTION: bool = True
+    ANOMALY_ALPHA: float = 0.05
+    ANOMALY_Z_THRESHOLD: float = 4.0
+    ANOMALY_WARMUP: int = 30
+    ANOMALY_MIN_STD: float = 0.01
+    # Optional line-protocol listener (app.line_listener); a port of 0 disables that transport
+    LINE_LISTENER_ENABLED: bool = False
+    LINE_LISTENER_HOST: str = "0.0.0.0"
+    LINE_TCP_PORT: int = 8094
+    LINE_UDP_PORT: int = 0
+    LINE_REQUIRE_KEY: bool = True
+    LINE_BATCH_SIZE: int = 5000
+    LINE_FLUSH_MS: int = 200
+    LINE_MAX_PENDING_BATCHES: int = 256
+    LINE_MAX_LINE_BYTES: int = 65536
+    # Rate limits per route class (app.ratelimit): requests/second and burst per client, then
+    # concurrent requests per worker, how many may queue and for how long before a 503
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_REDIS_URL: str = ""
+    RATE_LIMIT_RATES: Dict[str, float] = {"ingest": 20.0, "reports": 10.0, "auth": 1.0, "api": 20.0}
+    RATE_LIMIT_BURSTS: Dict[str, float] = {"ingest": 40, "reports": 30, "auth": 10, "api": 50}
+    CONCURRENCY_LIMITS: Dict[str, int] = {"ingest": 16, "reports": 8, "auth": 4, "api": 16}
+    CONCURRENCY_QUEUE: Dict[str, int] = {"ingest": 32, "reports": 16, "auth": 8, "api": 32}
+    CONCURRENCY_QUEUE_TIMEOUT_MS: int = 2000
+    # POST /batch: sub-requests per call and sub-requests running at once per worker
+    BATCH_MAX_REQUESTS: int = 20
+    BATCH_CONCURRENCY: int = 8
+    # KPI snapshots (app.kpi): in-app scheduler (enable in one worker only unless on Postgres) and its period,
+    # buckets recomputed behind the watermark, buckets per transaction
+    KPI_SCHEDULER_ENABLED: bool = False
+    KPI_INTERVAL_SECONDS: int = 300
+    KPI_LOOKBACK_BUCKETS: int = 2
+    KPI_CHUNK_BUCKETS: int = 168
+    # Order ETAs (app.eta): half-life of the per-machine throughput average
+    ETA_HALF_LIFE_SECONDS: float = 900.0
+    # Production events older than this are merged per source and minute (app.compaction)
+    COMPACTION_SCHEDULER_ENABLED: bool = False
+    COMPACTION_AGE_HOURS: int = 72
+    COMPACTION_WINDOW_MINUTES: int = 60
+    COMPACTION_INTERVAL_SECONDS: int = 3600
+    # Live OEE ring buffers (app.live): slot width, the longest window /reports/oee/live can cover,
+    # how often each worker reads new events and how long an id may wait for lower ids to commit
+    LIVE_OEE_ENABLED: bool = True
+    LIVE_OEE_SLOT_SECONDS: int = 10
+    LIVE_OEE_HORIZON_SECONDS: int = 3600
+    LIVE_OEE_REFRESH_SECONDS: float = 1.0
+    LIVE_OEE_SETTLE_SECONDS: float = 10.0
+    # Parquet/Arrow export (app.export): rows per row group, also the read chunk
+    EXPORT_ROW_GROUP_ROWS: int = 65536
 
     class Config:
         env_file = ".env"
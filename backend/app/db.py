@@ -1,9 +1,151 @@
+import itertools
+import logging
+import threading
+import time
+
+from sqlalchemy import event, text
 from sqlmodel import create_engine, Session
 from .core.config import settings
 
-engine = create_engine(settings.DATABASE_URL, echo=False)
+logger = logging.getLogger(__name__)
+
+
+def configure_sqlite(eng):
+    """Run SQLITE_PRAGMAS (WAL journal, relaxed fsync, bigger cache, mmap) on each new SQLite connection."""
+    if eng.dialect.name != 'sqlite':
+        return eng
+
+    @event.listens_for(eng, 'connect')
+    def set_pragmas(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return eng
+
+
+# rollups, sketches and KPI snapshots are upserted with INSERT .. ON CONFLICT
+UPSERT_DIALECTS = ('postgresql', 'sqlite')
+
+
+def check_dialect(eng):
+    """Refuse to start on a database without INSERT .. ON CONFLICT support."""
+    if eng.dialect.name not in UPSERT_DIALECTS:
+        raise RuntimeError(
+            f"DATABASE_URL uses the {eng.dialect.name} dialect; only PostgreSQL and SQLite are supported")
+    return eng
+
+
+engine = check_dialect(configure_sqlite(create_engine(settings.DATABASE_URL, echo=False)))
+
+# Postgres standby lag; 0 on a primary or when everything received has been replayed
+PG_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaRouter:
+    """Pick an engine for read-only work among READ_REPLICA_URLS.
+
+    Replicas whose measured lag exceeds REPLICA_MAX_LAG_SECONDS (or that fail
+    the lag probe) are skipped; with none left, reads go to the primary.
+    Lag is probed at most every REPLICA_LAG_CHECK_SECONDS per replica.
+    """
+
+    def __init__(self, primary, urls):
+        self.primary = primary
+        self.replicas = [configure_sqlite(create_engine(url, echo=False)) for url in urls]
+        self._rr = itertools.count()
+        self._lag = {}
+        self._lock = threading.Lock()
+        self.picks = {id(e): 0 for e in [primary] + self.replicas}
+        self.fallbacks = 0
+
+    def lag(self, eng) -> float:
+        now = time.monotonic()
+        checked, lag = self._lag.get(id(eng), (0.0, None))
+        if lag is not None and now - checked < settings.REPLICA_LAG_CHECK_SECONDS:
+            return lag
+        with self._lock:
+            try:
+                with eng.connect() as conn:
+                    lag = float(conn.execute(PG_LAG_SQL).scalar() or 0) if eng.dialect.name == 'postgresql' else 0.0
+            except Exception:
+                logger.warning("read replica %s failed its lag probe", eng.url.render_as_string(hide_password=True))
+                lag = float('inf')
+            self._lag[id(eng)] = (now, lag)
+        return lag
+
+    def pick(self):
+        healthy = [e for e in self.replicas if self.lag(e) <= settings.REPLICA_MAX_LAG_SECONDS]
+        if not healthy:
+            if self.replicas:
+                self.fallbacks += 1
+            chosen = self.primary
+        elif settings.REPLICA_POLICY == 'least_loaded':
+            chosen = min(healthy, key=lambda e: e.pool.checkedout() if hasattr(e.pool, 'checkedout') else 0)
+        else:
+            chosen = healthy[next(self._rr) % len(healthy)]
+        self.picks[id(chosen)] += 1
+        return chosen
+
+    def metrics(self):
+        out = []
+        for role, eng in [('primary', self.primary)] + [('replica', e) for e in self.replicas]:
+            pool = eng.pool
+            lag = self._lag.get(id(eng), (None, None))[1]
+            out.append({
+                'role': role,
+                'url': eng.url.render_as_string(hide_password=True),
+                'pool': pool.status(),
+                'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                'picks': self.picks[id(eng)],
+                'lag_seconds': lag if lag != float('inf') else None,
+                'healthy': role == 'primary' or (lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS),
+            })
+        return {'fallbacks_to_primary': self.fallbacks, 'engines': out}
+
+
+replicas = ReplicaRouter(engine, settings.READ_REPLICA_URLS)
 
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+def get_read_session():
+    """Session for read-only endpoints, routed to a read replica when one is healthy."""
+    with Session(replicas.pick()) as session:
+        yield session
+
+
+def dialect_insert(session):
+    """The dialect-specific `insert` construct (supports ON CONFLICT) for this session."""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        check_dialect(session.get_bind())
+    return insert
+
+
+def upsert_add(session, model, rows, keys, add_cols):
+    """Insert `rows` or, on key conflict, add their `add_cols` onto the stored row.
+
+    Uses INSERT .. ON CONFLICT DO UPDATE on Postgres and SQLite so concurrent
+    writers never lose increments.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    stmt = dialect_insert(session)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c[k] for k in keys],
+        set_={c: table.c[c] + stmt.excluded[c] for c in add_cols},
+    )
+    session.execute(stmt, rows)
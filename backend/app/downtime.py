@@ -0,0 +1,183 @@
+"""Downtime as merged [start, end) intervals per source.
+
+A ``downtime`` event covers ``[ts, ts + duration_seconds)``. At ingest the
+covered intervals are merged into `DowntimeInterval`, which holds disjoint,
+non-touching intervals per source sorted by start: a new interval absorbs
+every stored one it overlaps or touches. Overlapping reports therefore count
+once, and a stop that straddles a window boundary counts only the part
+inside the window.
+
+Because the intervals of a source are disjoint, those intersecting a window
+[lo, hi) are the last one starting before lo (if it ends after lo) plus the
+ones starting in [lo, hi): two range reads on the (source, start) index, so
+a window costs O(log n + k) for k intersecting intervals, independent of the
+source's history. Cross-source reads (KPI buckets) use the `end` index.
+
+Intervals are derived data like the rollups: the raw downtime events stay in
+`event`, and ``python -m app.downtime --rebuild [--start ISO --end ISO]``
+recomputes the intervals from them (needed after loading events with
+derived updates off, and for events on shard databases).
+"""
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, text
+from sqlmodel import Session, select
+
+from .models import DowntimeInterval, Event, Machine
+from .rollups import floor_ts, resolution_seconds
+from .shards import shards
+from .sources import labelled
+
+
+def duration_seconds(payload) -> float:
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except Exception:
+            return 0.0
+    if not payload:
+        return 0.0
+    try:
+        return max(float(payload.get('duration_seconds', 0)), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def merge(intervals: Iterable[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """Union of intervals as sorted, disjoint, non-touching intervals."""
+    out: List[list] = []
+    for start, end in sorted(intervals):
+        if out and start <= out[-1][1]:
+            out[-1][1] = max(out[-1][1], end)
+        else:
+            out.append([start, end])
+    return [(start, end) for start, end in out]
+
+
+def intersecting(session: Session, source: str, lo: datetime, hi: datetime, touching: bool = False) -> List[DowntimeInterval]:
+    """Stored intervals of `source` overlapping [lo, hi) (or touching it), by start."""
+    before = select(DowntimeInterval).where(
+        DowntimeInterval.source == source, DowntimeInterval.start < lo).order_by(DowntimeInterval.start.desc()).limit(1)
+    prev = session.exec(before).first()
+    inside = select(DowntimeInterval).where(DowntimeInterval.source == source, DowntimeInterval.start >= lo)
+    inside = inside.where(DowntimeInterval.start <= hi if touching else DowntimeInterval.start < hi)
+    found = list(session.exec(inside.order_by(DowntimeInterval.start)))
+    if prev is not None and (prev.end >= lo if touching else prev.end > lo):
+        found.insert(0, prev)
+    return found
+
+
+def lock(session: Session, source: str) -> None:
+    # one writer per source at a time, so concurrent merges can't leave overlaps
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': zlib.crc32(b'downtime:' + source.encode())})
+
+
+def add(session: Session, source: str, machine_id: Optional[int], intervals: Iterable[Tuple[datetime, datetime]]) -> None:
+    """Merge intervals of one source into the stored ones (caller holds `lock` and commits)."""
+    for start, end in merge(intervals):
+        stored = intersecting(session, source, start, end, touching=True)
+        if stored:
+            start = min(start, stored[0].start)
+            end = max(end, stored[-1].end)
+            machine_id = machine_id if machine_id is not None else stored[0].machine_id
+            session.execute(delete(DowntimeInterval).where(DowntimeInterval.id.in_([s.id for s in stored])))
+        session.execute(insert(DowntimeInterval).values(source=source, machine_id=machine_id, start=start, end=end))
+
+
+def apply(session: Session, rows: Iterable[dict]) -> None:
+    """Merge the downtime events of an ingest batch (caller commits)."""
+    per_source: Dict[str, list] = {}
+    machines: Dict[str, Optional[int]] = {}
+    for row in rows:
+        if row['type'] != 'downtime':
+            continue
+        seconds = duration_seconds(row['payload'])
+        if seconds <= 0:
+            continue
+        per_source.setdefault(row['source'], []).append((row['ts'], row['ts'] + timedelta(seconds=seconds)))
+        machines[row['source']] = row.get('machine_id')
+    # fixed order, so two batches never wait on each other's locks in reverse
+    for source in sorted(per_source):
+        lock(session, source)
+        add(session, source, machines[source], per_source[source])
+
+
+def clipped(intervals: Iterable[Tuple[datetime, datetime]], lo: datetime, hi: datetime) -> float:
+    """Seconds of [lo, hi) covered by the union of `intervals`."""
+    total = 0.0
+    for start, end in merge((max(s, lo), min(e, hi)) for s, e in intervals):
+        if end > start:
+            total += (end - start).total_seconds()
+    return total
+
+
+def window_seconds(session: Session, sources: List[str], lo: datetime, hi: datetime) -> float:
+    """Downtime seconds within [lo, hi) of the given sources (one machine), overlaps counted once."""
+    found = [(i.start, i.end) for source in set(sources) for i in intersecting(session, source, lo, hi)]
+    return clipped(found, lo, hi)
+
+
+def machine_sources(session: Session, machine_id: int) -> List[str]:
+    """The source strings that resolve to `machine_id` (its code and name, see app.sources)."""
+    machine = session.get(Machine, machine_id)
+    if machine is None:
+        return []
+    return [s for s in (machine.code, machine.name) if s]
+
+
+def bucket_seconds(session: Session, granularity: str, lo: datetime, hi: datetime) -> Dict[tuple, float]:
+    """Downtime seconds per (bucket, source) for the `granularity` buckets in [lo, hi)."""
+    step = timedelta(seconds=resolution_seconds(granularity))
+    stmt = select(DowntimeInterval.source, DowntimeInterval.start, DowntimeInterval.end).where(
+        DowntimeInterval.end > lo, DowntimeInterval.start < hi)
+    out: Dict[tuple, float] = {}
+    for source, start, end in session.execute(stmt):
+        at = max(start, lo)
+        stop = min(end, hi)
+        bucket = floor_ts(at, granularity)
+        while at < stop:
+            part_end = min(bucket + step, stop)
+            key = (bucket, source)
+            out[key] = out.get(key, 0.0) + (part_end - at).total_seconds()
+            at = bucket = bucket + step
+    return out
+
+
+def rebuild(session: Session, start: Optional[datetime] = None, end: Optional[datetime] = None, chunk: int = 5000) -> None:
+    """Recompute intervals from the downtime events, for everything or around [start, end) (caller commits)."""
+    stmt = select(Event.ts, Event.machine_id, Event.type, Event.payload).where(Event.type == 'downtime')
+    if start is None and end is None:
+        session.execute(delete(DowntimeInterval))
+    else:
+        lo = start or datetime.min
+        hi = end or datetime.max
+        # stored intervals reaching into the range may hold events from before it; widen to cover them whole
+        stored = session.exec(select(DowntimeInterval).where(DowntimeInterval.end > lo, DowntimeInterval.start < hi)).all()
+        if stored:
+            lo = min(lo, min(s.start for s in stored))
+            hi = max(hi, max(s.end for s in stored))
+            session.execute(delete(DowntimeInterval).where(DowntimeInterval.id.in_([s.id for s in stored])))
+        stmt = stmt.where(Event.ts >= lo, Event.ts < hi)
+    for part in shards.partitions(session, stmt, chunk):
+        apply(session, labelled(session, part))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from .db import engine
+
+    parser = argparse.ArgumentParser(description='Recompute downtime intervals from downtime events')
+    parser.add_argument('--rebuild', action='store_true', required=True)
+    parser.add_argument('--start', help='ISO datetime; everything when omitted')
+    parser.add_argument('--end', help='ISO datetime')
+    args = parser.parse_args()
+    with Session(engine) as session:
+        rebuild(session, datetime.fromisoformat(args.start) if args.start else None,
+                datetime.fromisoformat(args.end) if args.end else None)
+        session.commit()
+    print('downtime intervals rebuilt')
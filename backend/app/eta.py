@@ -0,0 +1,152 @@
+"""Order completion forecasts from live machine throughput.
+
+An order that is ``in_progress`` on a machine (`Order.machine_id`) is credited
+with the good units of that machine's production events stamped at or after
+its `started_at`. When several orders run on one machine they are served
+first come, first served: output goes to the earliest started order that
+still has quantity left, up to that quantity, and the rest to the next one.
+Output beyond all of them is not counted.
+
+Throughput per machine is an exponentially weighted average of good units
+per second in `MachineThroughput`. Each ingest batch contributes its good
+units over the time since the machine's previous event, weighted by
+``1 - 0.5 ** (elapsed / ETA_HALF_LIFE_SECONDS)``, so the estimate does not
+depend on how gateways batch their events. Late events count towards order
+progress but not towards the rate.
+
+The ingest transaction updates the rates of the machines in the batch and
+then the progress and `eta` of only those machines' in-progress orders. The
+ETA is the machine's last event time plus the remaining quantity (including
+that of orders queued before it) at the current rate. It stays where it was
+while the machine sends no production events.
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlmodel import Session, select
+
+from .caching import bump_version
+from .core.config import settings
+from .db import dialect_insert
+from .models import MachineThroughput, Order
+from .rollups import production_values
+
+IN_PROGRESS = 'in_progress'
+
+
+def machine_output(rows: Iterable[dict]) -> Dict[int, List[tuple]]:
+    """(ts, good) of the production rows per machine id."""
+    out: Dict[int, List[tuple]] = {}
+    for row in rows:
+        if row['type'] != 'production' or row.get('machine_id') is None:
+            continue
+        payload = row['payload']
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except Exception:
+                continue
+        good = production_values(payload)[1]
+        out.setdefault(row['machine_id'], []).append((row['ts'], good))
+    return out
+
+
+def update_rate(state: MachineThroughput, output: List[tuple]) -> None:
+    last = state.last_ts
+    fresh = [(ts, good) for ts, good in output if last is None or ts > last]
+    if not fresh:
+        return
+    newest = max(ts for ts, _ in fresh)
+    if last is None:
+        # first sight of the machine: the batch itself is the only interval there is
+        last = min(ts for ts, _ in fresh)
+        fresh = [(ts, good) for ts, good in fresh if ts > last]
+    elapsed = (newest - last).total_seconds()
+    if elapsed > 0:
+        rate = sum(good for _, good in fresh) / elapsed
+        if state.rate is None:
+            state.rate = rate
+        else:
+            alpha = 1 - 0.5 ** (elapsed / settings.ETA_HALF_LIFE_SECONDS)
+            state.rate += alpha * (rate - state.rate)
+    state.last_ts = newest
+
+
+def forecast(orders: List[Order], state: Optional[MachineThroughput]) -> None:
+    """Set `eta` on one machine's in-progress orders, given in service order."""
+    rate = state.rate if state is not None else None
+    at = state.last_ts if state is not None else None
+    for order in orders:
+        if not rate or at is None:
+            order.eta = None
+            continue
+        at += timedelta(seconds=max(order.quantity - order.progress, 0) / rate)
+        order.eta = at
+
+
+def in_progress(session: Session, machine_ids) -> Dict[int, List[Order]]:
+    stmt = select(Order).where(Order.status == IN_PROGRESS, Order.machine_id.in_(machine_ids)).order_by(
+        Order.started_at, Order.id).with_for_update()
+    out: Dict[int, List[Order]] = {}
+    for order in session.exec(stmt):
+        out.setdefault(order.machine_id, []).append(order)
+    return out
+
+
+def credit(orders: List[Order], ts: datetime, good: int) -> None:
+    """Give `good` units made at `ts` to the orders in service order, each up to its quantity."""
+    for order in orders:
+        if good <= 0:
+            return
+        if order.started_at <= ts and order.progress < order.quantity:
+            taken = min(good, order.quantity - order.progress)
+            order.progress += taken
+            good -= taken
+
+
+def apply(session: Session, rows: Iterable[dict]) -> None:
+    """Fold an ingest batch into the machine rates and affected orders (caller commits)."""
+    output = machine_output(rows)
+    if not output:
+        return
+    ids = sorted(output)
+    session.execute(dialect_insert(session)(MachineThroughput.__table__).on_conflict_do_nothing(
+        index_elements=['machine_id']), [{'machine_id': mid} for mid in ids])
+    states = {s.machine_id: s for s in session.exec(
+        select(MachineThroughput).where(MachineThroughput.machine_id.in_(ids)).with_for_update())}
+    for mid in ids:
+        update_rate(states[mid], output[mid])
+        session.add(states[mid])
+    orders = in_progress(session, ids)
+    for mid, machine_orders in orders.items():
+        for ts, good in sorted(output[mid]):
+            credit(machine_orders, ts, good)
+        forecast(machine_orders, states[mid])
+        session.add_all(machine_orders)
+    session.flush()
+    if orders:
+        bump_version(session, 'orders')
+
+
+def refresh(session: Session, machine_id: Optional[int]) -> None:
+    """Recompute the ETAs of a machine's in-progress orders after orders changed (caller commits)."""
+    if machine_id is None:
+        return
+    session.flush()
+    machine_orders = in_progress(session, [machine_id]).get(machine_id, [])
+    forecast(machine_orders, session.get(MachineThroughput, machine_id))
+    session.add_all(machine_orders)
+
+
+def track(order: Order, previous_status: Optional[str], previous_machine: Optional[int]) -> List[int]:
+    """Stamp status or machine changes of `order`; returns the machines whose forecasts need a refresh."""
+    if order.status == IN_PROGRESS:
+        if previous_status != IN_PROGRESS:
+            order.progress = 0
+        if previous_status != IN_PROGRESS or previous_machine != order.machine_id:
+            # only output from now on counts; progress made on another machine is kept
+            order.started_at = datetime.utcnow()
+    if order.status != IN_PROGRESS:
+        order.eta = None
+    return [mid for mid in {previous_machine, order.machine_id} if mid is not None]
@@ -0,0 +1,235 @@
+"""Columnar export of events and report snapshots to Parquet or Arrow IPC.
+
+Datasets:
+
+- ``events``: raw events (``ts``, ``source`` - the machine's label, see
+  `app.sources` - ``machine_id``, ``type``, ``payload`` as JSON text),
+  optionally limited to sources and a time range
+- ``production``: production rollups per source and bucket (``--resolution``)
+- ``kpi``: KPI snapshots (availability/performance/quality/OEE) per source
+  and closed hour or shift (``--resolution 1h|shift``)
+
+Rows are read from the database EXPORT_ROW_GROUP_ROWS at a time and every
+chunk becomes one Parquet row group or Arrow record batch, so memory stays
+bounded by a chunk (times the number of open partitions for partitioned
+exports). Timestamps are written as UTC. Parquet is zstd-compressed.
+
+`stream` produces one file as a sequence of byte chunks (used by
+``GET /reports/export/{dataset}``); `write_partitioned` writes Hive-style
+partitioned files::
+
+    python -m app.export events --start 2026-10-01 --end 2026-10-08 --out exports/ [--partition-by day|source|none]
+
+which gives ``exports/events/date=2026-10-01/part-0.parquet`` and so on.
+pyarrow is optional; without it exports fail with a clear message.
+"""
+import io
+import os
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from sqlmodel import Session, select
+
+from .core.config import settings
+from .models import Event, KpiSnapshot, ProductionRollup
+from .shards import shards
+from .sources import directory
+
+DATASETS = ('events', 'production', 'kpi')
+FORMATS = {'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+           'arrow': ('.arrow', 'application/vnd.apache.arrow.file')}
+PARTITIONS = ('day', 'source', 'none')
+EventRow = namedtuple('EventRow', 'id ts source machine_id type payload')
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet/Arrow export is not available on this server (pip install pyarrow)")
+    return pyarrow
+
+
+def schema(dataset: str):
+    pa = require_pyarrow()
+    ts = pa.timestamp('us', tz='UTC')
+    if dataset == 'events':
+        return pa.schema([('id', pa.int64()), ('ts', ts), ('source', pa.string()), ('machine_id', pa.int64()),
+                          ('type', pa.string()), ('payload', pa.string())])
+    if dataset == 'production':
+        return pa.schema([('resolution', pa.string()), ('bucket', ts), ('source', pa.string()), ('produced', pa.int64()),
+                          ('good', pa.int64()), ('ict_sum_ms', pa.float64()), ('ict_count', pa.int64()),
+                          ('events', pa.int64())])
+    return pa.schema([('granularity', pa.string()), ('source', pa.string()), ('bucket', ts),
+                      ('planned_seconds', pa.float64()), ('downtime_seconds', pa.float64()), ('run_seconds', pa.float64()),
+                      ('produced', pa.int64()), ('good', pa.int64()), ('ict_sum_ms', pa.float64()), ('ict_count', pa.int64()),
+                      ('availability', pa.float64()), ('performance', pa.float64()), ('quality', pa.float64()),
+                      ('oee', pa.float64())])
+
+
+def statement(session: Session, dataset: str, start: Optional[datetime], end: Optional[datetime],
+              sources: Optional[List[str]], resolution: Optional[str]):
+    """Select the dataset's columns (in schema order but for the event label); `start`/`end` are naive UTC."""
+    if dataset == 'events':
+        table, ts = Event, Event.ts
+        stmt = select(Event.id, Event.ts, Event.machine_id, Event.type, Event.payload)
+    elif dataset == 'production':
+        table, ts = ProductionRollup, ProductionRollup.bucket
+        stmt = select(*[getattr(ProductionRollup, f) for f in schema(dataset).names]).where(
+            ProductionRollup.resolution == (resolution or '1h'))
+    else:
+        table, ts = KpiSnapshot, KpiSnapshot.bucket
+        stmt = select(*[getattr(KpiSnapshot, f) for f in schema(dataset).names]).where(
+            KpiSnapshot.granularity == (resolution or '1h'))
+    if start is not None:
+        stmt = stmt.where(ts >= start)
+    if end is not None:
+        stmt = stmt.where(ts < end)
+    if sources and dataset == 'events':
+        ids = {directory.lookup(session, source) for source in sources}
+        stmt = stmt.where(Event.machine_id.in_(ids - {None}))
+    elif sources:
+        stmt = stmt.where(table.source.in_(sources))
+    return stmt
+
+
+def chunks(session: Session, dataset: str, stmt) -> Iterator[list]:
+    size = settings.EXPORT_ROW_GROUP_ROWS
+    if dataset == 'events':
+        # events may sit on shard databases, and store the machine id only
+        labels = directory.labels(session)
+        for part in shards.partitions(session, stmt, size):
+            yield [EventRow(r.id, r.ts, labels.get(r.machine_id) or str(r.machine_id), r.machine_id, r.type, r.payload)
+                   for r in part]
+    else:
+        yield from session.execute(stmt.execution_options(yield_per=size)).partitions()
+
+
+def record_batch(rows: list, table_schema):
+    pa = require_pyarrow()
+    columns = list(zip(*rows)) if rows else [[] for _ in table_schema]
+    return pa.record_batch([pa.array(list(col), type=field.type) for col, field in zip(columns, table_schema)],
+                           schema=table_schema)
+
+
+class Sink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last `take`."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        out = b''.join(self.parts)
+        self.parts = []
+        return out
+
+
+def open_writer(fmt: str, where, table_schema):
+    pa = require_pyarrow()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(where, table_schema, compression='zstd')
+    return pa.ipc.new_file(where, table_schema)
+
+
+def stream(session: Session, dataset: str, fmt: str = 'parquet', start: Optional[datetime] = None,
+           end: Optional[datetime] = None, sources: Optional[List[str]] = None,
+           resolution: Optional[str] = None) -> Iterator[bytes]:
+    """One Parquet/Arrow file as byte chunks, one row group at a time."""
+    table_schema = schema(dataset)
+    sink = Sink()
+    writer = open_writer(fmt, sink, table_schema)
+    for rows in chunks(session, dataset, statement(session, dataset, start, end, sources, resolution)):
+        writer.write_batch(record_batch(rows, table_schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def partition_key(dataset: str, partition_by: str) -> Callable:
+    if partition_by == 'source':
+        return lambda row: 'source=' + quote(row.source, safe='')
+    if partition_by == 'day':
+        ts = 'ts' if dataset == 'events' else 'bucket'
+        return lambda row: 'date=' + getattr(row, ts).date().isoformat()
+    return lambda row: ''
+
+
+def write_partitioned(session: Session, dataset: str, out: str, fmt: str = 'parquet', partition_by: str = 'day',
+                      start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      sources: Optional[List[str]] = None, resolution: Optional[str] = None) -> Dict[str, int]:
+    """Write `dataset` under `out`/<dataset>/<partition>/; returns rows per file."""
+    table_schema = schema(dataset)
+    suffix = FORMATS[fmt][0]
+    key_of = partition_key(dataset, partition_by)
+    size = settings.EXPORT_ROW_GROUP_ROWS
+    writers: Dict[str, object] = {}
+    pending: Dict[str, list] = {}
+    counts: Dict[str, int] = {}
+
+    def flush(key: str) -> None:
+        if key not in writers:
+            directory = os.path.join(out, dataset, key)
+            os.makedirs(directory, exist_ok=True)
+            writers[key] = open_writer(fmt, os.path.join(directory, 'part-0' + suffix), table_schema)
+        rows = pending.pop(key)
+        writers[key].write_batch(record_batch(rows, table_schema))
+        counts[key] = counts.get(key, 0) + len(rows)
+
+    try:
+        for rows in chunks(session, dataset, statement(session, dataset, start, end, sources, resolution)):
+            for row in rows:
+                key = key_of(row)
+                pending.setdefault(key, []).append(row)
+                if len(pending[key]) >= size:
+                    flush(key)
+        for key in list(pending):
+            flush(key)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {os.path.join(out, dataset, key, 'part-0' + suffix): n for key, n in counts.items()}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from .db import engine
+    from .ingest import parse_ts
+
+    parser = argparse.ArgumentParser(description='Export events and report snapshots to Parquet/Arrow files')
+    parser.add_argument('dataset', choices=DATASETS)
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    parser.add_argument('--partition-by', choices=PARTITIONS, default='day')
+    parser.add_argument('--start', help='ISO datetime (UTC)')
+    parser.add_argument('--end', help='ISO datetime (UTC), exclusive')
+    parser.add_argument('--source', action='append', help='limit to a source; repeatable')
+    parser.add_argument('--resolution', help='rollup resolution for production (default 1h), 1h or shift for kpi')
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        written = write_partitioned(
+            session, args.dataset, args.out, args.format, args.partition_by,
+            parse_ts(args.start), parse_ts(args.end),
+            args.source, args.resolution)
+    for path, n in sorted(written.items()):
+        print(f'{path}: {n} rows')
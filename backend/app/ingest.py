@@ -0,0 +1,241 @@
+"""Decoding and batched insertion of machine events.
+
+`/events/bulk` accepts several wire formats, negotiated by Content-Type:
+
+- ``application/json`` - the original list of `EventCreate` objects
+- ``application/x-ndjson`` - one event object per line
+- ``application/msgpack`` - a columnar batch (or a list of them)::
+
+      {"source": "M-A", "type": "production",
+       "ts": [...], "produced": [...], "good": [...], "ideal_cycle_time_ms": [...]}
+
+  `source`/`type` are sent once per batch; every other array becomes a
+  payload field of the event at the same position.
+
+Any body may be compressed with ``Content-Encoding: gzip`` or ``zstd``; it is
+decoded in chunks and rejected with 413 beyond INGEST_MAX_DECOMPRESSED_BYTES.
+Timestamps are ISO strings, epoch seconds or (MessagePack) timestamp
+extension values; a missing `ts` means server time, an invalid one fails
+the batch with 400. Decoders produce plain row dicts ready for a bulk
+insert, so no pydantic model is built per event.
+"""
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import insert
+
+from .core.config import settings
+from .models import Event
+from .shards import event_values, shards
+from . import anomaly, downtime, eta, rollups, sketches, sources
+
+JSON_TYPES = ("application/json",)
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def parse_ts(value) -> Optional[datetime]:
+    """Parse an ISO string, epoch seconds, datetime or msgpack Timestamp into a naive UTC datetime.
+
+    Returns None for missing or unparsable values; naive datetimes are taken as UTC.
+    """
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, datetime):
+            dt = value
+        elif hasattr(value, 'to_datetime'):
+            # msgpack.Timestamp (extension type -1)
+            dt = value.to_datetime()
+        elif isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+        else:
+            dt = datetime.fromisoformat(value)
+    except Exception:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def make_row(source, type_, payload, ts=None) -> dict:
+    if not source or not type_ or not isinstance(source, str) or not isinstance(type_, str):
+        raise HTTPException(status_code=400, detail="Event must have source and type")
+    if payload is not None and not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Event payload must be an object")
+    parsed = parse_ts(ts)
+    if parsed is None and ts is not None and ts != "":
+        raise HTTPException(status_code=400, detail=f"Invalid event timestamp {str(ts)[:40]!r}")
+    return {
+        'source': source,
+        'type': type_,
+        'payload': json.dumps(payload if payload is not None else {}),
+        'ts': parsed or datetime.utcnow(),
+    }
+
+
+def read_limited(stream, encoding: str) -> bytes:
+    """Read a decompressing stream, refusing to produce more than INGEST_MAX_DECOMPRESSED_BYTES."""
+    limit = settings.INGEST_MAX_DECOMPRESSED_BYTES
+    parts = []
+    size = 0
+    while True:
+        chunk = stream.read(min(1 << 20, limit + 1 - size))
+        if not chunk:
+            return b''.join(parts)
+        parts.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"{encoding} body expands beyond {limit} bytes")
+
+
+def decompress(body: bytes, content_encoding: Optional[str]) -> bytes:
+    encoding = (content_encoding or "identity").strip().lower()
+    try:
+        if encoding in ("identity", ""):
+            return body
+        if encoding in ("gzip", "x-gzip"):
+            return read_limited(gzip.GzipFile(fileobj=io.BytesIO(body)), encoding)
+        if encoding == "zstd":
+            import zstandard
+
+            return read_limited(zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)), encoding)
+    except ImportError:
+        raise HTTPException(status_code=415, detail="zstd encoding is not available on this server")
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Could not decode {encoding} body")
+    raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+
+
+def rows_from_objects(objs: Iterable) -> List[dict]:
+    rows = []
+    for obj in objs:
+        if not isinstance(obj, dict):
+            raise HTTPException(status_code=400, detail="Each event must be an object")
+        rows.append(make_row(obj.get('source'), obj.get('type'), obj.get('payload'), obj.get('ts')))
+    return rows
+
+
+def decode_json(body: bytes) -> List[dict]:
+    try:
+        data = json.loads(body)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Body is not valid JSON")
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="Expected a list of events")
+    return rows_from_objects(data)
+
+
+def decode_ndjson(body: bytes) -> List[dict]:
+    objs = []
+    for lineno, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            objs.append(json.loads(line))
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON on line {lineno}")
+    return rows_from_objects(objs)
+
+
+def rows_from_columnar(batch) -> List[dict]:
+    """Expand one columnar batch into row dicts, validating array shapes."""
+    if not isinstance(batch, dict):
+        raise HTTPException(status_code=400, detail="Columnar batch must be a map")
+    source = batch.get('source')
+    type_ = batch.get('type')
+    columns = {k: v for k, v in batch.items() if k not in ('source', 'type', 'ts')}
+    ts_col = batch.get('ts')
+    for name, col in columns.items():
+        if not isinstance(col, list):
+            raise HTTPException(status_code=400, detail=f"Column '{name}' must be an array")
+    lengths = {len(c) for c in columns.values()}
+    if ts_col is not None:
+        if not isinstance(ts_col, list):
+            raise HTTPException(status_code=400, detail="Column 'ts' must be an array")
+        lengths.add(len(ts_col))
+    if len(lengths) > 1:
+        raise HTTPException(status_code=400, detail="All columns in a batch must have the same length")
+    n = lengths.pop() if lengths else 0
+    names = list(columns)
+    cols = [columns[k] for k in names]
+    for name, col in zip(names, cols):
+        for v in col:
+            if v is not None and not isinstance(v, (int, float)):
+                raise HTTPException(status_code=400, detail=f"Column '{name}' must be numeric")
+    rows = []
+    for i in range(n):
+        payload = {k: c[i] for k, c in zip(names, cols) if c[i] is not None}
+        rows.append(make_row(source, type_, payload, ts_col[i] if ts_col is not None else None))
+    return rows
+
+
+def decode_msgpack(body: bytes) -> List[dict]:
+    try:
+        import msgpack
+    except ImportError:
+        raise HTTPException(status_code=415, detail="MessagePack is not available on this server")
+    try:
+        data = msgpack.unpackb(body, raw=False)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Body is not valid MessagePack")
+    batches = data if isinstance(data, list) else [data]
+    rows = []
+    for batch in batches:
+        rows.extend(rows_from_columnar(batch))
+    return rows
+
+
+def decode_body(body: bytes, content_type: Optional[str], content_encoding: Optional[str] = None) -> List[dict]:
+    """Decode a request body into event rows according to its media type."""
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    raw = decompress(body, content_encoding)
+    if media_type in JSON_TYPES:
+        return decode_json(raw)
+    if media_type in NDJSON_TYPES:
+        return decode_ndjson(raw)
+    if media_type in MSGPACK_TYPES:
+        return decode_msgpack(raw)
+    raise HTTPException(status_code=415, detail=f"Unsupported Content-Type: {media_type}")
+
+
+def insert_rows(session, rows: List[dict], returning: bool = False, derived: bool = True):
+    """Insert event rows with a single executemany statement.
+
+    With `derived=True` the rollups, cycle-time sketches, anomaly alerts,
+    downtime intervals and order ETAs are updated in the same transaction;
+    bulk loaders pass False and rebuild afterwards. (The live OEE buffers
+    read new events from the database, see app.live.)
+    With `returning=True` the inserted (id, ts) pairs are returned in input order.
+    The caller owns the transaction; with event shards configured the events
+    themselves are committed per shard before the derived updates (see app.shards).
+    """
+    if not rows:
+        return []
+    ids = sources.directory.resolve(session, {row['source'] for row in rows})
+    labels = sources.directory.labels(session)
+    for row in rows:
+        machine_id = row['machine_id'] = ids[row['source']]
+        # derived tables are keyed by the machine's label, whichever spelling the gateway sent
+        row['source'] = labels.get(machine_id, row['source'])
+    result = None
+    if shards.sharded:
+        result = shards.insert(rows, returning)
+    elif returning:
+        stmt = insert(Event).returning(Event.id, Event.ts, sort_by_parameter_order=True)
+        result = session.execute(stmt, event_values(rows)).all()
+    else:
+        session.execute(insert(Event), event_values(rows))
+    if derived:
+        rollups.apply(session, rows)
+        sketches.apply(session, rows)
+        anomaly.apply(session, rows)
+        downtime.apply(session, rows)
+        eta.apply(session, rows)
+    return result
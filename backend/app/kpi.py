@@ -0,0 +1,245 @@
+"""Periodic KPI snapshots.
+
+Availability, performance, quality and OEE are materialized per source for
+every closed hour and shift into `KpiSnapshot`, so KPI trends over months are
+plain indexed reads. Each run continues from the per-granularity watermark in
+`KpiWatermark`: production totals come from the `1h`/`shift` production
+rollups and downtime from the merged downtime intervals (`app.downtime`)
+overlapping the new buckets only. The last KPI_LOOKBACK_BUCKETS buckets
+before the watermark are recomputed to pick up late events; older
+corrections need an explicit rebuild.
+
+Runs inside the app every KPI_INTERVAL_SECONDS (KPI_SCHEDULER_ENABLED), or as
+a standalone worker::
+
+    python -m app.kpi [--once] [--rebuild --start ISO --end ISO]
+
+On Postgres concurrent runs (several workers) are serialized with an advisory
+lock; a worker that does not get it skips the round. Other databases have no
+such lock, so the in-app scheduler is off by default: enable it in a single
+worker or run the standalone worker once per deployment.
+
+A rebuild only recomputes buckets behind the watermark. When a granularity
+has no watermark yet, the rebuild first runs the scheduler's catch-up up to
+`end`, which materializes everything from the first event and sets it.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import delete, func, insert, text
+from sqlmodel import Session, select
+
+from .caching import bump_version
+from .core.config import settings
+from .db import engine
+from .models import Event, KpiSnapshot, KpiWatermark, ProductionRollup
+from .rollups import floor_ts, resolution_seconds
+from .shards import shards
+from . import downtime
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('1h', 'shift')
+VERSION_NAME = 'kpi'
+# arbitrary key for pg_try_advisory_xact_lock
+LOCK_KEY = 0x6B7069
+
+
+def oee_metrics(planned_seconds: float, downtime_seconds: float, produced: int, good: int,
+                ict_sum_seconds: float, ict_count: int) -> Dict[str, float]:
+    """OEE factors for a period; shared by `/reports/oee` and the snapshots."""
+    run_seconds = max(0.0, planned_seconds - downtime_seconds)
+    availability = run_seconds / planned_seconds if planned_seconds > 0 else 0.0
+
+    if produced > 0 and run_seconds > 0:
+        # average ideal cycle time
+        avg_ict = (ict_sum_seconds / ict_count) if ict_count > 0 else 0.0
+        if avg_ict > 0:
+            performance = (produced * avg_ict) / run_seconds
+        else:
+            performance = 1.0
+    else:
+        performance = 0.0
+
+    quality = (good / produced) if produced > 0 else 0.0
+
+    return {
+        'run_seconds': run_seconds,
+        'availability': availability,
+        'performance': performance,
+        'quality': quality,
+        'oee': availability * performance * quality,
+    }
+
+
+def compute(session: Session, granularity: str, lo: datetime, hi: datetime):
+    """Snapshot rows for every source with activity in buckets starting in [lo, hi)."""
+    acc = {}
+
+    def rec(bucket, source):
+        key = (bucket, source)
+        if key not in acc:
+            acc[key] = {'produced': 0, 'good': 0, 'ict_sum_ms': 0.0, 'ict_count': 0, 'downtime': 0.0}
+        return acc[key]
+
+    stmt = select(ProductionRollup).where(
+        ProductionRollup.resolution == granularity, ProductionRollup.bucket >= lo, ProductionRollup.bucket < hi)
+    for r in session.exec(stmt):
+        item = rec(r.bucket, r.source)
+        item['produced'] += r.produced
+        item['good'] += r.good
+        item['ict_sum_ms'] += r.ict_sum_ms
+        item['ict_count'] += r.ict_count
+
+    # merged downtime intervals, split at bucket boundaries
+    for (bucket, source), seconds in downtime.bucket_seconds(session, granularity, lo, hi).items():
+        rec(bucket, source)['downtime'] += seconds
+
+    planned = float(resolution_seconds(granularity))
+    now = datetime.utcnow()
+    rows = []
+    for (bucket, source), item in acc.items():
+        metrics = oee_metrics(planned, item['downtime'], item['produced'], item['good'],
+                              item['ict_sum_ms'] / 1000.0, item['ict_count'])
+        rows.append({'granularity': granularity, 'source': source, 'bucket': bucket, 'planned_seconds': planned,
+                     'downtime_seconds': item['downtime'], 'produced': item['produced'], 'good': item['good'],
+                     'ict_sum_ms': item['ict_sum_ms'], 'ict_count': item['ict_count'], 'computed_at': now, **metrics})
+    return rows
+
+
+def store(session: Session, granularity: str, lo: datetime, hi: datetime) -> int:
+    """Replace the snapshots of buckets in [lo, hi) (caller commits)."""
+    rows = compute(session, granularity, lo, hi)
+    session.execute(delete(KpiSnapshot).where(
+        KpiSnapshot.granularity == granularity, KpiSnapshot.bucket >= lo, KpiSnapshot.bucket < hi))
+    if rows:
+        session.execute(insert(KpiSnapshot), rows)
+    return len(rows)
+
+
+def try_lock(session: Session) -> bool:
+    """Transaction-scoped run lock; always granted on databases without advisory locks."""
+    if session.get_bind().dialect.name != 'postgresql':
+        return True
+    return bool(session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': LOCK_KEY}).scalar())
+
+
+def first_bucket(session: Session, granularity: str) -> Optional[datetime]:
+    found = [ts for ts in shards.gather(session, lambda s: s.exec(select(func.min(Event.ts))).one()) if ts is not None]
+    return floor_ts(min(found), granularity) if found else None
+
+
+def run(granularity: str, now: Optional[datetime] = None) -> int:
+    """Materialize closed buckets after the watermark; returns the number of rows written."""
+    step = timedelta(seconds=resolution_seconds(granularity))
+    closed = floor_ts(now or datetime.utcnow(), granularity)
+    written = 0
+    first = True
+    while True:
+        with Session(engine) as session:
+            if not try_lock(session):
+                return written
+            mark = session.get(KpiWatermark, granularity)
+            if mark is not None:
+                lo = mark.watermark
+                if first:
+                    lo -= step * settings.KPI_LOOKBACK_BUCKETS
+            else:
+                lo = first_bucket(session, granularity)
+                if lo is None:
+                    return written
+                mark = KpiWatermark(granularity=granularity, watermark=lo)
+            if lo >= closed:
+                return written
+            hi = min(closed, lo + step * settings.KPI_CHUNK_BUCKETS)
+            written += store(session, granularity, lo, hi)
+            mark.watermark = max(mark.watermark, hi)
+            session.add(mark)
+            bump_version(session, VERSION_NAME)
+            session.commit()
+            first = False
+            if hi >= closed:
+                return written
+
+
+def run_all(now: Optional[datetime] = None) -> int:
+    return sum(run(granularity, now) for granularity in GRANULARITIES)
+
+
+def rebuild(start: datetime, end: datetime) -> int:
+    """Recompute the materialized snapshots of buckets overlapping [start, end).
+
+    Granularities without a watermark are first caught up to `end` by `run`.
+    """
+    written = 0
+    for granularity in GRANULARITIES:
+        with Session(engine) as session:
+            missing = session.get(KpiWatermark, granularity) is None
+        if missing:
+            written += run(granularity, min(end, datetime.utcnow()))
+    with Session(engine) as session:
+        for granularity in GRANULARITIES:
+            lo = floor_ts(start, granularity)
+            hi = floor_ts(end, granularity)
+            if hi < end:
+                hi += timedelta(seconds=resolution_seconds(granularity))
+            mark = session.get(KpiWatermark, granularity)
+            # never materialize past the watermark; the scheduler owns newer buckets
+            hi = min(hi, mark.watermark if mark is not None else lo)
+            if lo < hi:
+                written += store(session, granularity, lo, hi)
+        bump_version(session, VERSION_NAME)
+        session.commit()
+    return written
+
+
+async def scheduler() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            written = await loop.run_in_executor(None, run_all)
+            if written:
+                logger.info("stored %d kpi snapshots", written)
+        except Exception:
+            logger.exception("kpi snapshot run failed")
+        await asyncio.sleep(settings.KPI_INTERVAL_SECONDS)
+
+
+_state = {'task': None}
+
+
+def start() -> None:
+    _state['task'] = asyncio.get_running_loop().create_task(scheduler())
+
+
+def stop() -> None:
+    if _state['task'] is not None:
+        _state['task'].cancel()
+        _state['task'] = None
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from .ingest import parse_ts
+
+    parser = argparse.ArgumentParser(description='Materialize KPI snapshots')
+    parser.add_argument('--once', action='store_true', help='run one round and exit')
+    parser.add_argument('--rebuild', action='store_true', help='recompute [--start, --end) and exit')
+    parser.add_argument('--start', help='ISO datetime (with --rebuild)')
+    parser.add_argument('--end', help='ISO datetime (with --rebuild, defaults to now)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.rebuild:
+        if not args.start:
+            parser.error('--rebuild needs --start')
+        print(f'{rebuild(parse_ts(args.start), parse_ts(args.end) or datetime.utcnow())} snapshots rebuilt')
+    else:
+        while True:
+            print(f'{run_all()} snapshots stored')
+            if args.once:
+                break
+            time.sleep(settings.KPI_INTERVAL_SECONDS)
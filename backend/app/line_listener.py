@@ -0,0 +1,281 @@
+"""Optional TCP/UDP listener for a compact line protocol.
+
+One event per line::
+
+    source,type,ts,field=value,field=value
+
+`ts` is ISO 8601, epoch seconds or empty (server time); field values are
+numbers and become the event payload. Lines starting with ``#`` are ignored.
+When LINE_REQUIRE_KEY is set, a TCP connection (or a UDP datagram) must start
+with ``AUTH <gateway api key>`` and may only post for that key's sources.
+
+Parsed rows are queued to a single writer task that coalesces them into
+batches of up to LINE_BATCH_SIZE and stores them through the same
+`ingest.insert_rows` path as `/events/bulk`. The queue is bounded: a TCP
+connection stops being read while it is full, so backpressure reaches the
+sender through TCP flow control; UDP datagrams are dropped and counted.
+A TCP connection sending a line longer than LINE_MAX_LINE_BYTES gets
+``ERR line too long`` and is closed. Batches the writer fails to store are
+logged line by line on the ``app.line_listener.lost`` logger, in the protocol
+format, so they can be sent again.
+
+Try it locally with ``printf 'M-A,production,,produced=5,good=5\\n' | nc localhost 8094``.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from itertools import count
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from .api_keys import index as key_index
+from .core.config import settings
+from .db import engine
+from .sources import directory
+from .writer import insert_events
+from . import api_keys, ingest
+
+logger = logging.getLogger(__name__)
+lost_logger = logging.getLogger(__name__ + '.lost')
+
+stats = Counter()
+connections: Dict[int, dict] = {}
+_conn_ids = count(1)
+_state = {'queue': None, 'servers': [], 'writer': None}
+
+
+class LineError(ValueError):
+    pass
+
+
+def parse_number(raw: bytes):
+    try:
+        return int(raw)
+    except ValueError:
+        return float(raw)
+
+
+def parse_line(line: bytes) -> Optional[dict]:
+    """Parse one protocol line into an event row; None for blank/comment lines."""
+    line = line.strip()
+    if not line or line.startswith(b'#'):
+        return None
+    parts = line.split(b',')
+    if len(parts) < 3 or not parts[0] or not parts[1]:
+        raise LineError("expected source,type,ts[,field=value...]")
+    payload = {}
+    try:
+        source, type_, ts_raw = (part.decode() for part in parts[:3])
+        for field in parts[3:]:
+            key, _, value = field.partition(b'=')
+            if not key:
+                raise ValueError("empty field name")
+            payload[key.decode()] = parse_number(value)
+    except (ValueError, UnicodeDecodeError):
+        raise LineError(f"bad field in {line[:80]!r}")
+    if ts_raw:
+        try:
+            ts_raw = float(ts_raw)
+        except ValueError:
+            pass
+    try:
+        return ingest.make_row(source, type_, payload, ts_raw or None)
+    except HTTPException as exc:
+        raise LineError(exc.detail)
+
+
+def format_line(row: dict) -> str:
+    """A stored row back in protocol form (for the lost-rows log)."""
+    fields = ''.join(f',{key}={value}' for key, value in json.loads(row['payload']).items())
+    return f"{row['source']},{row['type']},{row['ts'].isoformat()}{fields}"
+
+
+def write_batch(rows: List[dict]) -> None:
+    with Session(engine) as session:
+        insert_events(session, rows)
+
+
+async def writer(queue: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    flush_after = settings.LINE_FLUSH_MS / 1000.0
+    while True:
+        rows = list(await queue.get())
+        deadline = loop.time() + flush_after
+        while len(rows) < settings.LINE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                rows.extend(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await loop.run_in_executor(None, write_batch, rows)
+            stats['inserted'] += len(rows)
+            stats['batches'] += 1
+        except Exception:
+            stats['write_errors'] += 1
+            stats['lost_rows'] += len(rows)
+            logger.exception("line listener failed to store %d events; they are logged on %s", len(rows), lost_logger.name)
+            for row in rows:
+                lost_logger.error(format_line(row))
+
+
+def authenticate(line: bytes):
+    if not line.startswith(b'AUTH '):
+        return None
+    with Session(engine) as session:
+        principal = key_index.lookup(session, line[5:].strip().decode())
+        if principal is not None and principal.sources is not None:
+            # source scopes are checked against the in-memory directory (api_keys.allows)
+            directory.labels(session)
+        return principal
+
+
+def parse_chunk(lines: List[bytes], principal, conn: dict) -> List[dict]:
+    rows = []
+    for line in lines:
+        try:
+            row = parse_line(line)
+        except LineError:
+            conn['errors'] += 1
+            stats['parse_errors'] += 1
+            continue
+        if row is None:
+            continue
+        if not api_keys.allows(principal, row['source']):
+            conn['errors'] += 1
+            stats['denied'] += 1
+            continue
+        rows.append(row)
+    conn['lines'] += len(rows)
+    stats['lines'] += len(rows)
+    return rows
+
+
+async def handle_tcp(reader: asyncio.StreamReader, writer_: asyncio.StreamWriter) -> None:
+    conn_id = next(_conn_ids)
+    peer = writer_.get_extra_info('peername')
+    conn = connections[conn_id] = {'peer': str(peer), 'since': datetime.utcnow().isoformat(), 'bytes': 0, 'lines': 0, 'errors': 0, 'waits': 0}
+    stats['connections'] += 1
+    queue = _state['queue']
+    principal = None
+    buffer = b''
+    try:
+        if settings.LINE_REQUIRE_KEY:
+            try:
+                first = await reader.readline()
+            except ValueError:
+                # longer than the stream limit; certainly not a key
+                first = b''
+            principal = await asyncio.get_running_loop().run_in_executor(None, authenticate, first.strip())
+            if principal is None:
+                writer_.write(b'ERR auth\n')
+                await writer_.drain()
+                return
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            conn['bytes'] += len(chunk)
+            buffer += chunk
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+            if len(buffer) > settings.LINE_MAX_LINE_BYTES:
+                stats['oversized_lines'] += 1
+                writer_.write(b'ERR line too long\n')
+                await writer_.drain()
+                return
+            rows = parse_chunk(lines, principal, conn)
+            if rows:
+                if queue.full():
+                    conn['waits'] += 1
+                    stats['backpressure_waits'] += 1
+                # blocks (and stops reading this socket) while the writer is behind
+                await queue.put(rows)
+        if buffer:
+            rows = parse_chunk([buffer], principal, conn)
+            if rows:
+                await queue.put(rows)
+    finally:
+        connections.pop(conn_id, None)
+        writer_.close()
+
+
+class UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.tasks = set()
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if not settings.LINE_REQUIRE_KEY:
+            self.enqueue(data.split(b'\n'), None)
+            return
+        # the key lookup may refresh the index from the database, so it runs off the event loop
+        task = asyncio.get_running_loop().create_task(self.authenticated(data))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def authenticated(self, data: bytes) -> None:
+        lines = data.split(b'\n')
+        principal = await asyncio.get_running_loop().run_in_executor(None, authenticate, lines.pop(0).strip())
+        if principal is None:
+            stats['denied'] += 1
+            return
+        self.enqueue(lines, principal)
+
+    def enqueue(self, lines: List[bytes], principal) -> None:
+        conn = {'lines': 0, 'errors': 0}
+        rows = parse_chunk(lines, principal, conn)
+        if not rows:
+            return
+        try:
+            _state['queue'].put_nowait(rows)
+        except asyncio.QueueFull:
+            stats['udp_dropped'] += len(rows)
+
+
+async def start() -> None:
+    loop = asyncio.get_running_loop()
+    queue = _state['queue'] = asyncio.Queue(maxsize=settings.LINE_MAX_PENDING_BATCHES)
+    _state['writer'] = loop.create_task(writer(queue))
+    host = settings.LINE_LISTENER_HOST
+    if settings.LINE_TCP_PORT:
+        # reuse_port lets every uvicorn worker accept on the same port
+        server = await asyncio.start_server(handle_tcp, host, settings.LINE_TCP_PORT, reuse_port=True)
+        _state['servers'].append(server)
+    if settings.LINE_UDP_PORT:
+        transport, _ = await loop.create_datagram_endpoint(UDPProtocol, local_addr=(host, settings.LINE_UDP_PORT), reuse_port=True)
+        _state['servers'].append(transport)
+    stats['started_at'] = int(time.time())
+    logger.info("line listener on tcp:%s udp:%s", settings.LINE_TCP_PORT, settings.LINE_UDP_PORT)
+
+
+async def stop() -> None:
+    for server in _state['servers']:
+        server.close()
+    _state['servers'] = []
+    queue = _state['queue']
+    if queue is not None:
+        # give the writer a moment to flush what is already queued
+        for _ in range(50):
+            if queue.empty():
+                break
+            await asyncio.sleep(0.1)
+    if _state['writer'] is not None:
+        _state['writer'].cancel()
+        _state['writer'] = None
+
+
+def snapshot() -> dict:
+    queue = _state['queue']
+    return {
+        'enabled': settings.LINE_LISTENER_ENABLED,
+        'pending_batches': queue.qsize() if queue is not None else 0,
+        'counters': dict(stats),
+        'connections': list(connections.values()),
+    }
@@ -0,0 +1,268 @@
+"""Live rolling-window OEE from in-memory ring buffers.
+
+Each machine gets a ring of LIVE_OEE_HORIZON_SECONDS / LIVE_OEE_SLOT_SECONDS
+time slots holding produced, good and ideal-cycle-time sums, plus its merged
+downtime intervals of the same horizon. New events are folded in (O(1) per
+event), so ``/reports/oee/live`` reads at most one ring's worth of slots per
+request, however many events the window holds, and never touches the
+database.
+
+Slots are stamped with their absolute slot number; a slot from a previous
+lap of the ring is reset when written and skipped when read, so nothing has
+to expire the ring on a timer. Events older than the horizon are ignored.
+
+Buffers are per worker process, and every worker fills its own from the
+database rather than from the batches it ingests itself, so each one sees
+the events of all workers, the line listener and bulk loaders alike. Every
+LIVE_OEE_REFRESH_SECONDS a background task reads the events stored since
+its last read (by id, per event shard). Ids can commit out of order on
+Postgres, so ids above the last settled one are re-read and skipped until
+they have been known for LIVE_OEE_SETTLE_SECONDS. `warm` starts the tail at
+the first event of the horizon and loads the downtime intervals overlapping
+it. Machines are keyed by `Event.machine_id`. The warm-up and the refreshes
+run in the default executor, so worker startup does not wait for the scan.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from .core.config import settings
+from .db import engine
+from .models import DowntimeInterval, Event
+from .rollups import production_values
+from .shards import shards
+from .sources import directory
+from . import downtime
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+TYPES = ('production', 'downtime')
+
+
+def slot_number(ts: datetime) -> int:
+    return int((ts - EPOCH).total_seconds() // settings.LIVE_OEE_SLOT_SECONDS)
+
+
+class Ring:
+    __slots__ = ('tags', 'produced', 'good', 'ict_ms', 'ict_count', 'stops')
+
+    def __init__(self, size: int):
+        self.tags = [-1] * size
+        self.produced = [0] * size
+        self.good = [0] * size
+        self.ict_ms = [0.0] * size
+        self.ict_count = [0] * size
+        # merged [start, end) downtime intervals within the horizon
+        self.stops: List[Tuple[datetime, datetime]] = []
+
+    def add(self, number: int, produced: int, good: int, ict_ms: float, ict_count: int) -> None:
+        i = number % len(self.tags)
+        if self.tags[i] != number:
+            self.tags[i] = number
+            self.produced[i] = self.good[i] = self.ict_count[i] = 0
+            self.ict_ms[i] = 0.0
+        self.produced[i] += produced
+        self.good[i] += good
+        self.ict_ms[i] += ict_ms
+        self.ict_count[i] += ict_count
+
+    def add_stop(self, start: datetime, end: datetime, horizon_start: datetime) -> None:
+        self.stops = [(s, e) for s, e in downtime.merge(self.stops + [(start, end)]) if e > horizon_start]
+
+    def totals(self, first: int, last: int) -> Tuple[int, int, float, int]:
+        """Sums over slot numbers first..last."""
+        produced = good = ict_count = 0
+        ict_ms = 0.0
+        size = len(self.tags)
+        for number in range(first, last + 1):
+            i = number % size
+            if self.tags[i] == number:
+                produced += self.produced[i]
+                good += self.good[i]
+                ict_ms += self.ict_ms[i]
+                ict_count += self.ict_count[i]
+        return produced, good, ict_ms, ict_count
+
+
+_rings: Dict[int, Ring] = {}
+_lock = threading.Lock()
+
+
+def ring_size() -> int:
+    return max(settings.LIVE_OEE_HORIZON_SECONDS // settings.LIVE_OEE_SLOT_SECONDS, 1)
+
+
+def ring_for(key: int) -> Ring:
+    ring = _rings.get(key)
+    if ring is None:
+        ring = _rings[key] = Ring(ring_size())
+    return ring
+
+
+def payload_of(row) -> Optional[dict]:
+    payload = row['payload']
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except Exception:
+            return None
+    return payload or None
+
+
+def feed(rows: Iterable[dict], now: Optional[datetime] = None) -> None:
+    """Fold committed event rows into the rings."""
+    now = now or datetime.utcnow()
+    horizon_start = now - timedelta(seconds=settings.LIVE_OEE_HORIZON_SECONDS)
+    oldest = slot_number(now) - ring_size() + 1
+    with _lock:
+        for row in rows:
+            if row['type'] not in TYPES:
+                continue
+            key = row['machine_id']
+            if row['type'] == 'downtime':
+                seconds = downtime.duration_seconds(row['payload'])
+                end = row['ts'] + timedelta(seconds=seconds)
+                if seconds > 0 and end > horizon_start:
+                    ring_for(key).add_stop(row['ts'], end, horizon_start)
+                continue
+            number = slot_number(row['ts'])
+            payload = payload_of(row)
+            if number < oldest or payload is None:
+                continue
+            ring_for(key).add(number, *production_values(payload))
+
+
+class Tail:
+    """Read position in one shard's events.
+
+    Ids up to `settled` are done; `recent` holds the ids read above it (with
+    when they were first seen), which later reads skip.
+    """
+
+    def __init__(self, settled: int):
+        self.settled = settled
+        self.recent: Dict[int, float] = {}
+
+    def read(self, session: Session, chunk: int = 5000) -> None:
+        now = datetime.utcnow()
+        clock = time.monotonic()
+        stmt = select(Event.id, Event.ts, Event.machine_id, Event.type, Event.payload).where(
+            Event.id > self.settled, Event.type.in_(TYPES))
+        for part in session.execute(stmt.execution_options(yield_per=chunk)).partitions():
+            fresh = [row._mapping for row in part if row.id not in self.recent]
+            for row in fresh:
+                self.recent[row['id']] = clock
+            feed(fresh, now)
+        # an id seen LIVE_OEE_SETTLE_SECONDS ago leaves no gap below it that could still commit
+        due = [i for i, seen in self.recent.items() if clock - seen >= settings.LIVE_OEE_SETTLE_SECONDS]
+        if due:
+            self.settled = max(due)
+            self.recent = {i: seen for i, seen in self.recent.items() if i > self.settled}
+
+
+_tails: Dict[int, Tail] = {}
+
+
+def refresh() -> None:
+    """Fold in the events stored since the last call, on every shard."""
+    for index, eng in enumerate(shards.engines):
+        tail = _tails.get(index)
+        if tail is None:
+            continue
+        with Session(eng) as session:
+            tail.read(session)
+
+
+def window(key: int, seconds: int, now: Optional[datetime] = None) -> dict:
+    """Totals of the last `seconds` (whole slots, the current one partial) for one machine."""
+    now = now or datetime.utcnow()
+    last = slot_number(now)
+    first = last - max(seconds // settings.LIVE_OEE_SLOT_SECONDS, 1) + 1
+    start = EPOCH + timedelta(seconds=first * settings.LIVE_OEE_SLOT_SECONDS)
+    with _lock:
+        ring = _rings.get(key)
+        produced, good, ict_ms, ict_count = ring.totals(first, last) if ring else (0, 0, 0.0, 0)
+        stops = list(ring.stops) if ring else []
+    return {
+        'start': start,
+        'end': now,
+        'produced': produced,
+        'good': good,
+        'ict_sum_seconds': ict_ms / 1000.0,
+        'ict_count': ict_count,
+        'downtime_seconds': downtime.clipped(stops, start, now),
+    }
+
+
+def warm(session: Session, now: Optional[datetime] = None) -> None:
+    """Refill the rings from the database's last horizon."""
+    now = now or datetime.utcnow()
+    lo = now - timedelta(seconds=settings.LIVE_OEE_HORIZON_SECONDS)
+    reset()
+    # the tail starts at the first production event of the horizon (downtime comes from the intervals)
+    first = select(func.min(Event.id)).where(Event.type == 'production', Event.ts >= lo)
+    last = select(func.max(Event.id))
+    for index, eng in enumerate(shards.engines):
+        with Session(eng) as shard_session:
+            start = shard_session.exec(first).one()
+            if start is None:
+                start = (shard_session.exec(last).one() or 0) + 1
+        _tails[index] = Tail(start - 1)
+    refresh()
+    stops = select(DowntimeInterval.source, DowntimeInterval.machine_id, DowntimeInterval.start,
+                   DowntimeInterval.end).where(DowntimeInterval.end > lo)
+    with _lock:
+        for source, machine_id, start, end in session.execute(stops):
+            # intervals merged before machine ids were stored carry only the source
+            key = machine_id if machine_id is not None else directory.lookup(session, source)
+            if key is not None:
+                ring_for(key).add_stop(start, end, lo)
+
+
+def reset() -> None:
+    with _lock:
+        _rings.clear()
+    _tails.clear()
+
+
+def warm_from_db() -> None:
+    try:
+        with Session(engine) as session:
+            warm(session)
+    except Exception:
+        # half-warmed rings would be silently short; the next pass starts over
+        reset()
+        raise
+
+
+async def follow() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        # the first pass (and any after a failed one) warms the rings, later ones read what is new
+        try:
+            await loop.run_in_executor(None, refresh if _tails else warm_from_db)
+        except Exception:
+            logger.exception("live OEE refresh failed")
+        await asyncio.sleep(settings.LIVE_OEE_REFRESH_SECONDS)
+
+
+_state = {'task': None}
+
+
+def start() -> None:
+    """Warm the rings and keep them following the database, in a background task."""
+    _state['task'] = asyncio.get_running_loop().create_task(follow())
+
+
+def stop() -> None:
+    if _state['task'] is not None:
+        _state['task'].cancel()
+        _state['task'] = None
@@ -1,12 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import SQLModel
+from fastapi.middleware.gzip import GZipMiddleware
 
+from .core.config import settings
 from .db import engine
-from .routers import auth, machines, orders, users, events, reports
+from . import compaction, kpi, line_listener, live, schema
+from .writer import writer
+from .ratelimit import RateLimitMiddleware
+from .routers import auth, machines, orders, users, events, reports, alerts, health, gateway_keys, batch
 
 app = FastAPI(title="Production Optimization API")
 
+# Innermost: rejected requests still get CORS headers and compression
+app.add_middleware(RateLimitMiddleware)
+
 # Allow frontend origin; adjust in production to restrict origins
 app.add_middleware(
     CORSMiddleware,
@@ -14,20 +21,85 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Prefer brotli when brotli-asgi is installed (it falls back to gzip per Accept-Encoding)
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+else:
+    app.add_middleware(BrotliMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE, gzip_fallback=True)
+
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(machines.router, prefix="/machines", tags=["machines"])
 app.include_router(orders.router, prefix="/orders", tags=["orders"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(events.router, prefix="/events", tags=["events"])
 app.include_router(reports.router, prefix="/reports", tags=["reports"])
+app.include_router(alerts.router, prefix="/alerts", tags=["alerts"])
+app.include_router(gateway_keys.router, prefix="/gateway-keys", tags=["gateway-keys"])
+app.include_router(health.router, prefix="/health", tags=["health"])
+app.include_router(batch.router, prefix="/batch", tags=["batch"])
 
 
 @app.on_event("startup")
 def on_startup():
-    # create tables (for demo). For production use Alembic migrations.
-    SQLModel.metadata.create_all(engine)
+    # SCHEMA_MODE=create_all creates tables (demo); in production Alembic runs once
+    # in the entrypoint and workers only check the revision.
+    schema.prepare(engine)
+
+
+@app.on_event("startup")
+async def start_live_oee():
+    if settings.LIVE_OEE_ENABLED:
+        live.start()
+
+
+@app.on_event("shutdown")
+async def stop_live_oee():
+    live.stop()
+
+
+@app.on_event("startup")
+async def start_line_listener():
+    if settings.LINE_LISTENER_ENABLED:
+        await line_listener.start()
+
+
+@app.on_event("shutdown")
+async def stop_line_listener():
+    if settings.LINE_LISTENER_ENABLED:
+        await line_listener.stop()
+
+
+@app.on_event("shutdown")
+def stop_sqlite_writer():
+    # after the line listener has flushed its queue
+    writer.stop()
+
+
+@app.on_event("startup")
+async def start_kpi_scheduler():
+    if settings.KPI_SCHEDULER_ENABLED:
+        kpi.start()
+
+
+@app.on_event("shutdown")
+async def stop_kpi_scheduler():
+    kpi.stop()
+
+
+@app.on_event("startup")
+async def start_compaction_scheduler():
+    if settings.COMPACTION_SCHEDULER_ENABLED:
+        compaction.start()
+
+
+@app.on_event("shutdown")
+async def stop_compaction_scheduler():
+    compaction.stop()
 
 
 @app.get("/")
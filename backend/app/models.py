@@ -1,4 +1,5 @@
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 from datetime import datetime
 
@@ -17,6 +18,8 @@ class Machine(SQLModel, table=True):
     code: Optional[str] = Field(default=None, index=True)
     status: str = Field(default="idle")
     last_heartbeat: Optional[datetime] = None
+    # created by ingest for an unknown source (see app.sources); hidden from the listing until edited
+    auto_registered: bool = Field(default=False)
 
 
 class Order(SQLModel, table=True):
@@ -27,11 +30,120 @@ class Order(SQLModel, table=True):
     priority: int = Field(default=1)
     status: str = Field(default="pending")
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # set while in progress on a machine; see app.eta
+    machine_id: Optional[int] = Field(default=None, foreign_key="machine.id", ondelete="SET NULL")
+    started_at: Optional[datetime] = None
+    progress: int = Field(default=0)
+    eta: Optional[datetime] = None
 
 
 class Event(SQLModel, table=True):
+    __table_args__ = (Index('ix_event_type_ts', 'type', 'ts'), Index('ix_event_machine_id_ts', 'machine_id', 'ts'))
+
     id: Optional[int] = Field(default=None, primary_key=True)
     ts: datetime = Field(default_factory=datetime.utcnow)
-    source: str
+    # the machine the source string resolved to at ingest (see app.sources)
+    machine_id: int = Field(foreign_key="machine.id", ondelete="RESTRICT")
     type: str
     payload: Optional[str] = None
+
+
+class DataVersion(SQLModel, table=True):
+    """Monotonic modification counter per data set, used to derive ETags."""
+    name: str = Field(primary_key=True)
+    version: int = Field(default=0)
+
+
+class ProductionRollup(SQLModel, table=True):
+    """Pre-aggregated production per source and time bucket (see app.rollups)."""
+    resolution: str = Field(primary_key=True)
+    bucket: datetime = Field(primary_key=True)
+    source: str = Field(primary_key=True)
+    produced: int = Field(default=0)
+    good: int = Field(default=0)
+    ict_sum_ms: float = Field(default=0.0)
+    ict_count: int = Field(default=0)
+    events: int = Field(default=0)
+
+
+class DowntimeInterval(SQLModel, table=True):
+    """Merged, non-overlapping [start, end) downtime per source (see app.downtime)."""
+    __table_args__ = (Index('ix_downtimeinterval_source_start', 'source', 'start'),
+                      Index('ix_downtimeinterval_end', 'end'))
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    source: str
+    machine_id: Optional[int] = Field(default=None, foreign_key="machine.id", ondelete="SET NULL")
+    start: datetime
+    end: datetime
+
+
+class CycleTimeSketch(SQLModel, table=True):
+    """Serialized DDSketch of cycle times per source and hour (see app.sketches)."""
+    source: str = Field(primary_key=True)
+    hour: datetime = Field(primary_key=True)
+    count: int = Field(default=0)
+    sketch: str = ""
+
+
+class Alert(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    ts: datetime = Field(index=True)
+    source: str = Field(index=True)
+    kind: str
+    value: float
+    baseline_mean: float
+    baseline_std: float
+    score: float
+    acknowledged: bool = Field(default=False)
+
+
+class GatewayKey(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str
+    prefix: str = Field(index=True)
+    key_hash: str = Field(index=True, unique=True)
+    # comma-separated source strings the key may post for; '*' for any
+    sources: str = Field(default="*")
+    active: bool = Field(default=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class KpiSnapshot(SQLModel, table=True):
+    """Availability/performance/quality/OEE per source and closed hour or shift (see app.kpi)."""
+    __table_args__ = (Index('ix_kpisnapshot_granularity_bucket', 'granularity', 'bucket'),)
+
+    granularity: str = Field(primary_key=True)
+    source: str = Field(primary_key=True)
+    bucket: datetime = Field(primary_key=True)
+    planned_seconds: float
+    downtime_seconds: float = Field(default=0.0)
+    run_seconds: float
+    produced: int = Field(default=0)
+    good: int = Field(default=0)
+    ict_sum_ms: float = Field(default=0.0)
+    ict_count: int = Field(default=0)
+    availability: float
+    performance: float
+    quality: float
+    oee: float
+    computed_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class KpiWatermark(SQLModel, table=True):
+    """End of the last bucket materialized into KpiSnapshot, per granularity."""
+    granularity: str = Field(primary_key=True)
+    watermark: datetime
+
+
+class MachineThroughput(SQLModel, table=True):
+    """EWMA of good units per second per machine, updated at ingest (see app.eta)."""
+    machine_id: int = Field(primary_key=True, foreign_key="machine.id", ondelete="CASCADE")
+    rate: Optional[float] = None
+    last_ts: Optional[datetime] = None
+
+
+class CompactionWatermark(SQLModel, table=True):
+    """End of the last time window whose events were compacted (see app.compaction)."""
+    name: str = Field(primary_key=True)
+    watermark: datetime
@@ -0,0 +1,270 @@
+"""Per-client rate limiting and load shedding.
+
+Requests are sorted into route classes by path prefix (`ROUTE_CLASSES`) and
+identified by client: a known gateway API key, the user of a valid bearer
+token, or else the client address (also for keys that are not known, so
+fresh random keys do not buy fresh buckets). Two checks run before the request reaches the
+app:
+
+- a token bucket per (route class, client): RATE_LIMIT_RATES[class]
+  requests per second with bursts of RATE_LIMIT_BURSTS[class]; over the
+  limit the request gets ``429`` with ``Retry-After``
+- a concurrency limit per route class: at most CONCURRENCY_LIMITS[class]
+  requests run at once in this worker, up to CONCURRENCY_QUEUE[class] more
+  wait at most CONCURRENCY_QUEUE_TIMEOUT_MS, and anything beyond is shed at
+  once with ``503``
+
+Buckets live in worker memory. With RATE_LIMIT_REDIS_URL set (needs the
+optional `redis` package) they are kept in Redis so all workers share one
+budget per client; if Redis is unreachable the worker falls back to its
+local buckets rather than rejecting traffic. Concurrency limits always
+protect the individual worker's threadpool and database pool.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Deque, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from .api_keys import index as key_index
+from .core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# first matching prefix wins; None is never limited
+ROUTE_CLASSES = (
+    ('/events', 'ingest'),
+    ('/reports', 'reports'),
+    ('/auth', 'auth'),
+    ('/health', None),
+    ('/docs', None),
+    ('/openapi.json', None),
+)
+MAX_LOCAL_BUCKETS = 100_000
+
+stats = Counter()
+limiters: Dict[str, 'ClassLimiter'] = {}
+_state = {'remote': None}
+
+REDIS_TOKEN_BUCKET = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+def route_class(path: str) -> Optional[str]:
+    if path == '/':
+        return None
+    for prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return 'api'
+
+
+@lru_cache(maxsize=4096)
+def token_subject(token: str) -> Optional[str]:
+    from jose import JWTError, jwt
+
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"]).get("sub")
+    except JWTError:
+        return None
+
+
+def client_id(scope) -> str:
+    """Rate-limit identity of a request, derived from headers only (no database access)."""
+    headers = dict(scope.get('headers') or ())
+    api_key = headers.get(b'x-api-key')
+    if api_key:
+        # only keys in the loaded index count as an identity; a forged key cannot drain a real
+        # one, and an unknown one is limited by address below
+        principal = key_index.cached(api_key.decode('latin-1'))
+        if principal is not None:
+            return f'key:{principal.id}'
+    auth = headers.get(b'authorization', b'')
+    if auth[:7].lower() == b'bearer ':
+        subject = token_subject(auth[7:].decode('latin-1').strip())
+        if subject:
+            return 'user:' + subject
+    client = scope.get('client')
+    return 'ip:' + (client[0] if client else 'unknown')
+
+
+class LocalBuckets:
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], list] = {}
+
+    def take(self, key: Tuple[str, str], rate: float, burst: float) -> float:
+        """Take one token; returns 0 when allowed, else seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_LOCAL_BUCKETS:
+                self._evict(now)
+            bucket = self._buckets[key] = [float(burst), now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+
+    def _evict(self, now: float) -> None:
+        # drop buckets idle long enough to have refilled completely
+        idle = [key for key, (_, ts) in self._buckets.items()
+                if (now - ts) * settings.RATE_LIMIT_RATES.get(key[0], 1.0) >= settings.RATE_LIMIT_BURSTS.get(key[0], 1)]
+        for key in idle:
+            del self._buckets[key]
+        if len(self._buckets) >= MAX_LOCAL_BUCKETS:
+            self._buckets.clear()
+
+
+class RedisBuckets:
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(REDIS_TOKEN_BUCKET)
+
+    async def take(self, key: Tuple[str, str], rate: float, burst: float) -> float:
+        return float(await self._script(keys=[f"ratelimit:{key[0]}:{key[1]}"], args=[rate, burst]))
+
+
+class ClassLimiter:
+    """Concurrency limit with a bounded FIFO wait queue for one route class.
+
+    A released slot is handed straight to the longest waiter, so requests
+    arriving meanwhile cannot take it first.
+    """
+
+    def __init__(self, limit: int, queue: int):
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue:
+            return False
+        slot = asyncio.get_running_loop().create_future()
+        self._waiters.append(slot)
+        try:
+            await asyncio.wait_for(slot, timeout)
+            return True
+        except BaseException as exc:
+            if slot.done() and not slot.cancelled():
+                # handed a slot just as the wait ended
+                if isinstance(exc, asyncio.TimeoutError):
+                    return True
+                self._pass_on()
+            elif slot in self._waiters:
+                self._waiters.remove(slot)
+            if isinstance(exc, asyncio.TimeoutError):
+                return False
+            raise
+
+    def _pass_on(self) -> None:
+        while self._waiters:
+            slot = self._waiters.popleft()
+            if not slot.done():
+                # the slot changes hands; `active` stays the same
+                slot.set_result(True)
+                return
+        self.active -= 1
+
+    async def release(self) -> None:
+        self._pass_on()
+
+
+def limiter(name: str) -> Optional[ClassLimiter]:
+    if name not in settings.CONCURRENCY_LIMITS:
+        return None
+    found = limiters.get(name)
+    if found is None:
+        found = limiters[name] = ClassLimiter(settings.CONCURRENCY_LIMITS[name], settings.CONCURRENCY_QUEUE.get(name, 0))
+    return found
+
+
+_local = LocalBuckets()
+
+
+async def wait_time(name: str, client: str) -> float:
+    rate = settings.RATE_LIMIT_RATES.get(name)
+    if not rate:
+        return 0.0
+    burst = settings.RATE_LIMIT_BURSTS.get(name, rate)
+    remote = _state['remote']
+    if remote is not None:
+        try:
+            return await remote.take((name, client), rate, burst)
+        except Exception:
+            stats['redis_errors'] += 1
+    return _local.take((name, client), rate, burst)
+
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+        if settings.RATE_LIMIT_REDIS_URL and _state['remote'] is None:
+            try:
+                _state['remote'] = RedisBuckets(settings.RATE_LIMIT_REDIS_URL)
+            except ImportError:
+                logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package is missing; using in-memory buckets")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not settings.RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+        name = route_class(scope['path'])
+        if name is None or scope['method'] == 'OPTIONS':
+            return await self.app(scope, receive, send)
+
+        wait = await wait_time(name, client_id(scope))
+        if wait > 0:
+            stats[f'{name}_limited'] += 1
+            response = JSONResponse({'detail': 'Too many requests'}, status_code=429,
+                                    headers={'Retry-After': str(max(1, round(wait)))})
+            return await response(scope, receive, send)
+
+        gate = limiter(name)
+        if gate is None:
+            return await self.app(scope, receive, send)
+        if not await gate.acquire(settings.CONCURRENCY_QUEUE_TIMEOUT_MS / 1000.0):
+            stats[f'{name}_shed'] += 1
+            response = JSONResponse({'detail': 'Server busy'}, status_code=503, headers={'Retry-After': '1'})
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await gate.release()
+
+
+def snapshot() -> dict:
+    return {
+        'enabled': settings.RATE_LIMIT_ENABLED,
+        'backend': 'redis' if _state['remote'] is not None else 'memory',
+        'counters': dict(stats),
+        'concurrency': {name: {'active': l.active, 'waiting': l.waiting, 'limit': l.limit, 'queue': l.queue}
+                        for name, l in limiters.items()},
+    }
@@ -0,0 +1,266 @@
+"""Replay exported events from NDJSON archives.
+
+::
+
+    python -m app.replay events-2026-*.ndjson.zst [--workers N] [--batch 20000] [--copy]
+
+Each line is an event object as accepted by ``/events/bulk`` in NDJSON form
+(``{"source", "type", "ts", "payload"}``). Files may be plain, ``.gz`` or
+``.zst`` and are read as streams. Batches of lines are parsed and inserted by
+a pool of worker processes through `ingest.insert_rows(derived=False)` -
+or, with ``--copy`` on Postgres, with ``COPY ... FROM STDIN`` - and the
+rollups, cycle-time sketches and KPI snapshots of the loaded time range are
+rebuilt once at the end (skip with ``--no-rebuild``), as are the downtime
+intervals. Anomaly alerts are not raised for replayed history.
+
+Progress is checkpointed per file (``--checkpoint``, default
+``<first file>.replay.json``, written at most once a second) as the line up
+to which every batch is stored, so an interrupted run resumes where it
+stopped. Loading is at-least-once: batches stored after the last checkpoint
+write (about a second's worth plus those in flight) are loaded again on
+resume. SQLite allows a single writer, so there workers parse
+in parallel but insert one at a time.
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from .db import engine
+from .shards import shards
+from . import downtime, ingest, kpi, rollups, sketches, sources
+
+logger = logging.getLogger(__name__)
+
+COPY_SQL = "COPY event (ts, machine_id, type, payload) FROM STDIN WITH (FORMAT csv)"
+
+_worker = {'lock': None, 'copy': False}
+
+
+def open_archive(path: str):
+    """Binary line stream over a plain, gzip or zstd file."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        import zstandard
+
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+
+def read_batches(path: str, size: int, skip: int = 0) -> Iterator[Tuple[int, List[bytes]]]:
+    """Yield (line number after the batch, lines) for lines after the first `skip`."""
+    with open_archive(path) as stream:
+        for _ in islice(stream, skip):
+            pass
+        done = skip
+        while True:
+            lines = list(islice(stream, size))
+            if not lines:
+                return
+            done += len(lines)
+            yield done, lines
+
+
+def parse_lines(lines: List[bytes]) -> Tuple[List[dict], int]:
+    rows = []
+    errors = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            rows.append(ingest.make_row(obj.get('source'), obj.get('type'), obj.get('payload'), obj.get('ts')))
+        except (ValueError, AttributeError, HTTPException):
+            errors += 1
+    return rows, errors
+
+
+def copy_rows(eng, rows: List[dict]) -> None:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow((row['ts'].isoformat(), row['machine_id'], row['type'], row['payload']))
+    buf.seek(0)
+    conn = eng.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(COPY_SQL, buf)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def store(rows: List[dict]) -> None:
+    if _worker['copy']:
+        with Session(engine) as session:
+            ids = sources.directory.resolve(session, {row['source'] for row in rows})
+        parts = {}
+        for row in rows:
+            row['machine_id'] = ids[row['source']]
+            parts.setdefault(shards.index_for(row['machine_id']), []).append(row)
+        for index, part in parts.items():
+            copy_rows(shards.engines[index], part)
+        return
+    with Session(engine) as session:
+        ingest.insert_rows(session, rows, derived=False)
+        session.commit()
+
+
+def init_worker(lock, copy: bool) -> None:
+    # connections inherited from the parent process must not be reused
+    engine.dispose(close=False)
+    for eng in shards.engines:
+        eng.dispose(close=False)
+    _worker['lock'] = lock
+    _worker['copy'] = copy
+
+
+def load_batch(lines: List[bytes]):
+    """Worker: parse and store one batch; returns (inserted, errors, min ts, max ts)."""
+    rows, errors = parse_lines(lines)
+    if not rows:
+        return 0, errors, None, None
+    if _worker['lock'] is not None:
+        with _worker['lock']:
+            store(rows)
+    else:
+        store(rows)
+    stamps = [row['ts'] for row in rows]
+    return len(rows), errors, min(stamps), max(stamps)
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.files = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.files = {}
+        self._saved = 0.0
+
+    def entry(self, archive: str) -> dict:
+        st = os.stat(archive)
+        entry = self.files.get(os.path.abspath(archive))
+        if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            # a different file under the same name starts from the top
+            entry = self.files[os.path.abspath(archive)] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                                                            'lines': 0, 'done': False, 'start': None, 'end': None,
+                                                            'rebuilt': None}
+        return entry
+
+    def save(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._saved < 1.0:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.files, f, indent=1)
+        os.replace(tmp, self.path)
+        self._saved = now
+
+
+def widen(entry: dict, lo: Optional[datetime], hi: Optional[datetime]) -> None:
+    if lo is None:
+        return
+    if entry['start'] is None or lo.isoformat() < entry['start']:
+        entry['start'] = lo.isoformat()
+    if entry['end'] is None or hi.isoformat() > entry['end']:
+        entry['end'] = hi.isoformat()
+
+
+def replay(paths: List[str], workers: int, batch: int, copy: bool, checkpoint: Checkpoint) -> dict:
+    sqlite = any(e.dialect.name == 'sqlite' for e in shards.engines)
+    if copy and any(e.dialect.name != 'postgresql' for e in shards.engines):
+        raise SystemExit('--copy needs Postgres event storage')
+    ctx = multiprocessing.get_context()
+    lock = ctx.Lock() if sqlite else None
+    totals = {'inserted': 0, 'errors': 0}
+    started = time.monotonic()
+    with ctx.Pool(workers, initializer=init_worker, initargs=(lock, copy)) as pool:
+        for path in paths:
+            entry = checkpoint.entry(path)
+            if entry['done']:
+                logger.info("%s already replayed", path)
+                continue
+
+            def finish(done, result):
+                inserted, errors, lo, hi = result.get()
+                totals['inserted'] += inserted
+                totals['errors'] += errors
+                entry['lines'] = done
+                entry['rebuilt'] = False
+                widen(entry, lo, hi)
+                checkpoint.save()
+
+            # results are collected oldest first, so the checkpoint only advances past
+            # batches whose predecessors are stored too; the bound keeps memory flat
+            pending = deque()
+            for done, lines in read_batches(path, batch, entry['lines']):
+                pending.append((done, pool.apply_async(load_batch, (lines,))))
+                if len(pending) >= 2 * workers:
+                    finish(*pending.popleft())
+            while pending:
+                finish(*pending.popleft())
+            entry['done'] = True
+            checkpoint.save(force=True)
+            logger.info("%s: %d lines", path, entry['lines'])
+    totals['seconds'] = time.monotonic() - started
+    totals['rate'] = totals['inserted'] / totals['seconds'] if totals['seconds'] else 0.0
+    return totals
+
+
+def rebuild(checkpoint: Checkpoint) -> None:
+    """Rebuild derived data for the time range of every replayed file not rebuilt yet."""
+    entries = [e for e in checkpoint.files.values() if e.get('rebuilt') is False and e['start']]
+    if not entries:
+        return
+    start = datetime.fromisoformat(min(e['start'] for e in entries))
+    # the rebuilds treat `end` as exclusive
+    end = datetime.fromisoformat(max(e['end'] for e in entries)) + timedelta(seconds=1)
+    logger.info("rebuilding rollups, sketches and downtime intervals for %s .. %s", start, end)
+    with Session(engine) as session:
+        rollups.rebuild(session, start, end)
+        sketches.rebuild(session, start, end)
+        downtime.rebuild(session, start, end)
+        session.commit()
+    kpi.rebuild(start, end)
+    for e in entries:
+        e['rebuilt'] = True
+    checkpoint.save(force=True)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay NDJSON event archives into the database')
+    parser.add_argument('paths', nargs='+', help='.ndjson, .ndjson.gz or .ndjson.zst files, loaded in order')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parser/insert processes')
+    parser.add_argument('--batch', type=int, default=20000, help='events per insert')
+    parser.add_argument('--copy', action='store_true', help='load with COPY (Postgres only)')
+    parser.add_argument('--checkpoint', help='progress file (default: <first path>.replay.json)')
+    parser.add_argument('--no-rebuild', action='store_true', help='do not rebuild rollups, sketches and KPIs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    checkpoint = Checkpoint(args.checkpoint or args.paths[0] + '.replay.json')
+    totals = replay(args.paths, args.workers, args.batch, args.copy, checkpoint)
+    print(f"{totals['inserted']} events in {totals['seconds']:.1f}s ({totals['rate']:.0f}/s), {totals['errors']} bad lines")
+    if not args.no_rebuild:
+        rebuild(checkpoint)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Multi-resolution production rollups.
+
+Every production event is folded at ingest into `ProductionRollup` rows for
+each resolution in `RESOLUTIONS` (1m, 5m, 1h, shift, 1d), keyed by
+(resolution, bucket start, source). Trend queries then read at most one row
+per source and bucket instead of scanning raw events.
+
+Rebuild after bulk loads or schema changes with::
+
+    python -m app.rollups [--start ISO] [--end ISO]
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+
+from .core.config import settings
+from .db import upsert_add
+from .models import Event, ProductionRollup
+from .shards import shards
+from .sources import labelled
+
+RESOLUTIONS = ('1m', '5m', '1h', 'shift', '1d')
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+# rebuilds upsert whenever this many buckets are pending
+FLUSH_BUCKETS = 100_000
+
+
+def resolution_seconds(resolution: str) -> int:
+    if resolution == 'shift':
+        return settings.SHIFT_HOURS * 3600
+    try:
+        return {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}[resolution]
+    except KeyError:
+        raise ValueError(f"unknown resolution {resolution!r}")
+
+
+def floor_ts(ts: datetime, resolution: str) -> datetime:
+    """Start of the bucket containing naive-UTC `ts`."""
+    step = resolution_seconds(resolution)
+    offset = settings.SHIFT_START_HOUR * 3600 if resolution == 'shift' else 0
+    seconds = int((ts - EPOCH).total_seconds()) - offset
+    return EPOCH + timedelta(seconds=seconds - seconds % step + offset)
+
+
+def production_values(payload: Optional[dict]):
+    """Return (produced, good, ideal cycle time sum in ms, ideal cycle time count) of a payload."""
+    if not payload:
+        return 0, 0, 0.0, 0
+    produced = int(payload.get('produced', 0))
+    good = int(payload.get('good', 0))
+    if 'ict_count' in payload:
+        # compacted record (app.compaction): sums over the merged events
+        return produced, good, float(payload.get('ict_sum_ms', 0.0)), int(payload['ict_count'])
+    ict_ms = payload.get('ideal_cycle_time_ms')
+    if ict_ms:
+        return produced, good, float(ict_ms), 1
+    return produced, good, 0.0, 0
+
+
+def aggregate(rows: Iterable[dict], lo: Optional[datetime] = None, hi: Optional[datetime] = None) -> List[dict]:
+    """Fold event rows into rollup increments, optionally only for buckets in [lo, hi)."""
+    acc = {}
+    fold(acc, rows, lo, hi)
+    return list(acc.values())
+
+
+def fold(acc: dict, rows: Iterable[dict], lo: Optional[datetime] = None, hi: Optional[datetime] = None) -> None:
+    """Add rows to the increments in `acc`, keyed by (resolution, bucket, source)."""
+    # floor_ts inlined: epoch seconds once per row, bucket datetimes built once per bucket
+    grid = [(resolution, resolution_seconds(resolution), settings.SHIFT_START_HOUR * 3600 if resolution == 'shift' else 0)
+            for resolution in RESOLUTIONS]
+    starts = {}
+    for row in rows:
+        if row['type'] != 'production':
+            continue
+        payload = row['payload']
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except Exception:
+                payload = None
+        produced, good, ict_sum, ict_count = production_values(payload)
+        seconds = (row['ts'] - EPOCH) // ONE_SECOND
+        for resolution, step, offset in grid:
+            start = seconds - (seconds - offset) % step
+            bucket = starts.get(start)
+            if bucket is None:
+                bucket = starts[start] = EPOCH + timedelta(seconds=start)
+            if (lo is not None and bucket < lo) or (hi is not None and bucket >= hi):
+                continue
+            key = (resolution, bucket, row['source'])
+            rec = acc.get(key)
+            if rec is None:
+                rec = acc[key] = {'resolution': resolution, 'bucket': bucket, 'source': row['source'],
+                                  'produced': 0, 'good': 0, 'ict_sum_ms': 0.0, 'ict_count': 0, 'events': 0}
+            rec['produced'] += produced
+            rec['good'] += good
+            rec['ict_sum_ms'] += ict_sum
+            rec['ict_count'] += ict_count
+            rec['events'] += payload.get('events', 1) if payload else 1
+
+
+def apply(session: Session, rows: Iterable[dict]) -> None:
+    """Add a batch of newly inserted event rows to the rollups (caller commits)."""
+    upsert_add(session, ProductionRollup, aggregate(rows), keys=('resolution', 'bucket', 'source'),
+               add_cols=('produced', 'good', 'ict_sum_ms', 'ict_count', 'events'))
+
+
+def rebuild(session: Session, start: Optional[datetime] = None, end: Optional[datetime] = None, chunk: int = 5000) -> None:
+    """Recompute rollups from raw events, for everything or for [start, end)."""
+    if start is None and end is None:
+        session.execute(delete(ProductionRollup))
+        lo = hi = None
+        stmt = select(Event.ts, Event.machine_id, Event.type, Event.payload).where(Event.type == 'production')
+    else:
+        # widen to whole days (plus a day for shifts crossing midnight) so every
+        # bucket we drop is recomputed from all of its events
+        lo = floor_ts(start or EPOCH, '1d') - timedelta(days=1)
+        hi = floor_ts(end or datetime.utcnow(), '1d') + timedelta(days=1)
+        session.execute(delete(ProductionRollup).where(ProductionRollup.bucket >= lo, ProductionRollup.bucket < hi))
+        stmt = select(Event.ts, Event.machine_id, Event.type, Event.payload).where(
+            Event.type == 'production', Event.ts >= lo, Event.ts < hi + timedelta(days=1))
+    acc = {}
+    for part in shards.partitions(session, stmt, chunk):
+        fold(acc, labelled(session, part), lo, hi)
+        # events arrive in no particular order, so keep folding and upsert in large batches
+        if len(acc) >= FLUSH_BUCKETS:
+            apply_increments(session, acc)
+    apply_increments(session, acc)
+
+
+def apply_increments(session: Session, acc: dict) -> None:
+    upsert_add(session, ProductionRollup, list(acc.values()), keys=('resolution', 'bucket', 'source'),
+               add_cols=('produced', 'good', 'ict_sum_ms', 'ict_count', 'events'))
+    acc.clear()
+
+
+def pick_resolution(start: datetime, end: datetime) -> str:
+    """Finest resolution that keeps the number of buckets within TREND_MAX_POINTS."""
+    span = (end - start).total_seconds()
+    for resolution in RESOLUTIONS:
+        if span / resolution_seconds(resolution) <= settings.TREND_MAX_POINTS:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def trend(session: Session, resolution: str, start: datetime, end: datetime, sources: Optional[List[str]] = None):
+    """Zero-filled (bucket, produced, good) series for buckets starting in [start, end).
+
+    `start`/`end` are naive UTC; a bucket is included when it starts at or
+    after `start` and before `end`.
+    """
+    step = timedelta(seconds=resolution_seconds(resolution))
+    first = floor_ts(start, resolution)
+    if first < start:
+        first += step
+    stmt = (
+        select(ProductionRollup.bucket, func.sum(ProductionRollup.produced), func.sum(ProductionRollup.good))
+        .where(ProductionRollup.resolution == resolution, ProductionRollup.bucket >= first, ProductionRollup.bucket < end)
+        .group_by(ProductionRollup.bucket)
+    )
+    if sources:
+        stmt = stmt.where(ProductionRollup.source.in_(sources))
+    found = {bucket: (int(produced or 0), int(good or 0)) for bucket, produced, good in session.execute(stmt)}
+    out = []
+    bucket = first
+    while bucket < end:
+        produced, good = found.get(bucket, (0, 0))
+        out.append((bucket, produced, good))
+        bucket += step
+    return out
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from .db import engine
+    from .ingest import parse_ts
+
+    parser = argparse.ArgumentParser(description='Rebuild production rollups from raw events')
+    parser.add_argument('--start', help='ISO datetime; omit with --end for a full rebuild')
+    parser.add_argument('--end', help='ISO datetime')
+    args = parser.parse_args()
+    with Session(engine) as session:
+        rebuild(session, parse_ts(args.start), parse_ts(args.end))
+        session.commit()
+    print('Rollups rebuilt')
@@ -1 +1 @@
-from . import auth, machines, orders, users, events, reports
+from . import auth, machines, orders, users, events, reports, alerts, health, gateway_keys, batch
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import Session, select
+from typing import List, Optional
+
+from ..db import get_session, get_read_session
+from ..models import Alert
+from ..schemas import AlertRead
+from ..auth import get_current_user
+
+router = APIRouter()
+
+
+def to_read(a: Alert) -> AlertRead:
+    return AlertRead(id=a.id, ts=a.ts.isoformat(), source=a.source, kind=a.kind, value=a.value,
+                     baseline_mean=a.baseline_mean, baseline_std=a.baseline_std, score=a.score, acknowledged=a.acknowledged)
+
+
+@router.get("/", response_model=List[AlertRead])
+def list_alerts(
+    source: Optional[str] = None,
+    kind: Optional[str] = None,
+    since_id: Optional[int] = Query(None, description="only alerts with a larger id (for polling)"),
+    unacknowledged: bool = False,
+    limit: int = Query(100, le=1000),
+    session: Session = Depends(get_read_session),
+    user=Depends(get_current_user),
+):
+    """Anomalies flagged by the ingest detector, newest first."""
+    statement = select(Alert)
+    if source:
+        statement = statement.where(Alert.source == source)
+    if kind:
+        statement = statement.where(Alert.kind == kind)
+    if since_id is not None:
+        statement = statement.where(Alert.id > since_id)
+    if unacknowledged:
+        statement = statement.where(Alert.acknowledged == False)  # noqa: E712
+    statement = statement.order_by(Alert.id.desc()).limit(limit)
+    return [to_read(a) for a in session.exec(statement).all()]
+
+
+@router.put("/{alert_id}/ack", response_model=AlertRead)
+def acknowledge_alert(alert_id: int, session: Session = Depends(get_session), user=Depends(get_current_user)):
+    a = session.get(Alert, alert_id)
+    if not a:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    a.acknowledged = True
+    session.add(a)
+    session.commit()
+    session.refresh(a)
+    return to_read(a)
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+from contextlib import AsyncExitStack
+from urllib.parse import urlsplit
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+from ..auth import get_current_user
+from ..core.config import settings
+from ..schemas import BatchRequest
+from .. import ratelimit
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+_state = {'semaphore': None}
+
+
+def semaphore() -> asyncio.Semaphore:
+    if _state['semaphore'] is None:
+        _state['semaphore'] = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+    return _state['semaphore']
+
+
+async def dispatch(request: Request, user, path: str, if_none_match=None):
+    """Run one GET through the app's router in-process; returns (status, headers, body)."""
+    parts = urlsplit(path)
+    headers = [(b'authorization', request.headers.get('authorization', '').encode('latin-1'))]
+    if if_none_match:
+        headers.append((b'if-none-match', if_none_match.encode('latin-1')))
+    scope = {
+        'type': 'http',
+        'asgi': request.scope.get('asgi', {'version': '3.0'}),
+        'http_version': request.scope.get('http_version', '1.1'),
+        'method': 'GET',
+        'scheme': request.scope.get('scheme', 'http'),
+        'path': parts.path,
+        'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(),
+        'root_path': request.scope.get('root_path', ''),
+        'headers': headers,
+        'client': request.scope.get('client'),
+        'server': request.scope.get('server'),
+        'app': request.scope['app'],
+        # lets HTTPException handlers run inside the route as they do for real requests
+        'starlette.exception_handlers': request.scope.get('starlette.exception_handlers', ({}, {})),
+        # get_current_user returns this user instead of decoding the token again
+        'state': {'user': user},
+    }
+    result = {'status': 500, 'headers': {}, 'body': []}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+            result['headers'] = {k.decode('latin-1'): v.decode('latin-1') for k, v in message.get('headers', [])}
+        elif message['type'] == 'http.response.body':
+            result['body'].append(message.get('body', b''))
+
+    async with semaphore():
+        # the app's middleware stack is skipped, so set up the exit stack it would provide
+        async with AsyncExitStack() as stack:
+            scope['fastapi_middleware_astack'] = stack
+            await request.app.router(scope, receive, send)
+    return result['status'], result['headers'], b''.join(result['body'])
+
+
+@router.post("/")
+async def batch(payload: BatchRequest, request: Request, user=Depends(get_current_user)):
+    """Run several GET requests in one round-trip.
+
+    Body: ``{"requests": [{"id": "trend", "path": "/reports/production_trend?hours=12"}, ...]}``.
+    The caller is authenticated once; sub-requests run concurrently (at most
+    BATCH_CONCURRENCY per worker), each with its own database sessions, and
+    count against the caller's rate limits like separate requests.
+    Response: ``{"responses": [{"id", "status", "etag", "body"}, ...]}`` in request order.
+    """
+    if len(payload.requests) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_REQUESTS} requests per batch")
+    client = ratelimit.client_id(request.scope)
+
+    async def run(item):
+        path = item.path
+        if not path.startswith('/') or urlsplit(path).path.rstrip('/') == '/batch':
+            return item.id, 400, None, json.dumps({'detail': 'Invalid path'}).encode()
+        route_class = ratelimit.route_class(urlsplit(path).path)
+        if route_class is not None and settings.RATE_LIMIT_ENABLED and await ratelimit.wait_time(route_class, client) > 0:
+            return item.id, 429, None, json.dumps({'detail': 'Too many requests'}).encode()
+        try:
+            status, headers, body = await dispatch(request, user, path, item.if_none_match)
+        except StarletteHTTPException as exc:
+            # raised outside any route, e.g. 404/405 from the router itself
+            return item.id, exc.status_code, None, json.dumps({'detail': exc.detail}).encode()
+        except Exception:
+            logger.exception("batch sub-request %s failed", path)
+            return item.id, 500, None, json.dumps({'detail': 'Internal Server Error'}).encode()
+        if not headers.get('content-type', '').startswith('application/json'):
+            body = json.dumps(body.decode('utf-8', 'replace') if body else None).encode()
+        return item.id, status, headers.get('etag'), body
+
+    results = await asyncio.gather(*(run(item) for item in payload.requests))
+    # sub-responses are already JSON; splice them in instead of decoding and re-encoding
+    parts = [
+        b'{"id":' + json.dumps(rid).encode() + b',"status":' + str(status).encode()
+        + b',"etag":' + json.dumps(etag).encode() + b',"body":' + (body or b'null') + b'}'
+        for rid, status, etag, body in results
+    ]
+    return Response(content=b'{"responses":[' + b','.join(parts) + b']}', media_type='application/json')
@@ -1,44 +1,55 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, Union
 from sqlmodel import Session
 import json
-from datetime import datetime
 
 from ..db import get_session
-from ..schemas import EventCreate, EventRead
-from ..models import Event
-from ..auth import get_current_user
+from ..schemas import EventRead, BulkIngestResult
+from ..auth import get_current_user, get_ingest_principal
+from ..writer import insert_events
+from .. import api_keys, ingest, line_listener
 
 router = APIRouter()
 
 
-@router.post("/bulk", response_model=List[EventRead])
-def ingest_events(events: List[EventCreate], session: Session = Depends(get_session), user=Depends(get_current_user)):
-    objs = []
-    for ev in events:
-        # Validate basic shape
-        if not ev.type or not ev.source:
-            raise HTTPException(status_code=400, detail="Event must have source and type")
-        # allow optional timestamp (ISO) for seeding historical events
-        obj_kwargs = { 'source': ev.source, 'type': ev.type, 'payload': json.dumps(ev.payload) }
-        if getattr(ev, 'ts', None):
-            try:
-                obj_kwargs['ts'] = datetime.fromisoformat(ev.ts)
-            except Exception:
-                # ignore parse errors and let default ts apply
-                pass
-        obj = Event(**obj_kwargs)
-        session.add(obj)
-        objs.append(obj)
-    session.commit()
-    for o in objs:
-        session.refresh(o)
+def store_batch(session: Session, principal, body: bytes, content_type: Optional[str], content_encoding: Optional[str]):
+    rows = ingest.decode_body(body, content_type, content_encoding)
+    api_keys.check_sources(principal, {row['source'] for row in rows}, session)
+    media_type = (content_type or 'application/json').split(';')[0].strip().lower()
+    if media_type not in ingest.JSON_TYPES:
+        insert_events(session, rows)
+        return BulkIngestResult(inserted=len(rows))
+
+    inserted = insert_events(session, rows, returning=True)
     # map to read schema
     result = []
-    for o in objs:
+    for row, (event_id, ts) in zip(rows, inserted):
         try:
-            payload = json.loads(o.payload) if o.payload else None
+            payload = json.loads(row['payload']) if row['payload'] else None
         except Exception:
             payload = None
-        result.append(EventRead(id=o.id, ts=o.ts.isoformat(), source=o.source, type=o.type, payload=payload))
+        result.append(EventRead(id=event_id, ts=ts.isoformat(), source=row['source'], type=row['type'], payload=payload))
     return result
+
+
+@router.post("/bulk", response_model=Union[List[EventRead], BulkIngestResult])
+async def ingest_events(request: Request, session: Session = Depends(get_session), principal=Depends(get_ingest_principal)):
+    """Ingest a batch of events.
+
+    A JSON list of `EventCreate` objects is echoed back as `EventRead` items.
+    Compact formats (NDJSON, MessagePack columnar, optionally gzip/zstd
+    compressed; see `app.ingest`) only return the number of inserted events.
+    Gateways authenticate with an `X-API-Key` limited to their sources.
+    """
+    body = await request.body()
+    # decoding and the insert are blocking; keep them off the event loop
+    return await run_in_threadpool(
+        store_batch, session, principal, body, request.headers.get('content-type'), request.headers.get('content-encoding')
+    )
+
+
+@router.get("/listener")
+def line_listener_stats(user=Depends(get_current_user)):
+    """Counters and open connections of this worker's line-protocol listener."""
+    return line_listener.snapshot()
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import Session, select
+from typing import List
+
+from ..db import get_session
+from ..models import GatewayKey
+from ..schemas import GatewayKeyCreate, GatewayKeyRead, GatewayKeyCreated
+from ..auth import get_current_user
+from ..caching import bump_version
+from .. import api_keys
+
+router = APIRouter()
+
+
+def to_read(k: GatewayKey) -> GatewayKeyRead:
+    sources = api_keys.parse_sources(k.sources)
+    return GatewayKeyRead(id=k.id, name=k.name, prefix=k.prefix, sources=sorted(sources) if sources else [], active=k.active)
+
+
+@router.post("/", response_model=GatewayKeyCreated)
+def create_gateway_key(payload: GatewayKeyCreate, session: Session = Depends(get_session), current=Depends(get_current_user)):
+    """Issue a key for a machine gateway. The plaintext key is only returned here."""
+    if current.role != 'admin':
+        raise HTTPException(status_code=403, detail='Forbidden')
+    if any(',' in s for s in payload.sources):
+        raise HTTPException(status_code=400, detail='Source names cannot contain commas')
+    key, prefix, key_hash = api_keys.generate_key()
+    obj = GatewayKey(name=payload.name, prefix=prefix, key_hash=key_hash, sources=','.join(payload.sources) or '*')
+    session.add(obj)
+    bump_version(session, api_keys.VERSION_NAME)
+    session.commit()
+    session.refresh(obj)
+    api_keys.index.invalidate()
+    return GatewayKeyCreated(key=key, **to_read(obj).model_dump())
+
+
+@router.get("/", response_model=List[GatewayKeyRead])
+def list_gateway_keys(session: Session = Depends(get_session), current=Depends(get_current_user)):
+    if current.role != 'admin':
+        raise HTTPException(status_code=403, detail='Forbidden')
+    return [to_read(k) for k in session.exec(select(GatewayKey)).all()]
+
+
+@router.delete("/{key_id}")
+def revoke_gateway_key(key_id: int, session: Session = Depends(get_session), current=Depends(get_current_user)):
+    if current.role != 'admin':
+        raise HTTPException(status_code=403, detail='Forbidden')
+    k = session.get(GatewayKey, key_id)
+    if not k:
+        raise HTTPException(status_code=404, detail='Key not found')
+    k.active = False
+    session.add(k)
+    bump_version(session, api_keys.VERSION_NAME)
+    session.commit()
+    api_keys.index.invalidate()
+    return {'ok': True}
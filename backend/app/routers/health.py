@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import text
+
+from ..auth import get_current_user
+from ..db import engine, replicas
+from ..writer import writer
+from .. import ratelimit, schema
+
+router = APIRouter()
+
+
+def require_admin(current=Depends(get_current_user)):
+    """/live and /ready stay public for probes; the diagnostics below name hosts and load."""
+    if current.role != 'admin':
+        raise HTTPException(status_code=403, detail='Forbidden')
+    return current
+
+
+@router.get("/live")
+def liveness():
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def readiness():
+    """200 once the schema matches the Alembic head and the database answers."""
+    if not schema.state['schema_ok'] and not schema.check(engine):
+        raise HTTPException(status_code=503, detail=f"schema revision {schema.state['current']} is not {schema.head_revision()}")
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception:
+        raise HTTPException(status_code=503, detail="database unavailable")
+    return {"status": "ready", "revision": schema.state['current']}
+
+
+@router.get("/db")
+def database_pools(current=Depends(require_admin)):
+    """Connection pool status, replica lag and routing counters per engine, and the SQLite writer queue."""
+    return {**replicas.metrics(), 'sqlite_writer': writer.snapshot()}
+
+
+@router.get("/limits")
+def rate_limits(current=Depends(require_admin)):
+    """Rate-limit counters and in-flight requests per route class in this worker."""
+    return ratelimit.snapshot()
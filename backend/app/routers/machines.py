@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
 from sqlmodel import Session, select
 from typing import List
 
-from ..db import get_session
-from ..models import Machine
+from ..db import get_session, get_read_session
+from ..models import Event, Machine
 from ..schemas import MachineCreate, MachineRead
 from ..auth import get_current_user
+from ..caching import bump_version, conditional
+from ..rows import rows_response
+from ..shards import shards
+from .. import sources
 
 router = APIRouter()
 
@@ -14,20 +19,28 @@ router = APIRouter()
 def create_machine(m: MachineCreate, session: Session = Depends(get_session), user=Depends(get_current_user)):
     obj = Machine(name=m.name, code=m.code)
     session.add(obj)
+    bump_version(session, "machines")
     session.commit()
+    sources.directory.invalidate()
     session.refresh(obj)
     return obj
 
 
 @router.get("/", response_model=List[MachineRead])
-def list_machines(session: Session = Depends(get_session), user=Depends(get_current_user)):
-    statement = select(Machine)
-    machines = session.exec(statement).all()
-    return machines
+def list_machines(
+    include_auto: bool = Query(False, description="also list machines registered automatically by ingest"),
+    session: Session = Depends(get_read_session),
+    user=Depends(get_current_user),
+    _etag=Depends(conditional("machines")),
+):
+    statement = select(Machine.id, Machine.name, Machine.code, Machine.status, Machine.auto_registered)
+    if not include_auto:
+        statement = statement.where(Machine.auto_registered == False)  # noqa: E712
+    return rows_response(session.execute(statement), _etag)
 
 
 @router.get("/{machine_id}", response_model=MachineRead)
-def get_machine(machine_id: int, session: Session = Depends(get_session), user=Depends(get_current_user)):
+def get_machine(machine_id: int, session: Session = Depends(get_read_session), user=Depends(get_current_user)):
     m = session.get(Machine, machine_id)
     if not m:
         raise HTTPException(status_code=404, detail="Machine not found")
@@ -44,8 +57,12 @@ def update_machine(machine_id: int, payload: MachineCreate, session: Session = D
         raise HTTPException(status_code=403, detail="Forbidden")
     m.name = payload.name
     m.code = payload.code
+    # edited by hand: a regular machine from now on
+    m.auto_registered = False
     session.add(m)
+    bump_version(session, "machines")
     session.commit()
+    sources.directory.invalidate()
     session.refresh(m)
     return m
 
@@ -58,6 +75,13 @@ def delete_machine(machine_id: int, session: Session = Depends(get_session), use
     # Only admin can delete machines
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
+    # events reference their machine (on shards without a foreign key to enforce it)
+    stmt = select(func.count()).select_from(Event).where(Event.machine_id == machine_id)
+    with shards.session_for(session, machine_id) as shard_session:
+        if shard_session.exec(stmt).one():
+            raise HTTPException(status_code=409, detail="Machine has events")
     session.delete(m)
+    bump_version(session, "machines")
     session.commit()
+    sources.directory.invalidate()
     return {"ok": True}
@@ -2,34 +2,64 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session, select
 from typing import List
 
-from ..db import get_session
-from ..models import Order
-from ..schemas import OrderCreate, OrderRead
+from ..db import get_session, get_read_session
+from ..models import Machine, MachineThroughput, Order
+from ..schemas import OrderCreate, OrderEta, OrderRead
 from ..auth import get_current_user
+from ..caching import bump_version, conditional
+from ..rows import json_response, rows_response
+from .. import eta
 
 router = APIRouter()
 
 
+def check_machine(session: Session, machine_id):
+    if machine_id is not None and session.get(Machine, machine_id) is None:
+        raise HTTPException(status_code=400, detail="Machine not found")
+
+
 @router.post("/", response_model=OrderRead)
 def create_order(payload: OrderCreate, session: Session = Depends(get_session), user=Depends(get_current_user)):
     # Allow status to be set on creation; enforce role
     if user.role not in ("admin", "planner"):
         raise HTTPException(status_code=403, detail="Forbidden")
-    obj = Order(order_number=payload.order_number, product=payload.product, quantity=payload.quantity, priority=payload.priority, status=(payload.status or 'pending'))
+    check_machine(session, payload.machine_id)
+    obj = Order(order_number=payload.order_number, product=payload.product, quantity=payload.quantity, priority=payload.priority, status=(payload.status or 'pending'), machine_id=payload.machine_id)
     session.add(obj)
+    for machine_id in eta.track(obj, None, None):
+        eta.refresh(session, machine_id)
+    bump_version(session, "orders")
     session.commit()
     session.refresh(obj)
     return obj
 
 
 @router.get("/", response_model=List[OrderRead])
-def list_orders(session: Session = Depends(get_session), user=Depends(get_current_user)):
-    statement = select(Order)
-    return session.exec(statement).all()
+def list_orders(session: Session = Depends(get_read_session), user=Depends(get_current_user), _etag=Depends(conditional("orders"))):
+    statement = select(Order.id, Order.order_number, Order.product, Order.quantity, Order.priority, Order.status,
+                       Order.machine_id, Order.started_at, Order.progress, Order.eta)
+    return rows_response(session.execute(statement), _etag)
+
+
+@router.get("/eta", response_model=List[OrderEta])
+def order_etas(session: Session = Depends(get_read_session), user=Depends(get_current_user), _etag=Depends(conditional("orders"))):
+    """Completion forecasts of in-progress orders assigned to a machine, soonest first (see app.eta)."""
+    statement = select(
+        Order.id, Order.order_number, Order.machine_id, Order.quantity, Order.progress,
+        Order.quantity - Order.progress, MachineThroughput.rate, MachineThroughput.last_ts, Order.eta,
+    ).join(MachineThroughput, MachineThroughput.machine_id == Order.machine_id, isouter=True).where(
+        Order.status == eta.IN_PROGRESS, Order.machine_id.is_not(None)).order_by(Order.eta.is_(None), Order.eta, Order.id)
+    out = [
+        {'order_id': order_id, 'order_number': number, 'machine_id': machine_id, 'quantity': quantity,
+         'progress': progress, 'remaining': max(remaining, 0), 'rate_per_hour': rate * 3600 if rate is not None else None,
+         'last_event_at': last_ts, 'eta': when}
+        for order_id, number, machine_id, quantity, progress, remaining, rate, last_ts, when in session.execute(statement)
+    ]
+    return json_response(out, _etag)
 
 
 @router.get("/{order_id}", response_model=OrderRead)
-def get_order(order_id: int, session: Session = Depends(get_session), user=Depends(get_current_user)):
+def get_order(order_id: int, session: Session = Depends(get_read_session), user=Depends(get_current_user)):
     o = session.get(Order, order_id)
     if not o:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -44,6 +74,8 @@ def update_order(order_id: int, payload: OrderCreate, session: Session = Depends
     # Only admin or planner can update orders
     if user.role not in ("admin", "planner"):
         raise HTTPException(status_code=403, detail="Forbidden")
+    check_machine(session, payload.machine_id)
+    previous_status, previous_machine = o.status, o.machine_id
     o.order_number = payload.order_number
     o.product = payload.product
     o.quantity = payload.quantity
@@ -51,7 +83,13 @@ def update_order(order_id: int, payload: OrderCreate, session: Session = Depends
     # allow status update
     if getattr(payload, 'status', None) is not None:
         o.status = payload.status
+    # clients that predate machine assignment send no machine_id; keep the current one
+    if 'machine_id' in payload.model_fields_set:
+        o.machine_id = payload.machine_id
     session.add(o)
+    for machine_id in eta.track(o, previous_status, previous_machine):
+        eta.refresh(session, machine_id)
+    bump_version(session, "orders")
     session.commit()
     session.refresh(o)
     return o
@@ -65,6 +103,10 @@ def delete_order(order_id: int, session: Session = Depends(get_session), user=De
     # Only admin can delete orders
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
+    machine_id = o.machine_id
     session.delete(o)
+    # orders queued behind it on the machine move up
+    eta.refresh(session, machine_id)
+    bump_version(session, "orders")
     session.commit()
     return {"ok": True}
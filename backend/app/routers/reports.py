@@ -1,23 +1,40 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlmodel import Session, select
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime, timedelta, timezone
 import json
 
-from ..db import get_session
-from ..models import Event, Order
-from ..schemas import OEEReport
+from ..core.config import settings
+from ..db import get_read_session, replicas
+from ..models import Event, KpiSnapshot, Order
+from ..schemas import OEEReport, CycleTimeReport, KpiSnapshotRead
 from ..auth import get_current_user
+from ..caching import conditional
+from ..rows import json_response, rows_response
+from ..shards import shards
+from .. import downtime, export, ingest, kpi, live, rollups, sketches, sources
 
 router = APIRouter()
 
 
+def machine_key(session: Session, machine_id: str) -> int:
+    """Machine id for a code, name or numeric id; 404 for an unknown machine."""
+    mid = sources.directory.lookup(session, machine_id)
+    if mid is None and machine_id.isdigit() and int(machine_id) in sources.directory.labels(session):
+        mid = int(machine_id)
+    if mid is None:
+        raise HTTPException(status_code=404, detail="Machine not found")
+    return mid
+
+
 @router.get("/oee", response_model=OEEReport)
 def compute_oee(
-    machine_id: str = Query(..., description="machine id or code used as Event.source"),
+    machine_id: str = Query(..., description="machine code, name or numeric id"),
     start: str = Query(..., description="start ISO datetime"),
     end: str = Query(..., description="end ISO datetime"),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_read_session),
     user=Depends(get_current_user),
 ):
     try:
@@ -39,62 +56,39 @@ def compute_oee(
 
     planned_seconds = (dt_end - dt_start).total_seconds()
 
-    statement = select(Event).where(Event.source == machine_id)
-    events = session.exec(statement).all()
-
-    # filter by timestamp
-    # filter by timestamp (normalize event ts to UTC-aware for comparison)
-    def event_ts_aware(e):
-        ets = e.ts
-        if ets is None:
-            return None
-        if ets.tzinfo is None:
-            return ets.replace(tzinfo=timezone.utc)
-        return ets.astimezone(timezone.utc)
+    mid = machine_key(session, machine_id)
+    # events and intervals are stored as naive UTC
+    lo = dt_start.replace(tzinfo=None)
+    hi = dt_end.replace(tzinfo=None)
+    # plain rows: only the production events in the window, off the (machine_id, ts) / (type, ts) indexes
+    statement = select(Event.ts, Event.payload).where(Event.machine_id == mid, Event.type == 'production',
+                                                      Event.ts >= lo, Event.ts <= hi)
+    with shards.session_for(session, mid) as shard_session:
+        events = shard_session.exec(statement).all()
+    downtime_sources = downtime.machine_sources(session, mid)
 
-    filtered = [e for e in events if (event_ts_aware(e) is not None) and (dt_start <= event_ts_aware(e) <= dt_end)]
-
-    downtime_seconds = 0.0
+    # merged [start, end) intervals clipped to the window, so overlapping or straddling stops count once
+    downtime_seconds = downtime.window_seconds(session, downtime_sources, lo, hi)
     total_produced = 0
     total_good = 0
-    ideal_cycle_seconds_acc = 0.0
+    ideal_cycle_ms_acc = 0.0
     ideal_cycle_counts = 0
 
-    for e in filtered:
-        payload = None
+    for e in events:
         try:
             payload = json.loads(e.payload) if e.payload else None
         except Exception:
             payload = None
-        if e.type == 'downtime' and payload:
-            # expect payload: {"duration_seconds": 30}
-            downtime_seconds += float(payload.get('duration_seconds', 0))
-        if e.type == 'production' and payload:
-            produced = int(payload.get('produced', 0))
-            good = int(payload.get('good', 0))
-            ict_ms = payload.get('ideal_cycle_time_ms')
+        if payload:
+            # also reads the sums of compacted per-minute records
+            produced, good, ict_sum_ms, ict_count = rollups.production_values(payload)
             total_produced += produced
             total_good += good
-            if ict_ms:
-                ideal_cycle_seconds_acc += float(ict_ms) / 1000.0
-                ideal_cycle_counts += 1
+            ideal_cycle_ms_acc += ict_sum_ms
+            ideal_cycle_counts += ict_count
 
-    run_seconds = max(0.0, planned_seconds - downtime_seconds)
-    availability = run_seconds / planned_seconds if planned_seconds > 0 else 0.0
-
-    if total_produced > 0 and run_seconds > 0:
-        # average ideal cycle time
-        avg_ict = (ideal_cycle_seconds_acc / ideal_cycle_counts) if ideal_cycle_counts > 0 else 0.0
-        if avg_ict > 0:
-            performance = (total_produced * avg_ict) / run_seconds
-        else:
-            performance = 1.0
-    else:
-        performance = 0.0
-
-    quality = (total_good / total_produced) if total_produced > 0 else 0.0
-
-    oee = availability * performance * quality
+    metrics = kpi.oee_metrics(planned_seconds, downtime_seconds, total_produced, total_good,
+                              ideal_cycle_ms_acc / 1000.0, ideal_cycle_counts)
 
     return OEEReport(
         machine_id=machine_id,
@@ -102,79 +96,92 @@ def compute_oee(
         end=dt_end.isoformat(),
         planned_seconds=planned_seconds,
         downtime_seconds=downtime_seconds,
-        run_seconds=run_seconds,
-        availability=availability,
-        performance=performance,
-        quality=quality,
-        oee=oee,
+        **metrics,
+    )
+
+
+@router.get("/oee/live", response_model=OEEReport)
+def live_oee(
+    machine_id: str = Query(..., description="machine code, name or numeric id"),
+    window_seconds: int = Query(900, gt=0, description="rolling window ending now"),
+    session: Session = Depends(get_read_session),
+    user=Depends(get_current_user),
+):
+    """OEE of the last `window_seconds` from the in-memory ring buffers (see `app.live`)."""
+    if not settings.LIVE_OEE_ENABLED:
+        raise HTTPException(status_code=404, detail="live OEE is disabled")
+    if window_seconds > settings.LIVE_OEE_HORIZON_SECONDS:
+        raise HTTPException(status_code=400, detail=f"window_seconds must be at most {settings.LIVE_OEE_HORIZON_SECONDS}")
+    totals = live.window(machine_key(session, machine_id), window_seconds)
+    planned_seconds = (totals['end'] - totals['start']).total_seconds()
+    metrics = kpi.oee_metrics(planned_seconds, totals['downtime_seconds'], totals['produced'], totals['good'],
+                              totals['ict_sum_seconds'], totals['ict_count'])
+    return OEEReport(
+        machine_id=machine_id,
+        start=totals['start'].replace(tzinfo=timezone.utc).isoformat(),
+        end=totals['end'].replace(tzinfo=timezone.utc).isoformat(),
+        planned_seconds=planned_seconds,
+        downtime_seconds=totals['downtime_seconds'],
+        **metrics,
     )
 
 
 @router.get('/production_trend')
-def production_trend(hours: Optional[int] = 12, session: Session = Depends(get_session), user=Depends(get_current_user)):
-    """Return hourly production totals for the last `hours` hours.
+def production_trend(
+    hours: Optional[int] = 12,
+    resolution: Optional[str] = Query(None, description="1m, 5m, 1h, shift or 1d; picked from the range when omitted"),
+    start: Optional[str] = Query(None, description="start ISO datetime (defaults to now - hours)"),
+    end: Optional[str] = Query(None, description="end ISO datetime (defaults to now)"),
+    session: Session = Depends(get_read_session),
+    user=Depends(get_current_user),
+    _etag=Depends(conditional('events', clock=60)),
+):
+    """Return production totals per bucket, served from pre-aggregated rollups.
 
-    Response: list of { hour: ISOhour, produced: int, good: int }
+    Without start/end this covers the last `hours` hours at hourly resolution.
+    Response: list of { bucket: ISO, hour: ISO (same as bucket), produced: int, good: int }
     """
-    now = datetime.now(timezone.utc)
-    start = now - timedelta(hours=hours)
-    statement = select(Event).where(Event.type == 'production')
-    events = session.exec(statement).all()
-    # filter by time and bucket by hour
-    buckets = {}
-    for e in events:
-        # normalize event ts
-        ets = e.ts
-        if ets is None:
-            continue
-        if ets.tzinfo is None:
-            ets = ets.replace(tzinfo=timezone.utc)
-        else:
-            ets = ets.astimezone(timezone.utc)
-        if ets < start or ets > now:
-            continue
-        hour_key = ets.replace(minute=0, second=0, microsecond=0).isoformat()
-        try:
-            payload = json.loads(e.payload) if e.payload else {}
-        except Exception:
-            payload = {}
-        produced = int(payload.get('produced', 0))
-        good = int(payload.get('good', 0))
-        b = buckets.get(hour_key) or {'produced': 0, 'good': 0}
-        b['produced'] += produced
-        b['good'] += good
-        buckets[hour_key] = b
-
-    # build ordered list for each hour
-    out = []
-    for h in range(hours-1, -1, -1):
-        hr = (now - timedelta(hours=h)).replace(minute=0, second=0, microsecond=0).isoformat()
-        v = buckets.get(hr) or {'produced': 0, 'good': 0}
-        out.append({'hour': hr, 'produced': v['produced'], 'good': v['good']})
-    return out
+    try:
+        dt_end = datetime.fromisoformat(end) if end else datetime.now(timezone.utc)
+        dt_start = datetime.fromisoformat(start) if start else dt_end - timedelta(hours=hours)
+    except Exception:
+        raise HTTPException(status_code=400, detail="start/end must be ISO datetimes")
+    # rollup buckets are naive UTC
+    if dt_start.tzinfo is not None:
+        dt_start = dt_start.astimezone(timezone.utc).replace(tzinfo=None)
+    if dt_end.tzinfo is not None:
+        dt_end = dt_end.astimezone(timezone.utc).replace(tzinfo=None)
+    if dt_end <= dt_start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if resolution is None:
+        resolution = rollups.pick_resolution(dt_start, dt_end) if (start or end) else '1h'
+    if resolution not in rollups.RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(rollups.RESOLUTIONS)}")
+
+    # buckets are naive UTC datetimes; rows.dumps writes them as UTC ISO strings
+    out = [{'bucket': bucket, 'hour': bucket, 'produced': produced, 'good': good}
+           for bucket, produced, good in rollups.trend(session, resolution, dt_start, dt_end)]
+    return json_response(out, _etag)
 
 
 @router.get('/orders_status')
-def orders_status(session: Session = Depends(get_session), user=Depends(get_current_user)):
-    statement = select(Order)
-    items = session.exec(statement).all()
-    counts = {}
-    for o in items:
-        counts[o.status] = counts.get(o.status, 0) + 1
-    return [{'status': k, 'count': v} for k, v in counts.items()]
+def orders_status(session: Session = Depends(get_read_session), user=Depends(get_current_user), _etag=Depends(conditional('orders'))):
+    statement = select(Order.status, func.count().label('count')).group_by(Order.status)
+    return rows_response(session.execute(statement), _etag)
 
 
 @router.get('/metrics/production')
 def production_metrics(
     start: Optional[str] = Query(None, description='start ISO datetime'),
     end: Optional[str] = Query(None, description='end ISO datetime'),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_read_session),
     user=Depends(get_current_user),
+    _etag=Depends(conditional('events', 'machines')),
 ):
     """Aggregate production events per machine.
 
     Expects events with `type=='production'` and payload containing `produced` and `good` integers.
-    Returns list of {source, produced, good, last_ts}.
+    Returns list of {machine (label, see app.sources), produced, good, last_ts}.
     """
     dt_start = None
     dt_end = None
@@ -197,52 +204,158 @@ def production_metrics(
     except Exception:
         raise HTTPException(status_code=400, detail='start/end must be ISO datetimes')
 
-    statement = select(Event).where(Event.type == 'production')
-    events = session.exec(statement).all()
-    # filter by time range
-    if dt_start or dt_end:
-        filtered = []
-        for e in events:
-            ets = e.ts
-            if ets is None:
-                continue
-            if ets.tzinfo is None:
-                ets = ets.replace(tzinfo=timezone.utc)
-            else:
-                ets = ets.astimezone(timezone.utc)
-            if dt_start and ets < dt_start:
-                continue
-            if dt_end and ets > dt_end:
-                continue
-            filtered.append(e)
-    else:
-        filtered = events
+    # events are stored as naive UTC
+    statement = select(Event.ts, Event.machine_id, Event.payload).where(Event.type == 'production')
+    if dt_start is not None:
+        statement = statement.where(Event.ts >= dt_start.replace(tzinfo=None))
+    if dt_end is not None:
+        statement = statement.where(Event.ts <= dt_end.replace(tzinfo=None))
+
+    def partial(shard_session):
+        agg = {}
+        for ets, mid, raw in shard_session.execute(statement):
+            try:
+                payload = json.loads(raw) if raw else {}
+            except Exception:
+                payload = {}
+            rec = agg.get(mid) or {'produced': 0, 'good': 0, 'last_ts': None}
+            rec['produced'] += int(payload.get('produced', 0))
+            rec['good'] += int(payload.get('good', 0))
+            if ets is not None and (rec['last_ts'] is None or ets > rec['last_ts']):
+                rec['last_ts'] = ets
+            agg[mid] = rec
+        return agg
 
+    # each event shard aggregates its own events; merge the partial results
     agg = {}
-    for e in filtered:
-        try:
-            payload = json.loads(e.payload) if e.payload else {}
-        except Exception:
-            payload = {}
-        src = e.source
-        produced = int(payload.get('produced', 0))
-        good = int(payload.get('good', 0))
-        rec = agg.get(src) or {'produced': 0, 'good': 0, 'last_ts': None}
-        rec['produced'] += produced
-        rec['good'] += good
-        # last_ts in UTC ISO
-        ets = e.ts
-        if ets is not None:
-            if ets.tzinfo is None:
-                ets = ets.replace(tzinfo=timezone.utc)
-            else:
-                ets = ets.astimezone(timezone.utc)
-            rec['last_ts'] = ets.isoformat()
-        else:
-            rec['last_ts'] = None
-        agg[src] = rec
-
-    result = []
-    for src, v in agg.items():
-        result.append({'machine': src, 'produced': v['produced'], 'good': v['good'], 'last_ts': v['last_ts']})
-    return result
+    for part in shards.gather(session, partial):
+        for mid, v in part.items():
+            rec = agg.get(mid)
+            if rec is None:
+                agg[mid] = v
+                continue
+            rec['produced'] += v['produced']
+            rec['good'] += v['good']
+            if v['last_ts'] is not None and (rec['last_ts'] is None or v['last_ts'] > rec['last_ts']):
+                rec['last_ts'] = v['last_ts']
+
+    # last_ts is naive UTC; rows.dumps writes it as UTC ISO
+    labels = sources.directory.labels(session)
+    result = [{'machine': labels.get(mid) or str(mid), 'produced': v['produced'], 'good': v['good'], 'last_ts': v['last_ts']}
+              for mid, v in agg.items()]
+    return json_response(result, _etag)
+
+
+@router.get('/cycle_time', response_model=CycleTimeReport)
+def cycle_time_percentiles(
+    start: str = Query(..., description='start ISO datetime (rounded down to the hour)'),
+    end: str = Query(..., description='end ISO datetime'),
+    machines: Optional[List[str]] = Query(None, description='machine labels (code, else name); all machines when omitted'),
+    session: Session = Depends(get_read_session),
+    user=Depends(get_current_user),
+):
+    """Cycle-time percentiles merged from the hourly per-machine sketches.
+
+    Values are within SKETCH_RELATIVE_ACCURACY of the exact percentiles.
+    """
+    try:
+        dt_start = datetime.fromisoformat(start)
+        dt_end = datetime.fromisoformat(end)
+    except Exception:
+        raise HTTPException(status_code=400, detail='start/end must be ISO datetimes')
+    if dt_start.tzinfo is not None:
+        dt_start = dt_start.astimezone(timezone.utc).replace(tzinfo=None)
+    if dt_end.tzinfo is not None:
+        dt_end = dt_end.astimezone(timezone.utc).replace(tzinfo=None)
+    if dt_end <= dt_start:
+        raise HTTPException(status_code=400, detail='end must be after start')
+
+    sketch = sketches.merged_sketch(session, dt_start, dt_end, machines)
+    return CycleTimeReport(
+        machines=machines or [],
+        start=dt_start.replace(tzinfo=timezone.utc).isoformat(),
+        end=dt_end.replace(tzinfo=timezone.utc).isoformat(),
+        count=int(sketch.count),
+        relative_accuracy=sketch.relative_accuracy,
+        min_ms=sketch.min if sketch.count else None,
+        p50_ms=sketch.quantile(0.5),
+        p95_ms=sketch.quantile(0.95),
+        p99_ms=sketch.quantile(0.99),
+        max_ms=sketch.max if sketch.count else None,
+    )
+
+
+@router.get('/kpi', response_model=List[KpiSnapshotRead])
+def kpi_history(
+    start: str = Query(..., description='start ISO datetime'),
+    end: str = Query(..., description='end ISO datetime'),
+    granularity: str = Query('1h', description='1h or shift'),
+    machines: Optional[List[str]] = Query(None, description='machine labels (code, else name); all machines when omitted'),
+    session: Session = Depends(get_read_session),
+    user=Depends(get_current_user),
+    _etag=Depends(conditional('kpi')),
+):
+    """Stored KPI snapshots for buckets starting in [start, end), oldest first.
+
+    Only closed buckets are materialized (see `app.kpi`); use `/reports/oee`
+    for the current, still open period.
+    """
+    try:
+        dt_start = datetime.fromisoformat(start)
+        dt_end = datetime.fromisoformat(end)
+    except Exception:
+        raise HTTPException(status_code=400, detail='start/end must be ISO datetimes')
+    if dt_start.tzinfo is not None:
+        dt_start = dt_start.astimezone(timezone.utc).replace(tzinfo=None)
+    if dt_end.tzinfo is not None:
+        dt_end = dt_end.astimezone(timezone.utc).replace(tzinfo=None)
+    if dt_end <= dt_start:
+        raise HTTPException(status_code=400, detail='end must be after start')
+    if granularity not in kpi.GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(kpi.GRANULARITIES)}")
+
+    stmt = select(
+        KpiSnapshot.source.label('machine_id'), KpiSnapshot.bucket, KpiSnapshot.planned_seconds,
+        KpiSnapshot.downtime_seconds, KpiSnapshot.run_seconds, KpiSnapshot.produced, KpiSnapshot.good,
+        KpiSnapshot.availability, KpiSnapshot.performance, KpiSnapshot.quality, KpiSnapshot.oee,
+    ).where(
+        KpiSnapshot.granularity == granularity, KpiSnapshot.bucket >= dt_start, KpiSnapshot.bucket < dt_end)
+    if machines:
+        stmt = stmt.where(KpiSnapshot.source.in_(machines))
+    stmt = stmt.order_by(KpiSnapshot.bucket, KpiSnapshot.source)
+    return rows_response(session.execute(stmt), _etag)
+
+
+@router.get('/export/{dataset}')
+def export_dataset(
+    dataset: str,
+    format: str = Query('parquet', description='parquet or arrow'),
+    start: Optional[str] = Query(None, description='start ISO datetime'),
+    end: Optional[str] = Query(None, description='end ISO datetime (exclusive)'),
+    sources: Optional[List[str]] = Query(None, description='machine labels (code, else name); all when omitted'),
+    resolution: Optional[str] = Query(None, description='rollup resolution (production) or 1h/shift (kpi); ignored for events'),
+    user=Depends(get_current_user),
+):
+    """Download events, production rollups or KPI snapshots as one Parquet/Arrow file (see `app.export`)."""
+    if dataset not in export.DATASETS:
+        raise HTTPException(status_code=404, detail=f"dataset must be one of {', '.join(export.DATASETS)}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export.FORMATS)}")
+    dt_start = ingest.parse_ts(start)
+    dt_end = ingest.parse_ts(end)
+    if (start and dt_start is None) or (end and dt_end is None):
+        raise HTTPException(status_code=400, detail='start/end must be ISO datetimes')
+    # events have no resolution; it is ignored there
+    allowed = {'production': rollups.RESOLUTIONS, 'kpi': kpi.GRANULARITIES}.get(dataset)
+    if resolution is not None and allowed is not None and resolution not in allowed:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(allowed)}")
+    export.require_pyarrow()
+
+    def body():
+        # the request's session is gone by the time the body streams
+        with Session(replicas.pick()) as session:
+            yield from export.stream(session, dataset, format, dt_start, dt_end, sources, resolution)
+
+    suffix, media_type = export.FORMATS[format]
+    return StreamingResponse(body(), media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="{dataset}{suffix}"'})
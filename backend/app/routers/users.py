@@ -2,13 +2,14 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session, select
 from typing import List
 
-from ..db import get_session
+from ..db import get_session, get_read_session
 from ..models import User
 from ..schemas import UserRead
 from ..auth import get_current_user
 from ..schemas import UserUpdate
 from ..auth import get_password_hash
 from ..schemas import UserCreate
+from ..rows import rows_response
 from fastapi import Body
 
 router = APIRouter()
@@ -34,13 +35,12 @@ def update_current_user(payload: UserUpdate, session: Session = Depends(get_sess
 
 
 @router.get("/", response_model=List[UserRead])
-def list_users(session: Session = Depends(get_session), current=Depends(get_current_user)):
+def list_users(session: Session = Depends(get_read_session), current=Depends(get_current_user)):
     # For demo, restrict to role 'admin'
     if current.role != 'admin':
         raise HTTPException(status_code=403, detail="Forbidden")
-    statement = select(User)
-    users = session.exec(statement).all()
-    return [UserRead(id=u.id, username=u.username, full_name=u.full_name, role=u.role) for u in users]
+    statement = select(User.id, User.username, User.full_name, User.role)
+    return rows_response(session.execute(statement))
 
 
 @router.post('/', response_model=UserRead)
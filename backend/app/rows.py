@@ -0,0 +1,50 @@
+"""Plain-row read path for listings and reports.
+
+Listing and report endpoints select only the columns they return and write
+the rows straight to JSON bytes - no ORM instances, identity map or per-row
+pydantic validation. They keep their `response_model` for the OpenAPI
+schema (FastAPI does not validate a returned `Response`), so each select
+must produce exactly the documented fields.
+
+orjson is used when installed, the standard json module otherwise; either
+way naive datetimes are written as UTC ISO strings (``...+00:00``).
+"""
+import json
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NAIVE_UTC)
+    return json.dumps(content, default=_default, separators=(',', ':')).encode()
+
+
+def json_response(content, etag: Optional[str] = None) -> Response:
+    """`content` as JSON bytes.
+
+    Headers set on the injected Response are not copied onto a returned
+    one, so pass the ETag from `conditional()` here.
+    """
+    return Response(content=dumps(content), media_type='application/json', headers={'ETag': etag} if etag else None)
+
+
+def rows_response(result, etag: Optional[str] = None) -> Response:
+    """A column select's result as a list of objects keyed by column name."""
+    keys = list(result.keys())
+    return json_response([dict(zip(keys, row)) for row in result], etag)
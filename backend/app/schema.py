@@ -0,0 +1,80 @@
+"""Schema preparation at worker startup and readiness state.
+
+SCHEMA_MODE selects what a worker does on boot:
+
+- ``create_all`` - create missing tables from the models (local SQLite demo)
+- ``check`` - compare the database's Alembic revision with the head of
+  `alembic/versions`; migrations are applied once by the entrypoint, never by
+  the workers themselves
+- ``skip`` - do nothing
+
+The head revision is read by scanning the revision files (no Alembic import)
+and cached for the life of the process.
+"""
+import logging
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+
+from .core.config import settings
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_DIR = Path(__file__).resolve().parents[1] / "alembic" / "versions"
+_REVISION_RE = re.compile(r"^(down_revision|revision)\s*=\s*['\"]?([\w]+)?['\"]?", re.MULTILINE)
+
+state = {'schema_ok': False, 'current': None}
+
+
+@lru_cache(maxsize=None)
+def head_revision() -> Optional[str]:
+    revisions = set()
+    parents = set()
+    for path in VERSIONS_DIR.glob("*.py"):
+        found = dict(_REVISION_RE.findall(path.read_text(encoding="utf-8")))
+        if found.get('revision'):
+            revisions.add(found['revision'])
+        if found.get('down_revision') and found['down_revision'] != 'None':
+            parents.add(found['down_revision'])
+    heads = revisions - parents
+    if len(heads) != 1:
+        logger.warning("expected one alembic head, found %s", sorted(heads))
+        return None
+    return heads.pop()
+
+
+def current_revision(engine) -> Optional[str]:
+    with engine.connect() as conn:
+        try:
+            return conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+        except Exception:
+            return None
+
+
+def check(engine) -> bool:
+    """Refresh `state` from the database; cheap enough to call from a readiness probe."""
+    if settings.SCHEMA_MODE != 'check':
+        state['schema_ok'] = True
+        return True
+    current = current_revision(engine)
+    state['current'] = current
+    state['schema_ok'] = current is not None and current == head_revision()
+    return state['schema_ok']
+
+
+def prepare(engine) -> None:
+    """Run the configured SCHEMA_MODE; called once per worker on startup."""
+    if settings.SCHEMA_MODE == 'create_all':
+        from sqlmodel import SQLModel
+        from . import models  # noqa: F401  register tables
+
+        SQLModel.metadata.create_all(engine)
+        from .shards import init_tables
+
+        init_tables()
+    if not check(engine):
+        logger.error("database revision %s does not match alembic head %s; run `alembic upgrade head`",
+                     state['current'], head_revision())
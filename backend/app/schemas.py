@@ -1,5 +1,6 @@
-from typing import Optional
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from typing import List, Optional
+from pydantic import BaseModel, field_serializer
 
 
 class Token(BaseModel):
@@ -40,6 +41,7 @@ class MachineRead(BaseModel):
     name: str
     code: Optional[str]
     status: str
+    auto_registered: bool = False
 
 
 class OrderCreate(BaseModel):
@@ -48,6 +50,7 @@ class OrderCreate(BaseModel):
     quantity: int
     priority: Optional[int] = 1
     status: Optional[str] = 'pending'
+    machine_id: Optional[int] = None
 
 
 class OrderRead(BaseModel):
@@ -57,6 +60,29 @@ class OrderRead(BaseModel):
     quantity: int
     priority: int
     status: str
+    machine_id: Optional[int] = None
+    started_at: Optional[datetime] = None
+    progress: int = 0
+    eta: Optional[datetime] = None
+
+    @field_serializer('started_at', 'eta')
+    def utc_iso(self, value: Optional[datetime]):
+        # stored naive UTC; written like the plain-row listings (app.rows)
+        if value is None:
+            return None
+        return (value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value).isoformat()
+
+
+class OrderEta(BaseModel):
+    order_id: int
+    order_number: str
+    machine_id: int
+    quantity: int
+    progress: int
+    remaining: int
+    rate_per_hour: Optional[float]
+    last_event_at: Optional[str]
+    eta: Optional[str]
 
 
 class EventCreate(BaseModel):
@@ -74,6 +100,21 @@ class EventRead(BaseModel):
     payload: Optional[dict]
 
 
+class BulkIngestResult(BaseModel):
+    inserted: int
+
+
+class BatchItem(BaseModel):
+    id: str
+    # path with optional query string, e.g. "/reports/oee?machine_id=P1&start=...&end=..."
+    path: str
+    if_none_match: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+
 class OEEReport(BaseModel):
     machine_id: str
     start: str
@@ -85,3 +126,59 @@ class OEEReport(BaseModel):
     performance: float
     quality: float
     oee: float
+
+
+class KpiSnapshotRead(BaseModel):
+    machine_id: str
+    bucket: str
+    planned_seconds: float
+    downtime_seconds: float
+    run_seconds: float
+    produced: int
+    good: int
+    availability: float
+    performance: float
+    quality: float
+    oee: float
+
+
+class CycleTimeReport(BaseModel):
+    machines: List[str]
+    start: str
+    end: str
+    count: int
+    relative_accuracy: float
+    min_ms: Optional[float]
+    p50_ms: Optional[float]
+    p95_ms: Optional[float]
+    p99_ms: Optional[float]
+    max_ms: Optional[float]
+
+
+class AlertRead(BaseModel):
+    id: int
+    ts: str
+    source: str
+    kind: str
+    value: float
+    baseline_mean: float
+    baseline_std: float
+    score: float
+    acknowledged: bool
+
+
+class GatewayKeyCreate(BaseModel):
+    name: str
+    sources: List[str] = []
+
+
+class GatewayKeyRead(BaseModel):
+    id: int
+    name: str
+    prefix: str
+    sources: List[str]
+    active: bool
+
+
+class GatewayKeyCreated(GatewayKeyRead):
+    key: str
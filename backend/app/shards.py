@@ -0,0 +1,224 @@
+"""Event storage sharded by machine.
+
+With EVENT_SHARD_URLS set, raw events live in the `event` table of those
+databases instead of the primary. Each machine id is mapped to one shard by
+consistent hashing (EVENT_SHARD_VNODES points per shard on a 64-bit ring,
+keyed by the shard URL without its password), so adding a shard moves only
+about 1/n of the machines. Everything derived from events - rollups, sketches,
+alerts, KPI snapshots - stays on the primary.
+
+- ingest splits a batch per shard and writes the parts concurrently, each in
+  its own transaction; a batch that fails on one shard may already be stored
+  on the others
+- event ids are per shard, so (machine_id, id) identifies an event
+- readers use `partitions` (streaming, shard by shard), `gather` (the same
+  query on every shard concurrently, results merged by the caller) or
+  `session_for` (the one shard owning a machine)
+
+With no shard URLs the primary is the only shard and every helper simply uses
+the caller's session, so nothing changes for a single database. Shard
+databases are not managed by Alembic; create the table with
+``python -m app.shards init`` (SCHEMA_MODE=create_all does it on startup; it
+also converts tables from before migration 0012 to machine ids) and move
+machines to their new owner after changing the shard list with
+``python -m app.shards rebalance``.
+"""
+import bisect
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import column, delete, insert, inspect, make_url, table, text, update
+from sqlalchemy.schema import CreateTable
+from sqlmodel import Session, create_engine, select
+
+from .core.config import settings
+from .db import configure_sqlite, engine
+from .models import Event
+
+# what is stored of an ingest row; `source` is only carried for the derived tables
+EVENT_COLUMNS = ('ts', 'machine_id', 'type', 'payload')
+
+
+def event_values(rows: List[dict]) -> List[dict]:
+    return [{c: row[c] for c in EVENT_COLUMNS} for row in rows]
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class ShardRing:
+    def __init__(self, primary, urls: List[str], vnodes: int):
+        self.sharded = bool(urls)
+        self.engines = [configure_sqlite(create_engine(url, echo=False)) for url in urls] or [primary]
+        points = []
+        for i, url in enumerate(urls):
+            name = make_url(url).set(password=None).render_as_string(hide_password=False)
+            points.extend((ring_hash(f"{name}#{v}"), i) for v in range(vnodes))
+        points.sort()
+        self._keys = [p for p, _ in points]
+        self._owners = [i for _, i in points]
+        self._cache: Dict[int, int] = {}
+        self._pool = ThreadPoolExecutor(max_workers=len(self.engines), thread_name_prefix='shard') if self.sharded else None
+
+    def index_for(self, machine_id: int) -> int:
+        i = self._cache.get(machine_id)
+        if i is None:
+            if not self.sharded:
+                return 0
+            pos = bisect.bisect(self._keys, ring_hash(str(machine_id))) % len(self._keys)
+            i = self._cache[machine_id] = self._owners[pos]
+        return i
+
+    def engine_for(self, machine_id: int):
+        return self.engines[self.index_for(machine_id)]
+
+    def insert(self, rows: List[dict], returning: bool = False) -> Optional[list]:
+        """Write rows to their shards concurrently; returns (id, ts) in input order with `returning`."""
+        parts: Dict[int, List[int]] = {}
+        for pos, row in enumerate(rows):
+            parts.setdefault(self.index_for(row['machine_id']), []).append(pos)
+
+        def write(item):
+            index, positions = item
+            with Session(self.engines[index]) as session:
+                part = event_values([rows[p] for p in positions])
+                if returning:
+                    stmt = insert(Event).returning(Event.id, Event.ts, sort_by_parameter_order=True)
+                    found = session.execute(stmt, part).all()
+                else:
+                    session.execute(insert(Event), part)
+                    found = None
+                session.commit()
+            return positions, found
+
+        results = list(self._pool.map(write, parts.items()))
+        if not returning:
+            return None
+        out = [None] * len(rows)
+        for positions, found in results:
+            for p, value in zip(positions, found):
+                out[p] = value
+        return out
+
+    def gather(self, session: Session, fn: Callable[[Session], object]) -> list:
+        """Run `fn(session)` on every shard concurrently; one result per shard."""
+        if not self.sharded:
+            return [fn(session)]
+
+        def run(eng):
+            with Session(eng) as shard_session:
+                return fn(shard_session)
+
+        return list(self._pool.map(run, self.engines))
+
+    def partitions(self, session: Session, stmt, chunk: int):
+        """Stream the rows of `stmt` from every shard in lists of up to `chunk` rows."""
+        if not self.sharded:
+            yield from session.execute(stmt.execution_options(yield_per=chunk)).partitions()
+            return
+        for eng in self.engines:
+            with Session(eng) as shard_session:
+                yield from shard_session.execute(stmt.execution_options(yield_per=chunk)).partitions()
+
+    @contextmanager
+    def session_for(self, session: Session, machine_id: int):
+        """Session on the shard holding `machine_id`'s events."""
+        if not self.sharded:
+            yield session
+            return
+        with Session(self.engine_for(machine_id)) as shard_session:
+            yield shard_session
+
+
+shards = ShardRing(engine, settings.EVENT_SHARD_URLS, settings.EVENT_SHARD_VNODES)
+
+
+def init_tables() -> None:
+    """Create or upgrade the event table on every shard.
+
+    Shards have no machine table, so the machine_id foreign key is left out;
+    tables from before machine ids are converted (see `upgrade_table`).
+    """
+    if not shards.sharded:
+        return
+    event = Event.__table__
+    for eng in shards.engines:
+        with eng.begin() as conn:
+            conn.execute(CreateTable(event, if_not_exists=True, include_foreign_key_constraints=[]))
+        upgrade_table(eng)
+        with eng.begin() as conn:
+            for index in event.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def upgrade_table(eng, batch: int = 10000) -> None:
+    """Give a shard's pre-0012 event table machine ids (registering unknown sources) and drop `source`."""
+    from .sources import directory
+
+    columns = {c['name'] for c in inspect(eng).get_columns('event')}
+    if 'source' not in columns:
+        return
+    if 'machine_id' not in columns:
+        with eng.begin() as conn:
+            conn.execute(text("ALTER TABLE event ADD COLUMN machine_id INTEGER"))
+    legacy = table('event', column('id'), column('source'), column('machine_id'))
+    with eng.connect() as conn:
+        pending = conn.execute(select(legacy.c.source).where(legacy.c.machine_id.is_(None)).distinct()).scalars().all()
+    if pending:
+        with Session(engine) as session:
+            ids = directory.resolve(session, pending, register=True)
+        for source, mid in ids.items():
+            while True:
+                with eng.begin() as conn:
+                    chunk = select(legacy.c.id).where(legacy.c.source == source, legacy.c.machine_id.is_(None)).limit(batch)
+                    count = conn.execute(update(legacy).where(legacy.c.id.in_(chunk.scalar_subquery()))
+                                         .values(machine_id=mid)).rowcount
+                if count < batch:
+                    break
+    with eng.begin() as conn:
+        conn.execute(text("ALTER TABLE event DROP COLUMN source"))
+
+
+def rebalance(chunk: int = 5000) -> int:
+    """Move every machine's events to the shard that owns it now; returns moved rows."""
+    moved = 0
+    for index, eng in enumerate(shards.engines):
+        with Session(eng) as session:
+            machine_ids = session.exec(select(Event.machine_id).distinct()).all()
+        for machine_id in machine_ids:
+            owner = shards.index_for(machine_id)
+            if owner == index:
+                continue
+            with Session(eng) as src, Session(shards.engines[owner]) as dst:
+                stmt = select(Event.ts, Event.machine_id, Event.type, Event.payload).where(Event.machine_id == machine_id)
+                for part in src.execute(stmt.execution_options(yield_per=chunk)).partitions():
+                    dst.execute(insert(Event), [dict(r._mapping) for r in part])
+                    moved += len(part)
+                # commit the copy before dropping the originals
+                dst.commit()
+                src.execute(delete(Event).where(Event.machine_id == machine_id))
+                src.commit()
+    return moved
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Manage event shards')
+    parser.add_argument('command', choices=['init', 'rebalance', 'status'])
+    args = parser.parse_args()
+    if args.command == 'init':
+        init_tables()
+        print(f'event table ready on {len(shards.engines)} shard(s)')
+    elif args.command == 'rebalance':
+        print(f'{rebalance()} events moved')
+    else:
+        from sqlalchemy import func
+
+        for eng in shards.engines:
+            with Session(eng) as session:
+                count = session.exec(select(func.count()).select_from(Event)).one()
+            print(eng.url.render_as_string(hide_password=True), count)
@@ -0,0 +1,216 @@
+"""Mergeable cycle-time quantile sketches.
+
+`DDSketch` keeps counts in logarithmic buckets, so any quantile is returned
+within `relative_accuracy` of the true value and two sketches merge by adding
+bucket counts. At ingest, cycle times (`cycle_time_ms`, falling back to
+`ideal_cycle_time_ms`) are folded into one sketch per (source, hour) stored
+in `CycleTimeSketch`; reports merge those over any range and machine set.
+"""
+import json
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from .core.config import settings
+from .db import dialect_insert
+from .models import CycleTimeSketch, Event
+from .rollups import floor_ts
+from .shards import shards
+from .sources import labelled
+
+MIN_VALUE = 1e-9
+# rebuilds write sketches back whenever this many (source, hour) keys are pending
+FLUSH_SKETCHES = 10_000
+
+
+class DDSketch:
+    def __init__(self, relative_accuracy: Optional[float] = None, max_bins: Optional[int] = None):
+        self.relative_accuracy = relative_accuracy or settings.SKETCH_RELATIVE_ACCURACY
+        self.max_bins = max_bins or settings.SKETCH_MAX_BINS
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, float] = {}
+        self.zero_count = 0.0
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (1 + self.gamma)
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        if value <= MIN_VALUE:
+            self.zero_count += weight
+        else:
+            k = self.key(value)
+            self.bins[k] = self.bins.get(k, 0.0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'DDSketch') -> None:
+        if other.count == 0:
+            return
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different relative accuracy")
+        for k, c in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0.0) + c
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _collapse(self) -> None:
+        # fold the lowest buckets together; upper quantiles keep full accuracy
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        target = keys[excess]
+        self.bins[target] += sum(self.bins.pop(k) for k in keys[:excess])
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        acc = self.zero_count
+        for k in sorted(self.bins):
+            acc += self.bins[k]
+            if acc > rank:
+                return min(max(self.value(k), self.min), self.max)
+        return self.max
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'a': self.relative_accuracy, 'bins': {str(k): c for k, c in self.bins.items()},
+            'zero': self.zero_count, 'n': self.count,
+            'min': self.min if self.count else None, 'max': self.max if self.count else None,
+        })
+
+    @classmethod
+    def from_json(cls, text: Optional[str]) -> 'DDSketch':
+        if not text:
+            return cls()
+        data = json.loads(text)
+        sketch = cls(relative_accuracy=data['a'])
+        sketch.bins = {int(k): c for k, c in data['bins'].items()}
+        sketch.zero_count = data['zero']
+        sketch.count = data['n']
+        if data['min'] is not None:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        return sketch
+
+
+def cycle_times(payload: Optional[dict]) -> List[tuple]:
+    """(cycle time in ms, count) pairs of a payload; compacted records carry a histogram."""
+    if payload and 'cycle_times' in payload:
+        return [(float(value), count) for value, count in payload['cycle_times'].items()]
+    value = cycle_time_ms(payload)
+    return [(value, 1)] if value is not None else []
+
+
+def cycle_time_ms(payload: Optional[dict]) -> Optional[float]:
+    if not payload:
+        return None
+    value = payload.get('cycle_time_ms') or payload.get('ideal_cycle_time_ms')
+    try:
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def apply(session: Session, rows: Iterable[dict]) -> None:
+    """Merge cycle times from newly inserted event rows into the stored hourly sketches."""
+    batch: Dict[tuple, DDSketch] = {}
+    fold(batch, rows)
+    store(session, batch)
+
+
+def fold(batch: Dict[tuple, DDSketch], rows: Iterable[dict]) -> None:
+    """Add the cycle times of `rows` to in-memory sketches keyed by (source, hour)."""
+    for row in rows:
+        if row['type'] != 'production':
+            continue
+        payload = row['payload']
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except Exception:
+                continue
+        values = cycle_times(payload)
+        if not values:
+            continue
+        key = (row['source'], floor_ts(row['ts'], '1h'))
+        sketch = batch.get(key)
+        if sketch is None:
+            sketch = batch[key] = DDSketch()
+        for value, count in values:
+            sketch.add(value, count)
+
+
+def store(session: Session, batch: Dict[tuple, DDSketch]) -> None:
+    """Merge in-memory sketches into the stored rows."""
+    if not batch:
+        return
+    ensure_rows(session, list(batch))
+    for (source, hour), sketch in batch.items():
+        stmt = select(CycleTimeSketch).where(CycleTimeSketch.source == source, CycleTimeSketch.hour == hour).with_for_update()
+        stored = session.exec(stmt).one()
+        merged = DDSketch.from_json(stored.sketch)
+        merged.merge(sketch)
+        stored.sketch = merged.to_json()
+        stored.count = int(merged.count)
+        session.add(stored)
+    session.flush()
+
+
+def ensure_rows(session: Session, keys: List[tuple]) -> None:
+    """Create empty sketch rows for missing keys without racing other writers."""
+    stmt = dialect_insert(session)(CycleTimeSketch.__table__).on_conflict_do_nothing(index_elements=['source', 'hour'])
+    session.execute(stmt, [{'source': s, 'hour': h, 'count': 0, 'sketch': ''} for s, h in keys])
+
+
+def merged_sketch(session: Session, start: datetime, end: datetime, sources: Optional[List[str]] = None) -> DDSketch:
+    """Merge the hourly sketches for hours starting in [floor(start), end)."""
+    stmt = select(CycleTimeSketch.sketch).where(CycleTimeSketch.hour >= floor_ts(start, '1h'), CycleTimeSketch.hour < end)
+    if sources:
+        stmt = stmt.where(CycleTimeSketch.source.in_(sources))
+    result = DDSketch()
+    for text in session.exec(stmt):
+        result.merge(DDSketch.from_json(text))
+    return result
+
+
+def rebuild(session: Session, start: Optional[datetime] = None, end: Optional[datetime] = None, chunk: int = 5000) -> None:
+    """Recompute sketches from raw events, for everything or for the hours covering [start, end)."""
+    drop = delete(CycleTimeSketch)
+    stmt = select(Event.ts, Event.machine_id, Event.type, Event.payload).where(Event.type == 'production')
+    if start is not None:
+        start = floor_ts(start, '1h')
+        drop = drop.where(CycleTimeSketch.hour >= start)
+        stmt = stmt.where(Event.ts >= start)
+    if end is not None:
+        if floor_ts(end, '1h') < end:
+            end = floor_ts(end, '1h') + timedelta(hours=1)
+        drop = drop.where(CycleTimeSketch.hour < end)
+        stmt = stmt.where(Event.ts < end)
+    session.execute(drop)
+    batch: Dict[tuple, DDSketch] = {}
+    for part in shards.partitions(session, stmt, chunk):
+        fold(batch, labelled(session, part))
+        # merge into the table only when many hours are pending, not once per chunk
+        if len(batch) >= FLUSH_SKETCHES:
+            store(session, batch)
+            batch.clear()
+    store(session, batch)
@@ -0,0 +1,133 @@
+"""Dictionary encoding of event sources into machine ids.
+
+Events store only `machine_id`, the id of the `Machine` whose code (or,
+failing that, name) equals the source string the gateway sent. The ingest
+path resolves sources through an in-memory directory (code/name -> id)
+instead of querying per batch; each worker reloads it when the ``machines``
+data version changes, checking at most every SOURCE_REFRESH_SECONDS.
+
+Readers turn ids back into the machine's label - its code, or its name when
+it has none - with the same directory (`labels`, `labelled`); shard
+databases have no machine table to join. Ingest rewrites each row's
+`source` to that label too, so rollups, sketches, downtime intervals,
+alerts and KPI snapshots are keyed the same way whichever spelling a
+gateway used.
+
+Unknown sources are registered as new machines (name and code = source,
+flagged `auto_registered` and left out of ``GET /machines/``) when
+AUTO_REGISTER_SOURCES is on; otherwise a batch naming one is rejected with
+422.
+"""
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from .caching import bump_version, get_version
+from .core.config import settings
+from .db import engine
+from .models import Machine
+
+VERSION_NAME = 'machines'
+
+
+class SourceDirectory:
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._labels: Dict[int, str] = {}
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        self._checked = 0.0
+        self._version = None
+
+    def _load(self, session: Session) -> None:
+        ids = {}
+        machines = session.exec(select(Machine.id, Machine.name, Machine.code)).all()
+        for mid, name, _ in machines:
+            ids.setdefault(name, mid)
+        # codes win over names
+        for mid, _, code in machines:
+            if code:
+                ids[code] = mid
+        self._ids = ids
+        self._labels = {mid: code or name for mid, name, code in machines}
+
+    def _refresh(self, session: Session) -> None:
+        now = time.monotonic()
+        if now - self._checked < settings.SOURCE_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if now - self._checked < settings.SOURCE_REFRESH_SECONDS:
+                return
+            version = get_version(session, VERSION_NAME)
+            if version != self._version:
+                self._load(session)
+                self._version = version
+            self._checked = now
+
+    def lookup(self, session: Session, source: str) -> Optional[int]:
+        self._refresh(session)
+        return self._ids.get(source)
+
+    def known(self, source: str) -> Optional[int]:
+        """Like `lookup`, against the directory already loaded, without touching the database."""
+        return self._ids.get(source)
+
+    def labels(self, session: Session) -> Dict[int, str]:
+        """Machine id -> label (code, else name)."""
+        self._refresh(session)
+        return self._labels
+
+    def resolve(self, session: Session, sources: Iterable[str], register: Optional[bool] = None) -> Dict[str, int]:
+        """Machine id per source, registering unknown sources when enabled (default AUTO_REGISTER_SOURCES)."""
+        self._refresh(session)
+        found = {s: self._ids.get(s) for s in set(sources)}
+        missing = [s for s, mid in found.items() if mid is None]
+        if missing:
+            if not (settings.AUTO_REGISTER_SOURCES if register is None else register):
+                raise HTTPException(status_code=422, detail=f"Unknown sources: {', '.join(sorted(missing)[:20])}")
+            found.update(self._register(missing))
+        return found
+
+    def _register(self, sources) -> Dict[str, int]:
+        # own short transaction on the primary so the caller's batch is not held up behind it
+        with Session(engine) as session:
+            if session.get_bind().dialect.name == 'postgresql':
+                # one registrar at a time per source, so concurrent workers don't create duplicates
+                for source in sorted(sources):
+                    session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': zlib.crc32(source.encode())})
+            existing = session.exec(select(Machine.id, Machine.code).where(Machine.code.in_(sources))).all()
+            ids = {code: mid for mid, code in existing}
+            for source in sources:
+                if source not in ids:
+                    machine = Machine(name=source, code=source, auto_registered=True)
+                    session.add(machine)
+                    session.flush()
+                    ids[source] = machine.id
+            bump_version(session, VERSION_NAME)
+            session.commit()
+        with self._lock:
+            self._ids.update(ids)
+            self._labels.update({mid: source for source, mid in ids.items()})
+        return ids
+
+
+directory = SourceDirectory()
+
+
+def labelled(session: Session, rows) -> List[dict]:
+    """Event rows selected with `machine_id` as dicts that also carry the machine label as `source`."""
+    labels = directory.labels(session)
+    out = []
+    for row in rows:
+        item = dict(row._mapping)
+        item['source'] = labels.get(item['machine_id']) or str(item['machine_id'])
+        out.append(item)
+    return out
@@ -0,0 +1,145 @@
+"""Single writer thread for event ingest on SQLite.
+
+SQLite allows one writer at a time. With every `/events/bulk` request and the
+line listener inserting through their own sessions, concurrent batches queue
+on the database lock and fail with "database is locked" once busy_timeout
+runs out. On SQLite (and SQLITE_SINGLE_WRITER) these inserts are instead
+handed to one thread that owns all event writes: it takes the next batch,
+coalesces whatever else is already queued (up to SQLITE_WRITER_MAX_ROWS
+rows) and stores it with a single `ingest.insert_rows` call and one commit.
+Callers block on a future for their own part of the result. If a coalesced
+transaction fails, its batches are retried one by one, so a bad batch only
+fails its own request.
+
+Reads are not involved: with the WAL journal (see `db.configure_sqlite`)
+they run in parallel with the writer on their own connections. Other writes
+(orders, KPI runs, compaction) still use their own sessions and wait on
+busy_timeout; they are rare next to ingest.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import List, Optional
+
+from sqlmodel import Session
+
+from .core.config import settings
+from .db import engine
+from . import ingest
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Job:
+    __slots__ = ('rows', 'returning', 'future')
+
+    def __init__(self, rows: List[dict], returning: bool):
+        self.rows = rows
+        self.returning = returning
+        self.future: Future = Future()
+
+
+class Writer:
+    def __init__(self, eng):
+        self.engine = eng
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.stats = {'batches': 0, 'transactions': 0, 'rows': 0, 'retried': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.SQLITE_SINGLE_WRITER and self.engine.dialect.name == 'sqlite'
+
+    def submit(self, rows: List[dict], returning: bool = False) -> Future:
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='sqlite-writer', daemon=True)
+                self.thread.start()
+        job = Job(rows, returning)
+        self.queue.put(job)
+        return job.future
+
+    def insert(self, rows: List[dict], returning: bool = False):
+        """Store rows through the writer thread and wait; same result as `ingest.insert_rows`."""
+        return self.submit(rows, returning).result()
+
+    def snapshot(self) -> dict:
+        return {'enabled': self.enabled, 'queued': self.queue.qsize(), **self.stats}
+
+    def stop(self) -> None:
+        """Finish queued batches and end the thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(_STOP)
+            thread.join()
+
+    def run(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is _STOP:
+                return
+            jobs = [job]
+            size = len(job.rows)
+            stop = False
+            while size < settings.SQLITE_WRITER_MAX_ROWS:
+                try:
+                    more = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is _STOP:
+                    stop = True
+                    break
+                jobs.append(more)
+                size += len(more.rows)
+            self.write(jobs)
+            if stop:
+                return
+
+    def write(self, jobs: List[Job]) -> None:
+        try:
+            results = self.store(jobs)
+        except Exception as exc:
+            if len(jobs) == 1:
+                jobs[0].future.set_exception(exc)
+                return
+            logger.warning("coalesced write of %d batches failed; retrying them one by one", len(jobs))
+            self.stats['retried'] += len(jobs)
+            for job in jobs:
+                self.write([job])
+            return
+        for job, result in zip(jobs, results):
+            job.future.set_result(result)
+
+    def store(self, jobs: List[Job]) -> list:
+        rows = [row for job in jobs for row in job.rows]
+        returning = any(job.returning for job in jobs)
+        with Session(self.engine) as session:
+            inserted = ingest.insert_rows(session, rows, returning=returning)
+            session.commit()
+        self.stats['transactions'] += 1
+        self.stats['batches'] += len(jobs)
+        self.stats['rows'] += len(rows)
+        results = []
+        at = 0
+        for job in jobs:
+            part = inserted[at:at + len(job.rows)] if returning else None
+            results.append(part if job.returning else None)
+            at += len(job.rows)
+        return results
+
+
+writer = Writer(engine)
+
+
+def insert_events(session: Session, rows: List[dict], returning: bool = False):
+    """Insert and commit an ingest batch; through the writer thread on SQLite, else on `session`."""
+    if writer.enabled:
+        return writer.insert(rows, returning)
+    result = ingest.insert_rows(session, rows, returning=returning)
+    session.commit()
+    return result
@@ -21,4 +21,13 @@ api.interceptors.request.use((cfg) => {
   return cfg
 })
 
+// Several GETs in one round-trip via POST /batch; resolves to { id: { status, data } }
+export async function batchGet(paths) {
+  const requests = Object.entries(paths).map(([id, path]) => ({ id, path }))
+  const res = await api.post('/batch/', { requests })
+  const out = {}
+  res.data.responses.forEach(r => { out[r.id] = { status: r.status, data: r.body } })
+  return out
+}
+
 export default api
@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from 'react'
 import { Chart as ChartJS, CategoryScale, LinearScale, PointElement, LineElement, BarElement, Title, Tooltip, Legend, ArcElement } from 'chart.js'
 import { Line, Doughnut, Bar } from 'react-chartjs-2'
-import api from '../api'
+import { batchGet } from '../api'
 
 ChartJS.register(CategoryScale, LinearScale, PointElement, LineElement, BarElement, Title, Tooltip, Legend, ArcElement)
 
@@ -17,12 +17,24 @@ export default function Dashboard() {
   useEffect(() => {
     async function load() {
       try {
-        const orders = await api.get('/orders/')
-        const machines = await api.get('/machines/')
+        // one round-trip for everything the dashboard shows
+        const res = await batchGet({
+          orders: '/orders/',
+          machines: '/machines/',
+          metrics: '/reports/metrics/production',
+          trend: '/reports/production_trend',
+          ordersStatus: '/reports/orders_status',
+        })
+        const need = (id) => {
+          if (res[id].status >= 400) throw new Error(`${id}: HTTP ${res[id].status}`)
+          return res[id]
+        }
+        const orders = need('orders')
+        const machines = need('machines')
         // /events/bulk is a POST-only endpoint; use production metrics instead
         let productionMetrics = { data: [] }
         try {
-          productionMetrics = await api.get('/reports/metrics/production')
+          productionMetrics = need('metrics')
         } catch (e) {
           console.warn('Failed to load production metrics', e)
         }
@@ -62,7 +74,7 @@ export default function Dashboard() {
 
         // Production time series: try real trend, fallback to demo
         try {
-          const trend = await api.get('/reports/production_trend')
+          const trend = need('trend')
           const labels = trend.data.map(t => new Date(t.hour).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }))
           const values = trend.data.map(t => t.produced)
           setChartData({ labels, datasets: [{ label: 'Production (units/hour)', data: values, borderColor: 'rgb(75, 192, 192)', backgroundColor: 'rgba(75, 192, 192, 0.1)', tension: 0.4 }] })
@@ -78,7 +90,7 @@ export default function Dashboard() {
 
         // Orders by status
         try {
-          const s = await api.get('/reports/orders_status')
+          const s = need('ordersStatus')
           const labels = s.data.map(x => x.status)
           const values = s.data.map(x => x.count)
           setOrdersStatus({ labels, data: values })
@@ -1,19 +1,172 @@
+#!/usr/bin/env python3
+"""Extract text from the project PDFs into data/pdf_texts.
+
+Pages of all changed PDFs are extracted in a process pool, in chunks of
+PAGES_PER_TASK, and streamed to disk in page order as chunks complete, so a
+document is never joined in memory as a whole; only twice as many chunks as
+workers are in flight at a time. A manifest (data/pdf_texts/manifest.json) records
+size, mtime and SHA-256 of every source PDF; unchanged files are skipped
+(use --force to re-extract everything), and entries of deleted PDFs are
+dropped with their text. The search index is refreshed
+afterwards (see pdf_search.py).
+
+Usage: python scripts/extract_pdfs.py [--force] [--workers N]
+"""
+import argparse
+import hashlib
+import json
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+
 from PyPDF2 import PdfReader
 
 SRC_DIR = Path(__file__).resolve().parents[1] / "Описание проекта"
 OUT_DIR = Path(__file__).resolve().parents[1] / "data" / "pdf_texts"
-OUT_DIR.mkdir(parents=True, exist_ok=True)
+MANIFEST = OUT_DIR / "manifest.json"
+PAGES_PER_TASK = 8
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def extract_pages(args):
+    """Worker: return the text of pages [start, end) of one PDF."""
+    path, start, end = args
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or '' for i in range(start, end)]
 
-for pdf in SRC_DIR.glob('*.pdf'):
+
+def load_manifest() -> dict:
     try:
-        reader = PdfReader(str(pdf))
-        text = []
-        for p in reader.pages:
-            text.append(p.extract_text() or '')
+        return json.loads(MANIFEST.read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def changed_pdfs(manifest: dict, force: bool):
+    """Yield (pdf, stat, sha256) for PDFs whose content differs from the manifest."""
+    for pdf in sorted(SRC_DIR.glob('*.pdf')):
+        st = pdf.stat()
+        entry = manifest.get(pdf.name)
         out_file = OUT_DIR / (pdf.stem + '.txt')
-        out_file.write_text('\n'.join(text), encoding='utf-8')
-        print(f'Extracted: {pdf.name} -> {out_file}')
-    except Exception as e:
-        print(f'Failed to extract {pdf.name}: {e}')
+        if not force and entry and out_file.exists():
+            if entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                continue
+            digest = file_sha256(pdf)
+            if entry['sha256'] == digest:
+                # touched but identical: remember the new mtime and skip
+                entry['mtime_ns'] = st.st_mtime_ns
+                continue
+        else:
+            digest = file_sha256(pdf)
+        yield pdf, st, digest
+
+
+def chunks(todo):
+    """Yield (job, start, end) page ranges of the changed PDFs, in file and page order."""
+    for pdf, st, digest in todo:
+        try:
+            pages = len(PdfReader(str(pdf)).pages)
+        except Exception as e:
+            print(f'Failed to extract {pdf.name}: {e}')
+            continue
+        job = {'pdf': pdf, 'st': st, 'digest': digest, 'pages': pages, 'out': None, 'error': None}
+        # a PDF without pages still gets its (empty) text file
+        for i in range(0, pages, PAGES_PER_TASK) if pages else [0]:
+            yield job, i, min(i + PAGES_PER_TASK, pages)
+
+
+def write_chunk(job: dict, texts, end: int, manifest: dict) -> bool:
+    """Append one chunk to its PDF's text; returns True when the PDF is complete."""
+    pdf = job['pdf']
+    out_file = OUT_DIR / (pdf.stem + '.txt')
+    tmp_file = out_file.with_suffix('.txt.tmp')
+    if job['out'] is None:
+        job['out'] = open(tmp_file, 'w', encoding='utf-8')
+        job['first'] = True
+    for text in texts:
+        if not job['first']:
+            job['out'].write('\n')
+        job['out'].write(text)
+        job['first'] = False
+    if end < job['pages']:
+        return False
+    job['out'].close()
+    tmp_file.replace(out_file)
+    st = job['st']
+    manifest[pdf.name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': job['digest'],
+                          'pages': job['pages'], 'text': out_file.name}
+    print(f'Extracted: {pdf.name} -> {out_file}')
+    return True
+
+
+def fail(job: dict, error) -> None:
+    job['error'] = error
+    if job['out'] is not None:
+        job['out'].close()
+    (OUT_DIR / (job['pdf'].stem + '.txt.tmp')).unlink(missing_ok=True)
+    print(f"Failed to extract {job['pdf'].name}: {error}")
+
+
+def prune(manifest: dict) -> int:
+    """Drop manifest entries (and their text files) of PDFs no longer in SRC_DIR."""
+    present = {pdf.name for pdf in SRC_DIR.glob('*.pdf')}
+    removed = [name for name in manifest if name not in present]
+    for name in removed:
+        (OUT_DIR / manifest.pop(name).get('text', Path(name).stem + '.txt')).unlink(missing_ok=True)
+    return len(removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--force', action='store_true', help='re-extract every PDF')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='extraction processes')
+    args = parser.parse_args()
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest()
+    todo = list(changed_pdfs(manifest, args.force))
+    total = len(list(SRC_DIR.glob('*.pdf')))
+    extracted = 0
+    # chunks in flight: enough to keep every worker busy (also across small files), few enough
+    # that finished text does not pile up in memory ahead of the writer
+    window = max(args.workers, 1) * 2
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        pending = deque()
+        queued = chunks(todo)
+        while True:
+            while len(pending) < window:
+                nxt = next(queued, None)
+                if nxt is None:
+                    break
+                job, start, end = nxt
+                pending.append((job, end, pool.submit(extract_pages, (str(job['pdf']), start, end))))
+            if not pending:
+                break
+            # write chunks in page order as they finish; each is dropped once written
+            job, end, future = pending.popleft()
+            if job['error'] is not None:
+                continue
+            try:
+                extracted += write_chunk(job, future.result(), end, manifest)
+            except Exception as e:
+                fail(job, e)
+
+    removed = prune(manifest)
+    MANIFEST.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding='utf-8')
+    print(f'{extracted} extracted, {len(todo) - extracted} failed, {total - len(todo)} unchanged, {removed} removed')
+
+    from pdf_search import build_index
+    build_index()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Inverted full-text index over data/pdf_texts.
+
+The index (data/pdf_texts/index.json) maps each lowercased word to the
+documents and line numbers it occurs on. Building is incremental: only text
+files whose size/mtime changed are re-tokenized. Queries match documents
+containing every term; a trailing ``*`` makes a term a prefix match.
+
+Usage:
+    python scripts/pdf_search.py --build
+    python scripts/pdf_search.py "оптимизация производств*"
+"""
+import argparse
+import bisect
+import json
+import math
+import re
+from pathlib import Path
+
+TEXT_DIR = Path(__file__).resolve().parents[1] / "data" / "pdf_texts"
+INDEX_FILE = TEXT_DIR / "index.json"
+WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str):
+    return WORD_RE.findall(text.lower().replace('ё', 'е'))
+
+
+def load_index() -> dict:
+    try:
+        return json.loads(INDEX_FILE.read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return {'docs': {}, 'postings': {}}
+
+
+def build_index() -> dict:
+    index = load_index()
+    docs, postings = index['docs'], index['postings']
+    current = {p.name: p for p in TEXT_DIR.glob('*.txt')}
+    stale = []
+    for name in list(docs):
+        st = current[name].stat() if name in current else None
+        if st is None or docs[name]['size'] != st.st_size or docs[name]['mtime_ns'] != st.st_mtime_ns:
+            stale.append(name)
+    fresh = [name for name in current if name not in docs or name in stale]
+    if stale:
+        drop = set(stale)
+        for token in list(postings):
+            entry = {d: lines for d, lines in postings[token].items() if d not in drop}
+            if entry:
+                postings[token] = entry
+            else:
+                del postings[token]
+        for name in stale:
+            docs.pop(name, None)
+    for name in fresh:
+        path = current[name]
+        st = path.stat()
+        lines = 0
+        with open(path, encoding='utf-8') as f:
+            for lineno, line in enumerate(f, start=1):
+                lines = lineno
+                for token in set(tokenize(line)):
+                    postings.setdefault(token, {}).setdefault(name, []).append(lineno)
+        docs[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'lines': lines}
+    if stale or fresh:
+        INDEX_FILE.write_text(json.dumps(index, ensure_ascii=False), encoding='utf-8')
+    print(f'Index: {len(docs)} documents, {len(postings)} terms ({len(fresh)} (re)indexed)')
+    return index
+
+
+def expand(term: str, tokens: list) -> list:
+    if not term.endswith('*'):
+        return [term]
+    prefix = term[:-1]
+    start = bisect.bisect_left(tokens, prefix)
+    out = []
+    for token in tokens[start:]:
+        if not token.startswith(prefix):
+            break
+        out.append(token)
+    return out
+
+
+def search(query: str, index: dict, limit: int = 10):
+    """Return [(document, score, [line numbers])] for documents matching every term."""
+    postings = index['postings']
+    n_docs = max(len(index['docs']), 1)
+    tokens = sorted(postings)
+    terms = [t + '*' if raw.endswith('*') else t for raw in query.split() for t in tokenize(raw)]
+    scores, hits = None, {}
+    for term in terms:
+        term_docs = {}
+        for token in expand(term, tokens):
+            for doc, lines in postings.get(token, {}).items():
+                term_docs.setdefault(doc, set()).update(lines)
+        idf = math.log(n_docs / (1 + len(term_docs))) + 1
+        term_scores = {doc: len(lines) * idf for doc, lines in term_docs.items()}
+        scores = term_scores if scores is None else {d: s + term_scores[d] for d, s in scores.items() if d in term_scores}
+        for doc, lines in term_docs.items():
+            hits.setdefault(doc, set()).update(lines)
+    ranked = sorted((scores or {}).items(), key=lambda kv: -kv[1])[:limit]
+    return [(doc, score, sorted(hits[doc])) for doc, score in ranked]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('query', nargs='?', help='words to search for')
+    parser.add_argument('--build', action='store_true', help='(re)build the index before searching')
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    index = build_index() if args.build or not INDEX_FILE.exists() else load_index()
+    if not args.query:
+        return
+    for doc, score, lines in search(args.query, index, args.limit):
+        print(f'{doc}  (score {score:.2f})')
+        text = (TEXT_DIR / doc).read_text(encoding='utf-8').splitlines()
+        for lineno in lines[:3]:
+            print(f'  {lineno}: {text[lineno - 1].strip()[:120]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Send synthetic line-protocol events to the backend's TCP listener.
+
+Usage: python scripts/send_lines.py API_KEY [count] [host] [port]
+"""
+import random
+import socket
+import sys
+import time
+
+
+def main():
+    key = sys.argv[1]
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    host = sys.argv[3] if len(sys.argv) > 3 else 'localhost'
+    port = int(sys.argv[4]) if len(sys.argv) > 4 else 8094
+
+    with socket.create_connection((host, port)) as s:
+        s.sendall(f'AUTH {key}\n'.encode())
+        start = time.time()
+        batch = []
+        for i in range(total):
+            produced = random.randint(1, 5)
+            good = produced - (1 if random.random() < 0.05 else 0)
+            batch.append(f'M-A,production,{time.time():.3f},produced={produced},good={good},ideal_cycle_time_ms=800\n')
+            if len(batch) == 1000:
+                s.sendall(''.join(batch).encode())
+                batch = []
+        if batch:
+            s.sendall(''.join(batch).encode())
+        print(f'Sent {total} lines in {time.time() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Upgrade check: migrate a database holding events from the baseline to head.
+
+Creates the baseline schema (0001) in an empty scratch database, stores
+events from machines reported both by name and by code plus an unknown
+source, steps through the revisions that backfill derived data (adding KPI
+snapshots and alerts keyed by the raw spellings on the way, as the app did
+then) and upgrades to head. Then it checks that:
+
+- machines the migrations registered for unknown sources are flagged
+  `auto_registered` (hidden from ``GET /machines/``), the others are not
+- every derived table is keyed by machine label (code, else name) and holds
+  what the app's own rebuilds compute from the migrated events
+
+Run from ``backend/`` against an empty scratch database::
+
+    DATABASE_URL=sqlite:////tmp/upgrade_check.db python ../scripts/upgrade_check.py
+
+The exit status is 1 when a check fails.
+"""
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/upgrade_check.db')
+
+from alembic import command  # noqa: E402
+from alembic.config import Config  # noqa: E402
+from sqlalchemy import DateTime, bindparam, text  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+from app.db import engine  # noqa: E402
+from app import downtime, kpi, rollups, schema, sketches  # noqa: E402
+
+START = datetime(2025, 6, 2, 6)
+HOURS = 6
+# source spelling -> machine it belongs to (None: unknown, registered by the migration)
+SOURCES = {'Press 1': 'P1', 'P1': 'P1', 'Lathe': 'Lathe', 'UNKNOWN-GW': None}
+LABELS = {'P1', 'Lathe', 'UNKNOWN-GW'}
+
+
+def alembic_config() -> Config:
+    config = Config(str(BACKEND / 'alembic.ini'))
+    config.set_main_option('script_location', str(BACKEND / 'alembic'))
+    config.set_main_option('sqlalchemy.url', os.environ['DATABASE_URL'])
+    return config
+
+
+def seed_baseline(conn) -> None:
+    conn.execute(text("INSERT INTO machine (name, code, status) VALUES ('Press 1', 'P1', 'idle'), ('Lathe', NULL, 'idle')"))
+    rng = random.Random(3)
+    rows = []
+    for source in SOURCES:
+        for minute in range(HOURS * 60):
+            ts = START + timedelta(minutes=minute, seconds=rng.random() * 59)
+            payload = {'produced': rng.randint(1, 9), 'good': rng.randint(0, 1), 'ideal_cycle_time_ms': 900,
+                       'cycle_time_ms': rng.uniform(800, 1400)}
+            rows.append({'ts': ts, 'source': source, 'type': 'production', 'payload': json.dumps(payload)})
+            if minute % 47 == 5:
+                # both spellings of P1 report overlapping stops
+                rows.append({'ts': ts, 'source': source, 'type': 'downtime',
+                             'payload': json.dumps({'duration_seconds': rng.randint(60, 900)})})
+    conn.execute(text("INSERT INTO event (ts, source, type, payload) VALUES (:ts, :source, :type, :payload)")
+                 .bindparams(bindparam('ts', type_=DateTime())), rows)
+
+
+def seed_alerts(conn) -> None:
+    conn.execute(text(
+        "INSERT INTO alert (ts, source, kind, value, baseline_mean, baseline_std, score, acknowledged) "
+        "VALUES (:ts, :source, 'produced', 50, 5, 1, 45, :ack)").bindparams(bindparam('ts', type_=DateTime())),
+        [{'ts': START, 'source': source, 'ack': False} for source in SOURCES])
+
+
+def seed_snapshots(conn) -> None:
+    """Hourly snapshots per raw spelling, computed from the rollups and intervals as the app did before 0012."""
+    rows = []
+    for bucket, source, produced, good, ict_sum_ms, ict_count in conn.execute(text(
+            "SELECT bucket, source, produced, good, ict_sum_ms, ict_count FROM productionrollup WHERE resolution = '1h'")):
+        bucket = bucket if isinstance(bucket, datetime) else datetime.fromisoformat(bucket)
+        hi = bucket + timedelta(hours=1)
+        stops = conn.execute(text('SELECT start, "end" FROM downtimeinterval WHERE source = :s AND "end" > :lo AND start < :hi')
+                             .bindparams(bindparam('lo', type_=DateTime()), bindparam('hi', type_=DateTime())),
+                             {'s': source, 'lo': bucket, 'hi': hi}).all()
+        down = sum((min(as_dt(e), hi) - max(as_dt(s), bucket)).total_seconds() for s, e in stops)
+        metrics = kpi.oee_metrics(3600.0, down, produced, good, ict_sum_ms / 1000.0, ict_count)
+        rows.append({'granularity': '1h', 'source': source, 'bucket': bucket, 'planned_seconds': 3600.0,
+                     'downtime_seconds': down, 'produced': produced, 'good': good, 'ict_sum_ms': ict_sum_ms,
+                     'ict_count': ict_count, 'computed_at': START, **metrics})
+    conn.execute(text(
+        "INSERT INTO kpisnapshot (granularity, source, bucket, planned_seconds, downtime_seconds, run_seconds, produced, "
+        "good, ict_sum_ms, ict_count, availability, performance, quality, oee, computed_at) VALUES (:granularity, "
+        ":source, :bucket, :planned_seconds, :downtime_seconds, :run_seconds, :produced, :good, :ict_sum_ms, "
+        ":ict_count, :availability, :performance, :quality, :oee, :computed_at)").bindparams(
+            bindparam('bucket', type_=DateTime()), bindparam('computed_at', type_=DateTime())), rows)
+
+
+def as_dt(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def normalized(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, str) and value.startswith('{'):
+        data = json.loads(value)
+        data['bins'] = {k: round(v, 6) for k, v in data['bins'].items()}
+        return json.dumps({k: round(v, 6) if isinstance(v, float) else v for k, v in data.items()}, sort_keys=True)
+    if isinstance(value, str) and len(value) >= 19 and value[4] == '-' and value[10] == ' ':
+        return as_dt(value)
+    return value
+
+
+def table_state(conn, table: str, columns: str) -> set:
+    return {tuple(normalized(v) for v in row) for row in conn.execute(text(f'SELECT {columns} FROM {table}'))}
+
+
+DERIVED = {
+    'productionrollup': 'resolution, bucket, source, produced, good, ict_sum_ms, ict_count, events',
+    'cycletimesketch': 'source, hour, count, sketch',
+    'downtimeinterval': 'source, machine_id, start, "end"',
+    'kpisnapshot': 'granularity, source, bucket, downtime_seconds, run_seconds, produced, good, ict_sum_ms, '
+                   'ict_count, availability, performance, quality, oee',
+}
+
+
+def main() -> int:
+    if schema.current_revision(engine) is not None:
+        print(f'{engine.url.render_as_string(hide_password=True)} is not empty; point DATABASE_URL at a scratch database',
+              file=sys.stderr)
+        return 2
+    config = alembic_config()
+    command.upgrade(config, '0001_create_tables')
+    with engine.begin() as conn:
+        seed_baseline(conn)
+    command.upgrade(config, '0005_alert')
+    with engine.begin() as conn:
+        seed_alerts(conn)
+    command.upgrade(config, '0011_downtime_interval')
+    with engine.begin() as conn:
+        seed_snapshots(conn)
+    command.upgrade(config, 'head')
+
+    failures = []
+    with engine.connect() as conn:
+        flags = dict(conn.execute(text('SELECT name, auto_registered FROM machine')).all())
+        expected = {'Press 1': False, 'Lathe': False, 'UNKNOWN-GW': True}
+        if {name: bool(flag) for name, flag in flags.items()} != expected:
+            failures.append(f'auto_registered flags {flags}, expected {expected}')
+        migrated = {table: table_state(conn, table, columns) for table, columns in DERIVED.items()}
+        alerts = {row[0] for row in conn.execute(text('SELECT source FROM alert'))}
+    if alerts != LABELS:
+        failures.append(f'alerts keyed by {sorted(alerts)}')
+    for table, rows in migrated.items():
+        keys = {row[columns.split(', ').index('source')] for row in rows
+                for columns in [DERIVED[table]]}
+        if keys != LABELS:
+            failures.append(f'{table} keyed by {sorted(keys)}, expected {sorted(LABELS)}')
+
+    # what the current app computes from the migrated events
+    end = START + timedelta(hours=HOURS + 1)
+    with Session(engine) as session:
+        rollups.rebuild(session)
+        sketches.rebuild(session)
+        downtime.rebuild(session)
+        kpi.store(session, '1h', START, end)
+        session.commit()
+    with engine.connect() as conn:
+        for table, columns in DERIVED.items():
+            rebuilt = table_state(conn, table, columns)
+            if rebuilt != migrated[table]:
+                failures.append(f'{table}: {len(migrated[table] - rebuilt)} migrated rows differ from a rebuild '
+                                f'(e.g. {sorted(migrated[table] - rebuilt, key=str)[:1]} vs '
+                                f'{sorted(rebuilt - migrated[table], key=str)[:1]})')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if not failures:
+        print('ok   upgrade from 0001 with events: machines flagged, derived tables keyed by label and consistent')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())